@@ -8,12 +8,12 @@ One camera run at a time.
 The livestream and pixel value histogram can all be displayed.
 
 Known issue:
-The window sizes of the livestream and histogram are default. Need adjustment every time it appears.
 """
 
 import sys
 sys.path.append('/home/dbg/Desktop/camera_control_scripts/target_workbench')
 import os
+import pathlib
 import argparse
 import logging
 from logging import critical, error, info, warning, debug
@@ -26,9 +26,13 @@ from pypylon import pylon, genicam
 
 from mhbasler.camconfig import jsonLoadFunc, RealTimeFileLoader
 from mhbasler.camconfig import pickRequiredCameras, setCamParams
-from mhbasler.livestream import singleCamlivestream
+from mhbasler.camconfig import CamProfileCache, setCamParamsCached
+from mhbasler.livestream import singleCamlivestream, arrayMosaicLivestream
+from mhbasler.monitor import arrayMtfMonitor
+from mhbasler.intrinsics import loadIntrinsics, UndistortMapCache
 from mhbasler.grab import enableChunk, disableChunk, chunkGrabOne, saveChunkOne
 from target_toolbox.aruco_marker import ARUCO_DICT_TYPE
+from target_toolbox.aruco_sine_chart import prepare_chart_metas
 
 ########################################
 ### Argument parsing and logging setup
@@ -42,24 +46,88 @@ def parseArguments():
                  description='Display livestreams from a Basler camera array, one camera at a time',
                  epilog='Accept following keyboard inputs to the livestream window: ' + \
                         '0-6 to select camera; ' + \
-                        's to save snapshot (with overlays); ' + \
-                        'f to save frame (no overlays); ' + \
+                        'm for mosaic of all cameras; ' + \
+                        'p to toggle binned/decimated preview; ' + \
+                        's to save snapshot (with overlays, full resolution); ' + \
+                        'f to save full resolution frame (no overlays, undistorted with --undistort); ' + \
                         'ESC to quit.', 
                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-p', '--params', type=str, default='array_params.json',
                         help='The json file holding the array camera parameters.')
+    parser.add_argument('--profile_dir', type=str, default='cam_profiles',
+                        help='Folder caching configured camera profiles, keyed by the hash of each camera\'s parameters.')
+    parser.add_argument('--userset', nargs='+', type=str, default=None,
+                        help='Cache profiles in these camera UserSets (e.g. UserSet1 UserSet2) instead of feature files.')
+    parser.add_argument('--no_profile', dest='use_profile', action='store_false',
+                        help='Disable the camera profile cache, always set parameters one by one.')
     parser.add_argument('--fps', dest='show_fps', action='store_true',
                         help='Enable livestream fps display.')
+    parser.add_argument('--display_fps', type=float, default=30.0,
+                        help='Maximum render rate of the livestream window. Grabbing runs independently.')
+    parser.add_argument('--window_width', type=int, default=1280,
+                        help='Initial livestream window width. Frames are downscaled to the window before drawing.')
+    parser.add_argument('--mosaic', action='store_true',
+                        help='Start with the mosaic of all cameras instead of camera 0.')
+    parser.add_argument('--bandwidth', type=float, default=300.0,
+                        help='Total bandwidth budget of the mosaic in MB/s. Camera frame rates are capped to fit.')
+    parser.add_argument('--tile_width', type=int, default=640,
+                        help='Width of each camera tile in the mosaic, in pixels.')
+    parser.add_argument('--preview', type=int, default=None,
+                        help='Start in preview mode, binning/decimating the sensor by this factor on the camera.')
+    parser.add_argument('--preview_mode', type=str, choices=['binning', 'decimation'], default='binning',
+                        help='How the camera reduces resolution in preview mode.')
     parser.add_argument('--aruco', dest='detect_aruco', action='store_true',
                         help='Enable ArUco marker detection')
+    parser.add_argument('--aruco_scale', type=float, default=None,
+                        help='Search ArUco markers on the frame downscaled by this ratio (e.g. 0.25), ' \
+                            +'then refine corners at full resolution. Default full resolution search.')
+    parser.add_argument('--aruco_track', type=int, default=None,
+                        help='Track ArUco markers, only search around their last location. ' \
+                            +'A full frame search every this amount of frames, or when a marker is lost.')
     parser.add_argument('--sine', dest='detect_aruco_sine', action='store_true',
                         help='Enable ArUco-Sine chart detection')
     parser.add_argument('--sine_params', type=str, default='aruco_sine_chart_params.json',
                         help='The json file holding the ArUco-Sine chart parameters.')
+    parser.add_argument('--mtf_workers', type=int, default=None,
+                        help='Analyze ArUco-Sine charts asynchronously in this amount of processes. ' \
+                            +'Default analyze every frame in the display loop.')
+    parser.add_argument('--raw_bayer', action='store_true',
+                        help='With --sine, keep frames of Bayer color cameras raw instead of converting to Mono8. ' \
+                            +'Markers are found on a green plane, and the MTF of each color plane is shown.')
+    parser.add_argument('--field_map', type=float, default=None,
+                        help='With --sine, accumulate the MTF at this lp/mm of all charts seen into a heatmap ' \
+                            +'over the field. Press c to clear it.')
+    parser.add_argument('--field_bin', type=int, default=64,
+                        help='Bin size of the field MTF map in frame pixels.')
+    parser.add_argument('--mtf_avg', type=int, default=None,
+                        help='Average the MTF of each chart over its last this amount of results, ' \
+                            +'shown with a 95%% confidence band. Default no averaging.')
+    parser.add_argument('--intrinsics', type=str, default=None,
+                        help='The json file holding the camera intrinsics, keyed by SN. With it, the 3D tilt ' \
+                            +'of each marker is shown, and only charts tilted no more than --max_tilt are analyzed. ' \
+                            +'Default none, or intrinsics.json next to the parameter file with --undistort.')
+    parser.add_argument('--max_tilt', type=float, default=10.0,
+                        help='Largest chart tilt in degrees accepted for MTF analysis, with --intrinsics.')
+    parser.add_argument('--undistort', type=str, choices=['frame', 'roi'], default=None,
+                        help='Undistort by the intrinsics, every frame (frame), or only the charts for their ' \
+                            +'analysis (roi). Frame grabs are undistorted in both. Default not undistorted.')
+    parser.add_argument('--map_dir', type=str, default='undistort_maps',
+                        help='Folder caching the undistortion maps, keyed by SN, ROI and intrinsics.')
+    parser.add_argument('--monitor', type=str, default=None,
+                        help='Headless MTF monitoring instead of livestream, records saved to this .bin file. ' \
+                            +'Needs --sine. Plot it with mtf_monitor_plot.py.')
+    parser.add_argument('--monitor_interval', type=float, default=10.0,
+                        help='Seconds between two monitoring samples of all cameras.')
+    parser.add_argument('--monitor_duration', type=float, default=None,
+                        help='Monitoring duration in seconds. Default until ctrl+c.')
     parser.add_argument('--hist', dest='show_hist', action='store_true',
                         help='Enable pixel value histogram.')
     parser.add_argument('--bins', type=int, default=50,
                         help='Histogram bin amount.')
+    parser.add_argument('--hist_rate', type=float, default=5.0,
+                        help='Histogram refresh rate in Hz.')
+    parser.add_argument('--hist_stride', type=int, default=8,
+                        help='Histogram pixel subsample stride.')
     parser.add_argument('-v', '--verbose', type=int, default=1,
                         help='Verbosity of logging: 0-critical, 1-error, 2-warning, 3-info, 4-debug')
     ### parse args
@@ -91,11 +159,14 @@ def main(args):
     else:
         converter.OutputPixelFormat = pylon.PixelType_BGR8packed
     converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
-    # open and initialize camera parameters
+    # open and initialize camera parameters, bulk-load cached profiles if possible
+    profileCache = None
+    if args.use_profile:
+        profileCache = CamProfileCache(args.profile_dir, args.userset)
     for cam in camList:
         cam.Open()
         params = arrayParams[cam.GetDeviceInfo().GetSerialNumber()]
-        setCamParams(cam, params, None)
+        setCamParamsCached(cam, params, profileCache)
     # histogram parameters
     hist_bins = None
     if args.show_hist:
@@ -109,19 +180,66 @@ def main(args):
     # ArUco-Sine detection parameters
     arucoSineMetas = None
     if args.detect_aruco_sine:
-        sineParamsLoader = RealTimeFileLoader(args.sine_params, jsonLoadFunc)
+        # source geometry of each chart is computed once at loading
+        sineParamsLoader = RealTimeFileLoader(args.sine_params, lambda plp: prepare_chart_metas(jsonLoadFunc(plp)))
         arucoSineMetas = sineParamsLoader.load()
+    # camera intrinsics for marker tilt and undistortion, next to the parameter file only with --undistort,
+    # as loading them also turns on tilt gating
+    intrinsics = {}
+    intrinsicsPath = args.intrinsics
+    if intrinsicsPath is None and args.undistort is not None \
+            and (pathlib.Path(args.params).parent / 'intrinsics.json').exists():
+        intrinsicsPath = pathlib.Path(args.params).parent / 'intrinsics.json'
+    if intrinsicsPath is not None:
+        intrinsics = loadIntrinsics(intrinsicsPath)
+        info('Intrinsics of {} cameras loaded from {}, charts tilted over {} degrees are not analyzed'.format(
+            len(intrinsics), intrinsicsPath, args.max_tilt))
+        for cam in camList:
+            camSn = cam.GetDeviceInfo().GetSerialNumber()
+            if not camSn in intrinsics:
+                warning('No intrinsics of {} in {}, its charts are not tilt checked nor undistorted'.format(
+                    arrayParams[camSn]['name'], intrinsicsPath))
+    # undistortion maps, computed once per camera and ROI
+    undistortCache = None
+    if args.undistort is not None:
+        assert len(intrinsics) > 0, '--undistort needs --intrinsics, or intrinsics.json next to --params'
+        undistortCache = UndistortMapCache(args.map_dir)
 
+    ### headless monitoring, instead of livestream
+    if args.monitor is not None:
+        assert arucoSineMetas is not None, 'MTF monitoring needs --sine'
+        arrayMtfMonitor(camList, converter, arrayParams,
+                        aruco_detector, arucoSineMetas, args.monitor,
+                        interval=args.monitor_interval, duration=args.monitor_duration,
+                        arucoScale=args.aruco_scale,
+                        intrinsics=intrinsics, maxTilt=args.max_tilt)
     ### livestream cameras
-    # the outer loop: switch between cameras
-    camInd = 0
-    while camInd >= 0:
+    # the outer loop: switch between cameras and mosaic
+    camInd = -1 if args.monitor is not None else 'm' if args.mosaic else 0
+    while camInd != -1:
+        if camInd == 'm':
+            camInd, arrayParams = arrayMosaicLivestream(
+                camList, arrayParamsLoader, converter, arrayParams,
+                bandwidthBudget=args.bandwidth*1e6, tileWidth=args.tile_width,
+                showFps=args.show_fps,
+                previewFactor=args.preview, previewMode=args.preview_mode)
+            continue
         # the inner loop: grab, show, real-time configure
         camInd, arrayParams = singleCamlivestream(
             camList, arrayParamsLoader, converter,
             arrayParams, camInd,
             hist_bins, aruco_detector, 
-            args.show_fps, arucoSineMetas)
+            args.show_fps, arucoSineMetas,
+            displayFps=args.display_fps,
+            previewFactor=args.preview, previewMode=args.preview_mode,
+            windowWidth=args.window_width,
+            histRate=args.hist_rate, histStride=args.hist_stride,
+            arucoScale=args.aruco_scale, arucoTrackGap=args.aruco_track,
+            mtfWorkers=args.mtf_workers, mtfAvgFrames=args.mtf_avg,
+            rawBayer=args.raw_bayer and args.detect_aruco_sine,
+            fieldMapLpmm=args.field_map if args.detect_aruco_sine else None, fieldMapBin=args.field_bin,
+            intrinsics=intrinsics.get(camList[camInd].GetDeviceInfo().GetSerialNumber()), maxTilt=args.max_tilt,
+            undistortCache=undistortCache, undistortMode=args.undistort)
 
     ### cleanup
     # close cameras
@@ -0,0 +1,244 @@
+"""
+Codes to estimate the MTF of ArUco-Sine charts in captured frames, offline
+By Minghao, 2023 Mar
+
+Offline analysis logic:
+Frames saved by single_cam_cap.py / array_cam_cap.py live in '<camName>_<time>' folders, as '<frame>.png' with a '<frame>.json' of chunk data.
+All png frames under the given folders are listed, and analyzed in a process pool. Frames are sent to workers in chunks to cut the dispatch overhead.
+Each worker loads the chart parameters and builds its ArUco detector once, then detects markers and estimates the MTF of every known chart in a frame.
+Results are appended to one csv file as they come back, one row per sine tile: camera, frame, chart id, lpmm, MTF.
+Analyzed frames are appended to a done list next to the csv. A rerun skips them, so an interrupted run resumes where it stopped.
+When all frames are analyzed, the csv is also packed into an npz file.
+
+Known issue:
+Frames are analyzed at full resolution in grayscale. 16-bit frames are right shifted to 8-bit, raw Bayer frames need --bayer to be converted.
+"""
+
+import sys
+sys.path.append('/home/dbg/Desktop/camera_control_scripts/target_workbench')
+import os
+import re
+import csv
+import json
+import time
+import pathlib
+import argparse
+import logging
+from logging import critical, error, info, warning, debug
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2 as cv
+
+from target_toolbox.aruco_marker import ARUCO_DICT_TYPE
+from target_toolbox.aruco_sine_chart import analyze_aruco_sine_chart, prepare_chart_metas
+
+CSV_HEADER = ['camera', 'frame', 'chart', 'lpmm', 'mtf']
+BAYER_CODES = {'RG': cv.COLOR_BayerRG2GRAY, 'BG': cv.COLOR_BayerBG2GRAY,
+               'GR': cv.COLOR_BayerGR2GRAY, 'GB': cv.COLOR_BayerGB2GRAY}
+
+########################################
+### Argument parsing and logging setup
+########################################
+def parseArguments():
+    """
+    Read arguments from the command line
+    """
+    ### compose parser
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('folder_list', nargs='+', type=str,
+                        help='Capture folders, or folders holding capture folders. Searched recursively for png frames.')
+    parser.add_argument('--sine_params', type=str, default='aruco_sine_chart_params.json',
+                        help='The json file holding the ArUco-Sine chart parameters.')
+    parser.add_argument('-o', '--output', type=str, default='mtf_results.csv',
+                        help='Output csv file. The done list and npz file are saved next to it.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='Amount of worker processes.')
+    parser.add_argument('--chunksize', type=int, default=8,
+                        help='Amount of frames sent to a worker at a time.')
+    parser.add_argument('--bayer', type=str, choices=list(BAYER_CODES.keys()), default=None,
+                        help='Bayer pattern of raw color frames. Default frames are grayscale or BGR.')
+    parser.add_argument('--right_shift', type=int, default=8,
+                        help='Right shift of 16-bit frames to 8-bit. 8 for 4bit-left frames, 4 for 12-bit raw frames.')
+    parser.add_argument('--restart', action='store_true',
+                        help='Discard previous results and done list, analyze all frames again.')
+    parser.add_argument('-v', '--verbose', type=int, default=1,
+                        help='Verbosity of logging: 0-critical, 1-error, 2-warning, 3-info, 4-debug')
+    ### parse args
+    args = parser.parse_args()
+    ### set logging
+    vTable = {0: logging.CRITICAL, 1: logging.ERROR, 2: logging.WARNING,
+              3: logging.INFO, 4: logging.DEBUG}
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=vTable[args.verbose], stream=sys.stdout)
+
+    return args
+
+########################################
+### Frame listing
+########################################
+def listFrames(folderList):
+    """
+    Find all png frames under the folders
+    Return a sorted list of (camName, framePath)
+    camName is the capture folder name with its '_<time>' suffix removed
+    """
+    frameList = []
+    for folder in folderList:
+        for plp in sorted(pathlib.Path(folder).rglob('*.png')):
+            camName = re.sub(r'_\d{8}_\d{6}(\.\d+)?$', '', plp.parent.name)
+            frameList.append((camName, str(plp)))
+    return frameList
+
+def loadFrame(framePath, bayer=None, rightShift=8):
+    """
+    Load a saved frame as 8-bit grayscale
+    """
+    img = cv.imread(framePath, cv.IMREAD_UNCHANGED)
+    if img is None:
+        raise RuntimeError('Can not read frame {}'.format(framePath))
+    if img.dtype == np.uint16:
+        img = np.right_shift(img, rightShift).clip(0, 255).astype(np.uint8)
+    if img.ndim == 3:
+        img = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    elif bayer is not None:
+        img = cv.cvtColor(img, BAYER_CODES[bayer])
+    return img
+
+########################################
+### Worker side
+########################################
+_workerMetas = None
+_workerDetector = None
+_workerLoadArgs = None
+
+def _initWorker(sineParamsPath, bayer, rightShift):
+    """
+    Load the chart metas and build the ArUco detector once per worker
+    """
+    global _workerMetas, _workerDetector, _workerLoadArgs
+    with open(sineParamsPath, 'r') as fp: # no mhbasler import, pypylon is not needed offline
+        _workerMetas = prepare_chart_metas(json.load(fp))
+    arucoDict = cv.aruco.getPredefinedDictionary(ARUCO_DICT_TYPE)
+    _workerDetector = cv.aruco.ArucoDetector(arucoDict, cv.aruco.DetectorParameters())
+    _workerLoadArgs = (bayer, rightShift)
+
+def _analyzeFrame(frame):
+    """
+    Analyze all known charts in one frame
+    frame: (camName, framePath)
+    Return camName, framePath, and a list of (arucoIdx, lpmmList, mtfList)
+    """
+    camName, framePath = frame
+    resultList = []
+    try:
+        img = loadFrame(framePath, *_workerLoadArgs)
+    except Exception as e:
+        error('{}'.format(e))
+        return camName, framePath, resultList
+    cornerList, idList, _ = _workerDetector.detectMarkers(img)
+    if idList is None:
+        return camName, framePath, resultList
+    for arucoCorner, arucoIdx in zip(cornerList, np.reshape(idList, -1)):
+        arucoIdx = str(arucoIdx)
+        if not arucoIdx in _workerMetas:
+            continue
+        arucoCorner = np.array(arucoCorner, dtype=np.float32).reshape(4,2)
+        try:
+            _, lpmmList, mtfList = analyze_aruco_sine_chart(img, arucoCorner, _workerMetas[arucoIdx])
+        except Exception as e: # a chart partially out of frame may fail, keep others
+            error('Chart {} in {} analysis failed: {}'.format(arucoIdx, framePath, e))
+            continue
+        resultList.append((arucoIdx, [float(lpmm) for lpmm in lpmmList], [float(mtf) for mtf in mtfList]))
+    return camName, framePath, resultList
+
+########################################
+### Results
+########################################
+def loadDoneList(donePath, csvPath):
+    """
+    Read the frames already analyzed
+    Rows of frames missing from the done list (interrupted between writing rows and marking done) are dropped
+    """
+    doneSet = set()
+    if os.path.exists(donePath):
+        with open(donePath, 'r') as fp:
+            doneSet = set(line.rstrip('\n') for line in fp if line.strip())
+    if os.path.exists(csvPath):
+        with open(csvPath, 'r', newline='') as fp:
+            rowList = list(csv.DictReader(fp))
+        keptList = [row for row in rowList if row['frame'] in doneSet]
+        if len(keptList) < len(rowList):
+            warning('{} rows of unfinished frames dropped from {}'.format(len(rowList)-len(keptList), csvPath))
+            with open(csvPath, 'w', newline='') as fp:
+                writer = csv.DictWriter(fp, CSV_HEADER)
+                writer.writeheader()
+                writer.writerows(keptList)
+    return doneSet
+
+def csvToNpz(csvPath, npzPath):
+    """
+    Pack the csv results into an npz file of column arrays
+    """
+    with open(csvPath, 'r', newline='') as fp:
+        rowList = list(csv.DictReader(fp))
+    np.savez(npzPath,
+             camera=np.array([row['camera'] for row in rowList], dtype=str),
+             frame=np.array([row['frame'] for row in rowList], dtype=str),
+             chart=np.array([int(row['chart']) for row in rowList], dtype=int),
+             lpmm=np.array([float(row['lpmm']) for row in rowList], dtype=float),
+             mtf=np.array([float(row['mtf']) for row in rowList], dtype=float))
+    return len(rowList)
+
+########################################
+### Main function
+########################################
+def main(args):
+    ### Initialize
+    csvPath = args.output
+    stem = os.path.splitext(csvPath)[0]
+    donePath, npzPath = stem + '_done.txt', stem + '.npz'
+    if args.restart:
+        for path in [csvPath, donePath, npzPath]:
+            if os.path.exists(path):
+                os.remove(path)
+    # list frames, skip the analyzed ones
+    frameList = listFrames(args.folder_list)
+    doneSet = loadDoneList(donePath, csvPath)
+    todoList = [frame for frame in frameList if not frame[1] in doneSet]
+    print('{} frames found, {} analyzed before, {} to go'.format(
+        len(frameList), len(frameList)-len(todoList), len(todoList)))
+
+    ### analyze in a process pool, write results as they come back
+    newCsv = not os.path.exists(csvPath)
+    startTime = time.perf_counter()
+    rowAmount = 0
+    with open(csvPath, 'a', newline='') as csvFp, open(donePath, 'a') as doneFp, \
+         ProcessPoolExecutor(args.workers, initializer=_initWorker,
+                             initargs=(args.sine_params, args.bayer, args.right_shift)) as pool:
+        writer = csv.writer(csvFp)
+        if newCsv:
+            writer.writerow(CSV_HEADER)
+        for count, (camName, framePath, resultList) in enumerate(
+                pool.map(_analyzeFrame, todoList, chunksize=args.chunksize), 1):
+            for arucoIdx, lpmmList, mtfList in resultList:
+                writer.writerows([camName, framePath, arucoIdx, lpmm, mtf] for lpmm, mtf in zip(lpmmList, mtfList))
+                rowAmount += len(lpmmList)
+            # rows first, then mark done
+            csvFp.flush()
+            doneFp.write(framePath + '\n')
+            doneFp.flush()
+            # progress
+            if count % args.chunksize == 0 or count == len(todoList):
+                elapsed = time.perf_counter() - startTime
+                print('[{}/{}] {:.2f} frames/s, {} rows, ETA {:.0f} s'.format(
+                    count, len(todoList), count/elapsed, rowAmount, (len(todoList)-count)*elapsed/count))
+
+    ### pack
+    totalRows = csvToNpz(csvPath, npzPath)
+    print('{} rows of {} frames saved to {} and {}'.format(totalRows, len(frameList), csvPath, npzPath))
+
+    return
+
+if __name__ == '__main__':
+    args = parseArguments()
+    main(args)
@@ -12,6 +12,9 @@ that change should be applied in real time.
 Minimal changes should be made to cameras.
 After loading, every parameter will be compared with the cached parameter.
 Only the changed one will be applied.
+At startup, the full configuration of each camera can be bulk-loaded from a
+profile cache (pylon feature file or camera UserSet) keyed by the hash of
+the camera's parameter block. Per-node writes only happen on a cache miss.
 
 Known issue:
 1. Bayer sensor pixel format may change after reversing x/y, changing offset x/y,
@@ -27,6 +30,7 @@ from logging import critical, error, info, warning, debug
 import time
 import pathlib
 import json
+import hashlib
 
 import numpy as np
 
@@ -151,7 +155,11 @@ def pickRequiredCameras(tlFactory, arrayParams):
 ### Camera "in-file" feature configuration
 ########################################
 nonStopParamList = ('ExposureTime', 'Gain', 'DeviceLinkThroughputLimit')
-stopParamList = ('Width', 'Height', 'OffsetX', 'OffsetY', 'rot180', 'PixelFormat', 'AcquisitionFrameRate')
+# binning/decimation changes the sensor size, thus comes before width/height/offset
+stopParamList = ('BinningHorizontal', 'BinningVertical', 'DecimationHorizontal', 'DecimationVertical',
+                 'Width', 'Height', 'OffsetX', 'OffsetY', 'rot180', 'PixelFormat', 'AcquisitionFrameRate')
+# optional parameters, left untouched if not in the parameter file
+optionalParamList = ('BinningHorizontal', 'BinningVertical', 'DecimationHorizontal', 'DecimationVertical')
 
 def _checkCacheDeco(func):
     """
@@ -215,6 +223,7 @@ def _setCamNumValue(cam, camName, paramName, v):
     # validate the parameter
     if not hasattr(cam, paramName):
         error('Cam {} does not have parameter {}, ignored.'.format(camName, paramName))
+        return
 
     # correct value
     tgtV = getattr(cam, paramName)
@@ -321,7 +330,184 @@ def setCamParams(cam, params, paramsCache):
 
     # set parameters one by one
     for paramName in nonStopParamList+stopParamList:
-        _setCamParam(cam, params['name'], paramName, params[paramName], paramsCache[paramName])
+        if not paramName in params:
+            if not paramName in optionalParamList:
+                error('{}\'s parameter {} is missing, ignored.'.format(params['name'], paramName))
+            continue
+        _setCamParam(cam, params['name'], paramName, params[paramName], paramsCache.get(paramName))
+
+def previewParams(params, factor, mode='binning'):
+    """
+    Return a copy of a camera's parameter block for bandwidth-reduced preview.
+    The sensor is binned or decimated by factor on the camera,
+    and width/height/offset are scaled accordingly, so the field of view is kept.
+    Restore full resolution by setCamParams(cam, fullResParams(params), previewParams(params, ...)).
+    Args:
+        params: the camera's parameter block
+        factor: int, binning/decimation factor on both directions
+        mode: 'binning' or 'decimation'
+    """
+    if mode == 'binning':
+        hName, vName = 'BinningHorizontal', 'BinningVertical'
+    elif mode == 'decimation':
+        hName, vName = 'DecimationHorizontal', 'DecimationVertical'
+    else:
+        raise RuntimeError('Preview mode \'{}\' is not supported.'.format(mode))
+    factor = int(factor)
+    preview = dict(params)
+    preview[hName] = params.get(hName, 1) * factor
+    preview[vName] = params.get(vName, 1) * factor
+    for paramName in ('Width', 'Height', 'OffsetX', 'OffsetY'):
+        preview[paramName] = params[paramName] // factor
+    return preview
+
+def fullResParams(params):
+    """
+    Return a copy of a camera's parameter block to restore full resolution from a preview.
+    Binning/decimation are optional, thus skipped by setCamParams if missing from params,
+    which would leave the camera binned. They are written explicitly, 1 if missing.
+    """
+    full = dict(params)
+    for paramName in optionalParamList:
+        full[paramName] = params.get(paramName, 1)
+    return full
+
+########################################
+### Camera profile cache
+########################################
+def camParamsHash(params):
+    """
+    Hash the configurable part of a camera's parameter block.
+    Only parameters in nonStopParamList/stopParamList count, thus renaming
+    a camera or changing its index won't invalidate its profile.
+    """
+    configDict = {k: params[k] for k in (nonStopParamList+stopParamList) if k in params}
+    configStr = json.dumps(configDict, sort_keys=True)
+    return hashlib.sha1(configStr.encode('utf-8')).hexdigest()[:16]
+
+class CamProfileCache():
+    """
+    A cache of configured camera states, keyed by camera SN and the hash of
+    its parameter block. Loading a profile configures the whole node map at
+    once, which is much faster than writing parameters node by node.
+    Two storages are supported:
+        pylon feature files (.pfs) in a folder, one file per SN and hash.
+            Up to maxFiles profiles per SN are kept, the least recently
+            saved or loaded ones are deleted on save.
+        camera UserSets (e.g. UserSet1-3), the hashes stored in a small
+            json index per SN. Profiles live on the camera, so only a few
+            of them can be preloaded, the least recently saved one is replaced.
+    """
+    def __init__(self, folder:str, userSetList=None, maxFiles=8):
+        """
+        Args:
+            folder: string, folder holding the feature files and UserSet indices
+            userSetList: list of UserSet names to use. If None, use feature files
+            maxFiles: amount of feature files kept per SN
+        """
+        self.plp = pathlib.Path(folder)
+        if not self.plp.exists():
+            self.plp.mkdir(parents=True)
+            info('Folder {} made for camera profiles.'.format(self.plp))
+        self.userSetList = userSetList
+        self.maxFiles = maxFiles
+
+    def _featureFilePath(self, sn, paramsHash):
+        return self.plp / '{}_{}.pfs'.format(sn, paramsHash)
+
+    def _evictFeatureFiles(self, sn):
+        """
+        Delete all but the maxFiles most recently saved or loaded feature files of sn
+        """
+        plpList = sorted(self.plp.glob('{}_*.pfs'.format(sn)), key=lambda plp: plp.stat().st_mtime, reverse=True)
+        for plp in plpList[self.maxFiles:]:
+            plp.unlink()
+            info('Cam profile {} evicted'.format(plp))
+
+    def _userSetIndexPath(self, sn):
+        return self.plp / '{}_usersets.json'.format(sn)
+
+    def _loadUserSetIndex(self, sn):
+        plp = self._userSetIndexPath(sn)
+        if not plp.exists():
+            return {}
+        return jsonLoadFunc(plp)
+
+    def _saveUserSetIndex(self, sn, userSetIndex):
+        with open(self._userSetIndexPath(sn), 'w') as fp:
+            json.dump(userSetIndex, fp, indent=4)
+
+    def load(self, cam, params):
+        """
+        Try to configure an open, not grabbing camera from a cached profile
+        Return True on cache hit, False on miss or if loading failed
+        """
+        sn = cam.GetDeviceInfo().GetSerialNumber()
+        paramsHash = camParamsHash(params)
+        try:
+            if self.userSetList is None:
+                plp = self._featureFilePath(sn, paramsHash)
+                if not plp.exists():
+                    info('No cached profile {} for cam {}'.format(paramsHash, params['name']))
+                    return False
+                pylon.FeaturePersistence.Load(str(plp), cam.GetNodeMap(), True)
+                plp.touch() # recently used, kept on eviction
+                info('Cam {} configured from feature file {}'.format(params['name'], plp))
+                return True
+            userSetIndex = self._loadUserSetIndex(sn)
+            for userSet in self.userSetList:
+                if userSet in userSetIndex and userSetIndex[userSet]['hash'] == paramsHash:
+                    cam.UserSetSelector.SetValue(userSet)
+                    cam.UserSetLoad.Execute()
+                    info('Cam {} configured from {}'.format(params['name'], userSet))
+                    return True
+            info('No UserSet holds profile {} for cam {}'.format(paramsHash, params['name']))
+            return False
+        except genicam.GenericException as e:
+            error('Cam {} fails to load cached profile {}, fall back to per-node writes. {}'.format(
+                params['name'], paramsHash, e))
+            return False
+
+    def save(self, cam, params):
+        """
+        Save the current state of an open, not grabbing camera as the profile of params
+        """
+        sn = cam.GetDeviceInfo().GetSerialNumber()
+        paramsHash = camParamsHash(params)
+        try:
+            if self.userSetList is None:
+                plp = self._featureFilePath(sn, paramsHash)
+                pylon.FeaturePersistence.Save(str(plp), cam.GetNodeMap())
+                info('Cam {} profile saved to {}'.format(params['name'], plp))
+                self._evictFeatureFiles(sn)
+                return
+            # pick an unused UserSet, otherwise the least recently saved one
+            userSetIndex = self._loadUserSetIndex(sn)
+            unusedList = [us for us in self.userSetList if not us in userSetIndex]
+            if len(unusedList) > 0:
+                userSet = unusedList[0]
+            else:
+                userSet = min(self.userSetList, key=lambda us: userSetIndex[us]['time'])
+            cam.UserSetSelector.SetValue(userSet)
+            cam.UserSetSave.Execute()
+            userSetIndex[userSet] = {'hash': paramsHash, 'time': time.time()}
+            self._saveUserSetIndex(sn, userSetIndex)
+            info('Cam {} profile saved to {}'.format(params['name'], userSet))
+        except genicam.GenericException as e:
+            error('Cam {} fails to save profile {}, ignored. {}'.format(params['name'], paramsHash, e))
+
+def setCamParamsCached(cam, params, profileCache):
+    """
+    Configure an open, not grabbing camera with the full parameter block.
+    Bulk-load the matching profile from profileCache if there is one,
+    otherwise set parameters one by one and save the result as a new profile.
+    If profileCache is None, simply set parameters one by one.
+    """
+    if profileCache is not None and profileCache.load(cam, params):
+        return
+    setCamParams(cam, params, None)
+    if profileCache is not None:
+        profileCache.save(cam, params)
 
 def configArrayIfParamChanges(camList, arrayParamsLoader, arrayParams):
     """
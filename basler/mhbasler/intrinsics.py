@@ -0,0 +1,221 @@
+"""
+Codes to load the camera intrinsics of a camera array, and undistort its frames
+
+check the notes in __init__.py for some overall ideas.
+
+Intrinsics logic:
+Like the camera configuration, intrinsics live in a json file keyed by the camera serial number (SN), e.g.
+{"40123456": {"camera_matrix": [[fx, 0, cx], [0, fy, cy], [0, 0, 1]],
+              "dist_coeffs": [k1, k2, p1, p2, k3],
+              "image_size": [w, h],
+              "offset": [x, y]}}
+in OpenCV's model, calibrated at image_size, usually the full sensor resolution. The file is usually
+intrinsics.json next to the camera configuration file.
+Frames of another size but the same field of view, e.g. binned/decimated previews or the color planes of
+a raw Bayer frame, use the camera matrix scaled to their size. Distortion coefficients are scale free.
+Frames of a known ROI, e.g. a camera parameter block, use the camera matrix moved to that ROI instead.
+The optional offset is the OffsetX/OffsetY of the calibration frames on the sensor, default 0, 0.
+
+Undistortion logic:
+cv.undistort recomputes its maps on every call. Instead the maps of each camera and ROI are computed once
+by initUndistortRectifyMap, in fixed-point form, and every frame only goes through cv.remap.
+The maps are also saved to a folder, such that a restart loads them instead of computing them again.
+The undistorted frame keeps the size and camera matrix of its ROI, without distortion.
+The pixel scale at the principal point is unchanged, so charts near it keep their lp/mm.
+Only the pixels of a region can be remapped as well, e.g. the charts found by their markers.
+
+Known issue:
+1. A frame of a different field of view without its ROI, e.g. a smaller ROI passed to scaledIntrinsics, is not handled.
+2. ReverseX/ReverseY (rot180) is assumed the same as at calibration.
+3. Remapping interpolates, which slightly blurs the frame, thus lowers the MTF measured on it.
+"""
+
+import json
+import pathlib
+import hashlib
+import logging
+from logging import critical, error, info, warning, debug
+
+import numpy as np
+import cv2 as cv
+
+def loadIntrinsics(path):
+    """
+    Load the intrinsics json file
+    Return a dict keyed by SN, valued by a dict of camera_matrix (3x3), dist_coeffs, both numpy arrays,
+        image_size (w, h), and offset (x, y)
+    """
+    plp = pathlib.Path(path)
+    if not plp.exists():
+        raise RuntimeError("No such file: {}".format(plp))
+    with open(plp, 'r') as fp:
+        jo = json.load(fp)
+    intrinsics = {}
+    for sn, camIntrinsics in jo.items():
+        intrinsics[sn] = {'camera_matrix': np.array(camIntrinsics['camera_matrix'], dtype=np.float64).reshape(3,3),
+                          'dist_coeffs': np.array(camIntrinsics.get('dist_coeffs', []), dtype=np.float64).reshape(-1),
+                          'image_size': tuple(int(n) for n in camIntrinsics['image_size']),
+                          'offset': tuple(int(n) for n in camIntrinsics.get('offset', (0, 0)))}
+    return intrinsics
+
+def scaledIntrinsics(camIntrinsics, imgWh):
+    """
+    Camera matrix and distortion coefficients for frames of imgWh (w, h), of the same field of view
+    as the calibration. Pixel centers are kept aligned, c' = (c + 0.5)*s - 0.5
+    """
+    calibW, calibH = camIntrinsics['image_size']
+    sx, sy = imgWh[0] / calibW, imgWh[1] / calibH
+    if abs(sx - sy) > 1e-3:
+        warning('Frame size {} is not a scaled calibration size {}'.format(tuple(imgWh), (calibW, calibH)))
+    cameraMatrix = camIntrinsics['camera_matrix'].copy()
+    cameraMatrix[0, [0, 1]] *= sx
+    cameraMatrix[1, 1] *= sy
+    cameraMatrix[0, 2] = (cameraMatrix[0, 2] + 0.5)*sx - 0.5
+    cameraMatrix[1, 2] = (cameraMatrix[1, 2] + 0.5)*sy - 0.5
+    return cameraMatrix, camIntrinsics['dist_coeffs']
+
+def frameRoi(params):
+    """
+    ROI of the frames of a camera parameter block, e.g. one from previewParams
+    Return (OffsetX, OffsetY, Width, Height, factorX, factorY), offsets and size in frame pixels,
+        factors being binning times decimation
+    """
+    factorX = params.get('BinningHorizontal', 1) * params.get('DecimationHorizontal', 1)
+    factorY = params.get('BinningVertical', 1) * params.get('DecimationVertical', 1)
+    return tuple(int(n) for n in (params['OffsetX'], params['OffsetY'], params['Width'], params['Height'],
+                                  factorX, factorY))
+
+def roiIntrinsics(camIntrinsics, roi):
+    """
+    Camera matrix and distortion coefficients for frames of roi (see frameRoi)
+    Pixel centers are kept aligned, in sensor pixels c + offset = (c' + roiOffset + 0.5)*factor - 0.5
+    """
+    offX, offY, _, _, factorX, factorY = roi
+    calibOffX, calibOffY = camIntrinsics['offset']
+    cameraMatrix = camIntrinsics['camera_matrix'].copy()
+    cameraMatrix[0, [0, 1]] /= factorX
+    cameraMatrix[1, 1] /= factorY
+    cameraMatrix[0, 2] = (cameraMatrix[0, 2] + calibOffX + 0.5)/factorX - 0.5 - offX
+    cameraMatrix[1, 2] = (cameraMatrix[1, 2] + calibOffY + 0.5)/factorY - 0.5 - offY
+    return cameraMatrix, camIntrinsics['dist_coeffs']
+
+########################################
+### Undistortion maps
+########################################
+class FrameUndistorter():
+    """
+    Undistort the frames of one camera ROI by fixed-point maps, see UndistortMapCache
+    The undistorted frame is of the same size and cameraMatrix, without distortion
+    """
+    def __init__(self, roi, cameraMatrix, distCoeffs, map1, map2):
+        """
+        Args:
+            roi: the frame ROI, see frameRoi
+            cameraMatrix, distCoeffs: intrinsics of the ROI, see roiIntrinsics
+            map1, map2: CV_16SC2 and CV_16UC1 maps of initUndistortRectifyMap
+        """
+        self.roi = roi
+        self.cameraMatrix = cameraMatrix
+        self.distCoeffs = distCoeffs
+        self.map1 = map1
+        self.map2 = map2
+
+    @property
+    def frameWh(self):
+        return self.roi[2], self.roi[3]
+
+    def undistort(self, img, interpolation=cv.INTER_LINEAR):
+        """
+        Undistort a whole frame
+        """
+        return cv.remap(img, self.map1, self.map2, interpolation)
+
+    def undistortRoi(self, img, x0, y0, x1, y1, interpolation=cv.INTER_CUBIC):
+        """
+        Pixels [y0:y1, x0:x1] of the undistorted frame, only those are remapped from the whole distorted img
+        Cubic by default, as a region is usually analyzed, not only shown
+        """
+        return cv.remap(img, self.map1[y0:y1, x0:x1], self.map2[y0:y1, x0:x1], interpolation)
+
+    def undistortPoints(self, points):
+        """
+        Points (..., 2) of the distorted frame to the undistorted frame, same shape
+        """
+        points = np.asarray(points)
+        pts = cv.undistortPoints(points.reshape(-1, 1, 2).astype(np.float64), self.cameraMatrix, self.distCoeffs,
+                                 P=self.cameraMatrix)
+        return pts.reshape(points.shape).astype(np.result_type(points.dtype, np.float32))
+
+    def distortPoints(self, points):
+        """
+        Points (..., 2) of the undistorted frame back to the distorted frame, e.g. to draw on it, same shape
+        """
+        points = np.asarray(points)
+        pts = points.reshape(-1, 2).astype(np.float64)
+        # normalized image points on the z = 1 plane, projected with the distortion
+        xyz = np.hstack([(pts - self.cameraMatrix[[0, 1], [2, 2]]) / self.cameraMatrix[[0, 1], [0, 1]],
+                         np.ones((len(pts), 1))])
+        pts, _ = cv.projectPoints(xyz, np.zeros(3), np.zeros(3), self.cameraMatrix, self.distCoeffs)
+        return pts.reshape(points.shape).astype(np.result_type(points.dtype, np.float32))
+
+def undistortMapsHash(cameraMatrix, distCoeffs, roi):
+    """
+    Hash what the undistortion maps of a ROI depend on
+    """
+    configStr = json.dumps({'camera_matrix': np.asarray(cameraMatrix).tolist(),
+                            'dist_coeffs': np.asarray(distCoeffs).tolist(),
+                            'roi': list(roi)})
+    return hashlib.sha1(configStr.encode('utf-8')).hexdigest()[:16]
+
+class UndistortMapCache():
+    """
+    Undistortion maps of each camera and ROI, computed once by initUndistortRectifyMap.
+    Maps are in fixed-point form, CV_16SC2 integer coordinates plus CV_16UC1 interpolation table indices,
+    6 bytes per pixel instead of 8 of the float maps, ~50 MB at 3840x2160.
+    They are kept in memory, and saved as .npz files in a folder, one file per SN, frame size,
+    and the hash of the intrinsics and ROI, so changed intrinsics never load stale maps.
+    """
+    def __init__(self, folder:str):
+        """
+        Args:
+            folder: string, folder holding the map files
+        """
+        self.plp = pathlib.Path(folder)
+        if not self.plp.exists():
+            self.plp.mkdir(parents=True)
+            info('Folder {} made for undistortion maps.'.format(self.plp))
+        self.undistorterDict = {} # (SN, hash) -> FrameUndistorter
+
+    def _mapFilePath(self, sn, roi, mapsHash):
+        return self.plp / '{}_{}x{}_{}.npz'.format(sn, roi[2], roi[3], mapsHash)
+
+    def get(self, sn, camIntrinsics, roi):
+        """
+        Return the FrameUndistorter of a camera's intrinsics (see loadIntrinsics) at roi (see frameRoi)
+        From memory, else from its map file, else computed and saved
+        """
+        cameraMatrix, distCoeffs = roiIntrinsics(camIntrinsics, roi)
+        mapsHash = undistortMapsHash(cameraMatrix, distCoeffs, roi)
+        if (sn, mapsHash) in self.undistorterDict:
+            return self.undistorterDict[(sn, mapsHash)]
+        plp = self._mapFilePath(sn, roi, mapsHash)
+        maps = None
+        if plp.exists():
+            try:
+                with np.load(plp) as npz:
+                    maps = (npz['map1'], npz['map2'])
+                debug('Undistortion maps of {} loaded from {}'.format(sn, plp))
+            except (OSError, KeyError, ValueError) as e:
+                error('Cannot load undistortion maps {}, computed again. {}'.format(plp, e))
+        if maps is None:
+            maps = cv.initUndistortRectifyMap(cameraMatrix, distCoeffs, None, cameraMatrix,
+                                              (roi[2], roi[3]), cv.CV_16SC2)
+            # written aside then renamed, an interrupted save never leaves a broken map file
+            tmpPlp = plp.with_suffix('.tmp')
+            with open(tmpPlp, 'wb') as fp:
+                np.savez(fp, map1=maps[0], map2=maps[1])
+            tmpPlp.replace(plp)
+            info('Undistortion maps of {} at {}x{} saved to {}'.format(sn, roi[2], roi[3], plp))
+        undistorter = FrameUndistorter(roi, cameraMatrix, distCoeffs, *maps)
+        self.undistorterDict[(sn, mapsHash)] = undistorter
+        return undistorter
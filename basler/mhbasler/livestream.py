@@ -7,37 +7,46 @@ check the notes in __init__.py for some overall ideas.
 Camera livestream logic:
 A list of cameras are connected, but only one camera will be streaming at one time to save bandwidth.
 Press number keys to switch displaying camera. Press esc to escape.
+Press p to toggle the preview mode, where the sensor is binned/decimated on the camera to save bandwidth.
+Frame grab (f) always saves a full resolution frame, switching out of preview for that one frame.
+Press m to switch to the mosaic mode, where all cameras stream at once at a reduced frame rate,
+such that the total bandwidth stays under a budget. Frames are resized and tiled into one window.
 The camera configuration might change while the cameras livestreams, and that change should be applied in real time. Check camconfig.py for more information.
 Two loops are applied. Outer loop switchs between cameras, only esc would break that loop. Inner loop keeps grabbing frames from one camera, esc and camera index can break that loop.
 The ugly part is that real-time parameter change happens in the inner loop, thus we have to expose all camera and parameters to inner loop.
+Grabbing and rendering are decoupled. A grab thread keeps retrieving and converting frames, and only keeps the newest one in a latest-slot.
+The render loop (main thread, as OpenCV GUI requires) picks up the newest frame at the display refresh rate, so slow overlays won't lower the grab rate.
 
-Known issue:
+The pixel value histogram is drawn with OpenCV into a small image at the corner of the livestream.
+It is computed on a strided subsample of the frame, and only refreshed a few times per second.
 
-Acknoledgement:
-histogram part largely learned from
-https://github.com/nrsyed/computer-vision/blob/master/real_time_histogram/real_time_histogram.py.
-The original one is not working, though. I fixed it following
-https://www.geeksforgeeks.org/how-to-update-a-plot-on-same-figure-during-the-loop/
+Known issue:
 """
 
 import sys
 sys.path.append('/home/dbg/Desktop/camera_control_scripts/target_workbench')
+import re
 import time
+import threading
 from datetime import datetime
 import logging
 from logging import critical, error, info, warning, debug
 
 import numpy as np
 import cv2 as cv
-import matplotlib.pyplot as plt
 
 from pypylon import pylon, genicam
 
-from .camconfig import configArrayIfParamChanges
-from target_toolbox.aruco_marker import draw_aruco_square_score, draw_aruco_coordinate
-from target_toolbox.aruco_sine_chart import extract_sine_and_bw_tiles, estimate_comm_diff_from_bw_tile, \
-                                            estimate_mtf_from_sine_tile, find_sine_corner_list, \
-                                            draw_sine_block_outline_and_mtf
+from .camconfig import configArrayIfParamChanges, setCamParams, previewParams, fullResParams
+from .mtfpool import AsyncMtfAnalyzer
+from .intrinsics import scaledIntrinsics, frameRoi
+from target_toolbox.aruco_marker import draw_aruco_square_score, draw_aruco_coordinate, \
+                                        detect_markers_pyramid, ArucoRoiTracker, \
+                                        marker_tilt_batch, draw_aruco_tilt
+from target_toolbox.field_map import FieldMtfMap
+from target_toolbox.aruco_sine_chart import analyze_aruco_sine_chart, find_sine_corner_list_batch, find_chart_roi, \
+                                            draw_chart_outline_and_mtf, MtfTemporalAverager, \
+                                            analyze_aruco_sine_chart_bayer, bayer_planes, bayer_from_plane_corners
 
 ########################################
 ### Camera livestream
@@ -46,7 +55,7 @@ def opencvKeyWatcher(x, waitTime=1):
     """
     Return changed x if certain key is pressed
     Return original x if not pressed
-    Currently only accept 0-6 and ESC (return as -1)
+    Currently only accept 0-6, ESC (return as -1), and f/s/m/p/c (returned as str)
     """
     k = cv.waitKey(waitTime)
     if k < 0: # no input
@@ -59,47 +68,401 @@ def opencvKeyWatcher(x, waitTime=1):
         return 'f'
     elif k == 115: # 115 for s, snap shot
         return 's'
+    elif k == 109: # 109 for m, mosaic mode
+        return 'm'
+    elif k == 112: # 112 for p, toggle preview
+        return 'p'
+    elif k == 99: # 99 for c, clear field MTF map
+        return 'c'
     else:
-        warning('Input not accepted. ESC to quit, 0-6 for camera selection, s for snapshot, f for frame grab')
+        warning('Input not accepted. ESC to quit, 0-6 for camera selection, m for mosaic, ' \
+                + 'p for preview, s for snapshot, f for frame grab, c to clear field map')
         return x
 
-def initHist(bins, lw=3, alpha=0.5):
-    plt.ion() # enable GUI event loop
-    fig, ax = plt.subplots()
-    ax.set_title('Histogram (RGB)')
-    ax.set_xlabel('Bin')
-    ax.set_ylabel('Frequency')
-    lineR, = ax.plot(np.arange(bins), np.zeros((bins,)), c='r', lw=lw, alpha=alpha, label='Red')
-    lineG, = ax.plot(np.arange(bins), np.zeros((bins,)), c='g', lw=lw, alpha=alpha, label='Green')
-    lineB, = ax.plot(np.arange(bins), np.zeros((bins,)), c='b', lw=lw, alpha=alpha, label='Blue')
-    ax.set_xlim(0, bins-1)
-    ax.set_ylim(0, 1)
-    ax.legend()
-    return fig, ax, lineR, lineG, lineB
-
-def dispHist(frame, bins, fig, ax, lineR, lineG, lineB):
-    # calculate histogram
-    numPixels = np.prod(frame.shape[:2])
-    (r, g, b) = cv.split(frame)
-    histogramR = cv.calcHist([r], [0], None, [bins], [0, 255]) / numPixels
-    histogramG = cv.calcHist([g], [0], None, [bins], [0, 255]) / numPixels
-    histogramB = cv.calcHist([b], [0], None, [bins], [0, 255]) / numPixels
-    # update data value
-    lineR.set_ydata(histogramR)
-    lineG.set_ydata(histogramG)
-    lineB.set_ydata(histogramB)
-    ax.set_ylim(0, max([histogramR.max(), histogramG.max(), histogramB.max()]))
-    # update value and run GUI event
-    fig.canvas.draw()
-    fig.canvas.flush_events()
-    return
+class HistogramOverlay():
+    """
+    Pixel value histogram drawn with OpenCV into a small image.
+    The histogram is computed on a strided subsample of the frame,
+    and only refreshed at rate Hz. Works on grayscale and BGR frames.
+    The percentage of clipped (lowest and highest value) pixels is reported per channel.
+    """
+    CHANNEL_COLORS = {1: [(255,255,255)], 3: [(255,0,0), (0,255,0), (0,0,255)]}
+    CHANNEL_NAMES = {1: ['Y'], 3: ['B', 'G', 'R']}
+
+    def __init__(self, bins, rate=5, stride=8, wh=(320, 160)):
+        """
+        Args:
+            bins: amount of histogram bins
+            rate: refresh rate in Hz
+            stride: subsample stride on both directions
+            wh: size of the histogram image in pixels
+        """
+        self.bins = bins
+        self.periodNs = 1e9/rate
+        self.stride = stride
+        self.wh = wh
+        self.canvas = np.zeros((wh[1], wh[0], 3), dtype=np.uint8)
+        self.lastTime = 0
+        # bin edges on 256 levels
+        self.binStarts = np.linspace(0, 256, bins+1).astype(int)[:-1]
+
+    def update(self, img):
+        """
+        Recompute and redraw the histogram if the refresh period passed
+        """
+        now = time.time_ns()
+        if now - self.lastTime < self.periodNs:
+            return
+        self.lastTime = now
+        # strided subsample, scaled to 8-bit levels
+        sub = img[::self.stride, ::self.stride]
+        if sub.dtype != np.uint8:
+            sub = (sub.astype(np.uint32) * 256 // (np.iinfo(sub.dtype).max + 1)).astype(np.uint8)
+        if sub.ndim == 2:
+            sub = sub[..., None]
+        chAmount = sub.shape[2]
+        numPixels = sub.shape[0] * sub.shape[1]
+        histList = []
+        clipList = []
+        for c in range(chAmount):
+            hist256 = np.bincount(sub[..., c].ravel(), minlength=256)
+            histList.append(np.add.reduceat(hist256, self.binStarts) / numPixels)
+            clipList.append((hist256[0]/numPixels*100, hist256[255]/numPixels*100))
+        self._draw(histList, clipList)
+
+    def _draw(self, histList, clipList):
+        w, h = self.wh
+        textH = int(h*0.15)
+        plotH = h - textH*len(histList) - 2
+        self.canvas[:] = 32
+        histMax = max([hist.max() for hist in histList]) + 1e-12
+        x = np.linspace(0, w-1, self.bins)
+        colorList = self.CHANNEL_COLORS[len(histList)]
+        nameList = self.CHANNEL_NAMES[len(histList)]
+        for a, (hist, (clipLo, clipHi)) in enumerate(zip(histList, clipList)):
+            y = plotH - hist/histMax*(plotH-1)
+            pts = np.round(np.stack([x, y], 1)).astype(np.int32)
+            cv.polylines(self.canvas, [pts], False, colorList[a], 1, cv.LINE_AA)
+            clipStr = '{} clip lo {:.1f}% hi {:.1f}%'.format(nameList[a], clipLo, clipHi)
+            cv.putText(self.canvas, clipStr, (2, plotH + textH*(a+1)),
+                       cv.FONT_HERSHEY_SIMPLEX, textH*0.03, colorList[a], 1, cv.LINE_AA, False)
+
+    def draw(self, dispImg):
+        """
+        Blit the histogram image to the bottom-right corner of a BGR display image
+        """
+        w, h = self.wh
+        imgH, imgW = dispImg.shape[:2]
+        if imgW < w or imgH < h:
+            return dispImg
+        dispImg[imgH-h:, imgW-w:] = self.canvas
+        return dispImg
+
+def copyConverter(converter):
+    """
+    A new pylon ImageFormatConverter with the output pixel format and bit alignment of converter,
+    None if converter is None. Converters are not thread-safe, each thread converting needs its own
+    """
+    if converter is None:
+        return None
+    converterCopy = pylon.ImageFormatConverter()
+    converterCopy.OutputPixelFormat = converter.OutputPixelFormat
+    converterCopy.OutputBitAlignment = converter.OutputBitAlignment
+    return converterCopy
+
+class LatestFrameGrabber(threading.Thread):
+    """
+    A thread that keeps grabbing frames from one camera.
+    Only the newest frame is kept in self.latest, as a (img, frameCount, timestamp_ns) tuple.
+    The slot is replaced by a single reference assignment, thus readers never need a lock.
+    camLock guards the camera itself, so that parameters can be changed from another thread
+    (which may stop and restart grabbing) without racing with RetrieveResult.
+    An unexpected exception stops the thread, it is logged and kept in self.error.
+    """
+    def __init__(self, cam, converter, camLock, camName='', timeout=5000, fpsAvgGap=20):
+        """
+        Args:
+            cam: an open instant camera object, grabbing started by the caller
+            converter: pylon ImageFormatConverter, the thread converts by its own copy. If None, keep the raw array
+            camLock: threading.Lock guarding the camera
+            camName: string, for report
+            timeout: RetrieveResult timeout in ms
+            fpsAvgGap: amount of frames to average the grab fps
+        """
+        super().__init__(daemon=True)
+        self.cam = cam
+        self.converter = copyConverter(converter)
+        self.camLock = camLock
+        self.camName = camName
+        self.timeout = timeout
+        self.fpsAvgGap = fpsAvgGap
+        # latest-slot and statistics, only written by this thread
+        self.latest = None
+        self.frameCount = 0
+        self.fps = 0
+        self.error = None # the exception that stopped the thread, if any
+        self._stopEvent = threading.Event()
+
+    def run(self):
+        try:
+            self._grabLoop()
+        except Exception as e:
+            error('Cam {} grab thread stopped: {}'.format(self.camName, e))
+            self.error = e
+
+    def _grabLoop(self):
+        grabTime0 = time.time_ns()
+        while not self._stopEvent.is_set():
+            # retrieve under camera lock, the camera may be reconfigured by other threads
+            with self.camLock:
+                if self.cam.IsGrabbing():
+                    try:
+                        grabResult = self.cam.RetrieveResult(self.timeout, pylon.TimeoutHandling_ThrowException)
+                    except genicam.TimeoutException:
+                        error('Cam {} grab timeout, retry.'.format(self.camName))
+                        continue
+                else:
+                    grabResult = None
+            if grabResult is None: # grabbing is being restarted
+                time.sleep(0.001)
+                continue
+            # convert outside the lock
+            img = None
+            if grabResult.GrabSucceeded():
+                if self.converter is None:
+                    img = grabResult.GetArray()
+                else:
+                    img = self.converter.Convert(grabResult).GetArray()
+            else:
+                error('Cam {} grab failed: {}'.format(self.camName, grabResult.GetErrorDescription()))
+            grabResult.Release()
+            if img is None:
+                continue
+            self.frameCount += 1
+            self.latest = (img, self.frameCount, time.time_ns())
+            debug('One frame grabbed.')
+            # timing
+            if self.frameCount % self.fpsAvgGap == 0:
+                grabTime1 = time.time_ns()
+                self.fps = 1e9/(grabTime1-grabTime0)*self.fpsAvgGap
+                grabTime0 = grabTime1
+
+    def stop(self):
+        """
+        Stop the thread and wait for it
+        """
+        self._stopEvent.set()
+        self.join()
+
+class DisplayResizer():
+    """
+    Downscale frames to the size of a cv.WINDOW_NORMAL window, so the window
+    doesn't need to rescale, and overlays are drawn on the small image.
+    The output buffers are reused between frames as long as the size holds.
+    """
+    def __init__(self, windowName, windowWidth=None):
+        """
+        Args:
+            windowName: string, name of the window to create
+            windowWidth: initial window width in pixels. If None, OpenCV default
+        """
+        self.windowName = windowName
+        self.windowWidth = windowWidth
+        self.sized = False
+        self.buf = None # resized output
+        self.grayBuf = None # resized grayscale, before converting to BGR
+        cv.namedWindow(windowName, cv.WINDOW_NORMAL)
+
+    def _windowWh(self, imgW, imgH):
+        # size the window once according to the first frame
+        if not self.sized and self.windowWidth is not None:
+            cv.resizeWindow(self.windowName, int(self.windowWidth),
+                            int(np.round(self.windowWidth*imgH/imgW)))
+        self.sized = True
+        _, _, w, h = cv.getWindowImageRect(self.windowName)
+        if w <= 0 or h <= 0: # window not shown yet
+            return imgW, imgH
+        return w, h
+
+    def resize(self, img, overlayOn):
+        """
+        Return an image to display and its scale relative to img.
+        If overlayOn, the returned image is a BGR image that is safe to draw on.
+        Otherwise, img itself may be returned, without any copy.
+        """
+        imgH, imgW = img.shape[:2]
+        winW, winH = self._windowWh(imgW, imgH)
+        scale = min(winW/imgW, winH/imgH, 1.0)
+        dispWh = (max(1, int(np.round(imgW*scale))), max(1, int(np.round(imgH*scale))))
+        # no downscale needed
+        if dispWh == (imgW, imgH):
+            if not overlayOn:
+                return img, 1.0
+            if img.ndim == 2:
+                return cv.cvtColor(img, cv.COLOR_GRAY2BGR), 1.0
+            return np.copy(img), 1.0
+        # downscale into reused buffers
+        dispShape = (dispWh[1], dispWh[0], 3)
+        if self.buf is None or self.buf.shape != dispShape:
+            self.buf = np.empty(dispShape, dtype=img.dtype)
+            self.grayBuf = np.empty(dispShape[:2], dtype=img.dtype)
+        if img.ndim == 2:
+            cv.resize(img, dispWh, dst=self.grayBuf, interpolation=cv.INTER_AREA)
+            if not overlayOn:
+                return self.grayBuf, scale
+            cv.cvtColor(self.grayBuf, cv.COLOR_GRAY2BGR, dst=self.buf)
+        else:
+            cv.resize(img, dispWh, dst=self.buf, interpolation=cv.INTER_AREA)
+        return self.buf, scale
+
+def grabFullResFrame(cam, converter, params, preview, camLock, timeout=5000):
+    """
+    Grab one full resolution frame from a grabbing camera in preview mode.
+    Grabbing is stopped, full resolution parameters restored, one frame grabbed,
+        then the preview parameters applied and grabbing restarted.
+    Return the converted image, or the raw array if converter is None, None if failed
+    """
+    img = None
+    with camLock:
+        cam.StopGrabbing()
+        setCamParams(cam, fullResParams(params), preview)
+        grabResult = cam.GrabOne(timeout)
+        if grabResult.GrabSucceeded():
+            img = grabResult.GetArray() if converter is None else converter.Convert(grabResult).GetArray()
+        else:
+            error('Full resolution grab failed: {}'.format(grabResult.GetErrorDescription()))
+        grabResult.Release()
+        setCamParams(cam, preview, fullResParams(params))
+        cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+    return img
+
+def parseBayerFormat(pixelFormat):
+    """
+    Parse an unpacked Bayer pixel format, e.g. BayerRG8 or BayerRG12, into (pattern, bit depth)
+    Return None if pixelFormat is not Bayer
+    Packed formats, e.g. BayerRG12p or BayerRG12Packed, are not unpacked by GetArray, RuntimeError raised
+    """
+    match = re.fullmatch(r'Bayer(RG|BG|GR|GB)(\d+)(p|Packed)?', pixelFormat)
+    if match is None:
+        return None
+    pattern, bits, packed = match.groups()
+    if packed is not None:
+        raise RuntimeError('Packed pixel format {} is not supported for raw Bayer frames, '.format(pixelFormat) \
+                           + 'use an unpacked one, e.g. Bayer{}{}'.format(pattern, bits))
+    return pattern, int(bits)
+
+def _averageMtf(averagerDict, arucoIdx, frameCount, lpmmList, mtfList, window):
+    """
+    Feed the MTF of a chart in frame frameCount to the chart's MtfTemporalAverager,
+        once per frame, such that an async result shown on several frames counts once
+    Return averaged mtfList, (mtfLowList, mtfHighList), and the amount of frames averaged
+    A dict of channel -> mtfList (raw Bayer) is averaged channel by channel, returned as a dict without band
+    """
+    if not arucoIdx in averagerDict:
+        averagerDict[arucoIdx] = [MtfTemporalAverager(window), None]
+    averager, lastFrameCount = averagerDict[arucoIdx]
+    # channels are stacked into one list
+    chList = list(mtfList.keys()) if isinstance(mtfList, dict) else None
+    if frameCount != lastFrameCount:
+        if chList is None:
+            averager.update(lpmmList, mtfList)
+        else:
+            averager.update([(ch, lpmm) for ch in chList for lpmm in lpmmList],
+                            [mtf for ch in chList for mtf in mtfList[ch]])
+        averagerDict[arucoIdx][1] = frameCount
+    mtfList, mtfLowList, mtfHighList = averager.result()
+    if chList is not None:
+        n = len(lpmmList)
+        return {ch: mtfList[a*n:(a+1)*n] for a, ch in enumerate(chList)}, None, averager.count
+    return mtfList, (mtfLowList, mtfHighList), averager.count
+
+def _feedFieldMap(fieldMap, fedDict, arucoIdx, frameCount, sineCorner, lpmmList, mtfList):
+    """
+    Add a chart's MTF of frame frameCount to the field map, once per frame
+    For raw Bayer results, the mean of the two green planes is mapped
+    """
+    if fedDict.get(arucoIdx) == frameCount:
+        return
+    fedDict[arucoIdx] = frameCount
+    if isinstance(mtfList, dict):
+        mtfList = [(gr + gb)/2 for gr, gb in zip(mtfList['Gr'], mtfList['Gb'])]
+    fieldMap.add(sineCorner, lpmmList, mtfList)
+
+def _analyzeUndistortedChart(img, arucoCorner, metaDict, undistorter):
+    """
+    Analyze a chart on its undistorted ROI only, see FrameUndistorter.undistortRoi
+    arucoCorner is in undistorted frame coordinate, and so is the sineCorner returned
+    """
+    x0, y0, x1, y1 = find_chart_roi(arucoCorner, metaDict, img.shape)
+    roiImg = undistorter.undistortRoi(img, x0, y0, x1, y1)
+    sineCorner, lpmmList, mtfList = analyze_aruco_sine_chart(roiImg, arucoCorner - np.array([x0, y0], dtype=np.float32),
+                                                             metaDict)
+    return sineCorner + np.array([x0, y0]), lpmmList, mtfList
+
+def _drawOverlays(dispImg, dispScale, fpsStr, cornerList, idList, tiltList, maxTilt,
+                  fieldMap, fieldMapLpmm, sineResultList, roiUndistorter, histOverlay):
+    """
+    Draw the overlays of singleCamlivestream on a BGR image of the frame scaled by dispScale,
+    the display image, or the full resolution frame for a snapshot. Return the image
+    """
+    # fps
+    if fpsStr is not None:
+        h, w, _ = dispImg.shape
+        cv.putText(dispImg, fpsStr,
+            (np.round(w*0.01).astype(int), np.round(w*0.03).astype(int)),
+            cv.FONT_HERSHEY_SIMPLEX, w*0.0008,
+            (0,255,0), max(1, np.round(w*0.0012).astype(int)), cv.LINE_AA, False)
+
+    # ArUco markers
+    if len(cornerList) > 0:
+        dispCornerList = [c*dispScale for c in cornerList]
+        cv.aruco.drawDetectedMarkers(dispImg, dispCornerList, idList, (255,0,0))
+        if tiltList is None:
+            draw_aruco_square_score(dispImg, dispCornerList)
+        else:
+            draw_aruco_tilt(dispImg, dispCornerList, tiltList, maxTilt)
+        draw_aruco_coordinate(dispImg, dispCornerList, scale=dispScale)
+
+    # field MTF map, under the chart overlays, its heatmap refreshed a few times per second
+    if fieldMap is not None and fieldMap.chart_count > 0:
+        dispImg = fieldMap.draw(dispImg, fieldMapLpmm, scale=dispScale, min_interval=0.2)
+
+    # ArUco-Sine charts, and ArUco-Star charts as curves
+    for sineCorner, lpmmList, mtfList, title, mtfBand, metaDict in sineResultList:
+        if roiUndistorter is not None: # drawn on the distorted frame
+            sineCorner = roiUndistorter.distortPoints(sineCorner)
+        dispSineCorner = np.round(sineCorner*dispScale).astype(int)
+        dispImg = draw_chart_outline_and_mtf(dispImg, dispSineCorner, lpmmList, mtfList, metaDict,
+                                             title=title, mtf_band=mtfBand)
+
+    # histogram
+    if histOverlay is not None:
+        dispImg = histOverlay.draw(dispImg)
+    return dispImg
 
 def singleCamlivestream(camList, arrayParamsLoader, converter,
                         arrayParams, camInd,
                         histBins=None,
                         arucoDetector=None,
                         showFps=False, 
-                        arucoSineMetas=None
+                        arucoSineMetas=None,
+                        displayFps=30,
+                        previewFactor=None,
+                        previewMode='binning',
+                        windowWidth=1280,
+                        histRate=5,
+                        histStride=8,
+                        arucoScale=None,
+                        arucoTrackGap=None,
+                        mtfWorkers=None,
+                        mtfAvgFrames=None,
+                        rawBayer=False,
+                        fieldMapLpmm=None,
+                        fieldMapBin=64,
+                        intrinsics=None,
+                        maxTilt=10.0,
+                        undistortCache=None,
+                        undistortMode=None
                        ):
     """
     Single camera livestream function. Including init, loop, and cleanup.
@@ -108,138 +471,359 @@ def singleCamlivestream(camList, arrayParamsLoader, converter,
         then return the updated arrayParams back to the outer loop.
     The nextCamInd returned to control camera switch
         histBins denotes the numbers of bins when showing histogram.
-    If None, no hisograms will be shown
+    If None, no hisograms will be shown. Otherwise, it is drawn at the bottom-right corner,
+        refreshed at histRate Hz, computed on every histStride-th pixel on both directions
         arucoDetector detects the Aruco markers and labels it on the image.
-    If None, not going to detect ArUco markers
-    If showFps, image count and fps would not only printed in terminal,
+    If None, not going to detect ArUco markers.
+        If arucoScale is not None, candidates are searched on the frame downscaled by arucoScale,
+        and corners refined at full resolution only around each corner.
+        If arucoTrackGap is not None, markers are tracked, only searched around their last location,
+        with a full frame search every arucoTrackGap frames or when a marker is lost.
+    If showFps, grab and render fps would not only printed in terminal,
         but also displayed at the frames top-left corner
     If arucoSineMetas is not None, the program would try to find ArUco-Sine chart,
         and calculate the MTF if we found any fronto-parallel. Note that
-        that should be dict of meta dicts, the key being ArUco index
+        that should be dict of meta dicts, the key being ArUco index.
+        If mtfWorkers is not None, the analysis runs in a pool of mtfWorkers processes,
+        and the display shows the most recent results, tagged with their frame age
+        If mtfAvgFrames is not None, the MTF of each chart is averaged over its last mtfAvgFrames results,
+        and shown with a confidence band
+        If rawBayer and the camera streams a Bayer pixel format, frames are not converted.
+        Markers are detected on the Gr plane, which is also displayed, and the MTF of
+        each color plane is estimated on the raw frame, see analyze_aruco_sine_chart_bayer
+        If fieldMapLpmm is not None, the MTF at that lpmm of all charts seen is accumulated into a
+        field map of fieldMapBin pixel bins, and drawn as a heatmap. Move a chart around to fill it,
+        press c to clear it. It restarts when the frame size changes, e.g. toggling preview
+        If intrinsics is not None, the intrinsics of this camera (see intrinsics.py), the 3D tilt of every
+        marker is estimated and shown instead of its square score, and only charts tilted no more than
+        maxTilt degrees are analyzed
+        If undistortMode is not None as well, frames are undistorted by the maps of undistortCache
+        (UndistortMapCache), picked by the ROI streamed, preview or not. 'frame' undistorts every frame,
+        which is then detected, analyzed and shown. 'roi' only undistorts the ROI of each chart for
+        its analysis, the frame shown is not. Frame grabs (f) are undistorted in both modes.
+        Raw Bayer frames are not undistorted
+    Frames are grabbed in a separate thread. The render loop runs at most at displayFps,
+        and always shows the newest frame. Frames grabbed in between are dropped.
+    If previewFactor is not None, the livestream starts in preview mode, where the camera
+        bins/decimates (previewMode) the sensor by previewFactor. Press p to toggle it.
+        Full resolution settings are restored on frame grab and on exit.
+    Frames are downscaled once to the window size, which starts at windowWidth pixels wide,
+        and overlays are drawn in display coordinates. Snapshots are drawn again at full resolution.
     """
     ### initializing
     # camera
     cam = camList[camInd]
     nextCamInd = camInd
-    camName = arrayParams[cam.GetDeviceInfo().GetSerialNumber()]['name']
+    camSn = cam.GetDeviceInfo().GetSerialNumber()
+    camName = arrayParams[camSn]['name']
     liveWindowName = 'cam{} '.format(camInd) + camName
+    # preview mode
+    previewOn = previewFactor is not None
+    if previewFactor is None:
+        previewFactor = 2
+    if previewOn:
+        setCamParams(cam, previewParams(arrayParams[camSn], previewFactor, previewMode), arrayParams[camSn])
+    # raw Bayer frames, e.g. BayerRG8 or BayerRG12
+    bayerPattern = None
+    if rawBayer:
+        pixelFormat = cam.PixelFormat.Value
+        try:
+            bayerFormat = parseBayerFormat(pixelFormat)
+        except RuntimeError as e:
+            error('{}: {}. Frames converted as usual'.format(camName, e))
+            bayerFormat = None
+        else:
+            if bayerFormat is None:
+                info('{} pixel format {} is not Bayer, frames converted as usual'.format(camName, pixelFormat))
+        if bayerFormat is not None:
+            bayerPattern, bayerShift = bayerFormat[0], bayerFormat[1] - 8
+            info('{} streams raw {} frames'.format(camName, pixelFormat))
     cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
-    # histogram window
+    camLock = threading.Lock()
+    grabber = LatestFrameGrabber(cam, converter if bayerPattern is None else None, camLock, camName)
+    grabber.start()
+    # histogram overlay
+    histOverlay = None
     if histBins is not None:
-        histWindowName = liveWindowName + ' histogram'
-        fig, ax, lineR, lineG, lineB = initHist(histBins)
+        histOverlay = HistogramOverlay(histBins, histRate, histStride)
+    # ArUco marker tracker
+    arucoTracker = None
+    if arucoDetector is not None and arucoTrackGap is not None:
+        arucoTracker = ArucoRoiTracker(arucoDetector, arucoTrackGap, scale=arucoScale)
     # arucoSineMetas
     if arucoSineMetas is not None:
         assert arucoDetector is not None, 'ArUco-Sine charts needs a arucoDetector'
         arucoSineIdxList = list(arucoSineMetas.keys())
         #print(arucoSineIdxList)
+    mtfAnalyzer = None
+    if arucoSineMetas is not None and mtfWorkers is not None:
+        mtfAnalyzer = AsyncMtfAnalyzer(arucoSineMetas, mtfWorkers, bayerPattern)
+    mtfAveragers = {} # arucoIdx -> [MtfTemporalAverager, frameCount last fed]
+    fieldMap = None # built on the first frame, when its size is known
+    fieldMapFed = {} # arucoIdx -> frameCount last added to fieldMap
+    tiltIntrinsics = None # (imgWh, cameraMatrix, distCoeffs) scaled to the frame size
+    # lens undistortion
+    if undistortMode is not None and (intrinsics is None or undistortCache is None):
+        warning('No intrinsics of {}, frames are not undistorted'.format(camName))
+        undistortMode = None
+    if undistortMode is not None and bayerPattern is not None:
+        warning('Raw Bayer frames of {} are not undistorted'.format(camName))
+        undistortMode = None
+    undistorter = None # FrameUndistorter of the ROI streamed
     # other args
     dateFormat = '%Y%m%d_%H%M%S.%f'
+    renderPeriodNs = 1e9/displayFps
 
-    ### Inner camera loop
-    frameCount = 0
-    fps = 0
+    ### Inner render loop
+    renderCount = 0
+    renderFps = 0
     FPS_AVG_GAP = 20
-    grabTime0 = time.time_ns()
-    print('Note that display fps is usually slow and unstable comparing to pure capture.')
-    while cam.IsGrabbing():
-        # Access the image data, convert
-        grabResult = cam.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-        if grabResult.GrabSucceeded():
-            img = converter.Convert(grabResult).GetArray()
-        grabResult.Release()
-        debug('One frame grabbed.')
-        frameCount += 1
-
-        # timing and show fps every 10 frames
-        if frameCount % FPS_AVG_GAP == 0:
-            grabTime1 = time.time_ns()
-            fps = 1e9/(grabTime1-grabTime0)*FPS_AVG_GAP
-            print('{:d} frames grabbed, \t display fps {:.2f} '.format(frameCount, fps), end='\r')
-            grabTime0 = grabTime1
-
-        ### add overlays to image
-        dispImg = np.copy(img)
-        if len(dispImg.shape) == 2: # if grayscale, to RGB for better text drawing
-            dispImg = cv.cvtColor(dispImg, cv.COLOR_GRAY2BGR)
-            
-        # fps
-        if showFps:
-            h, w, _ = dispImg.shape
-            fpsStr = 'Frame {:d}, fps {:.2f}'.format(frameCount, fps)
-            cv.putText(dispImg, fpsStr,
-                (np.round(w*0.01).astype(int), np.round(w*0.03).astype(int)),
-                cv.FONT_HERSHEY_SIMPLEX, w*0.0008,
-                (0,255,0), np.round(w*0.0012).astype(int), cv.LINE_AA, False)
-        
-        # ArUco markers
-        if arucoDetector is not None:
-            cornerList, idList, rejectedImgPoints = arucoDetector.detectMarkers(img)
-            if len(cornerList) > 0:
-                cv.aruco.drawDetectedMarkers(dispImg, cornerList, idList, (255,0,0))
-                draw_aruco_square_score(dispImg, cornerList)
-                draw_aruco_coordinate(dispImg, cornerList)
-        
-        # ArUco-Sine charts, note that img is aready grayscale
-        if arucoSineMetas is not None and len(cornerList) > 0:
-            # loop each marker found
-            for arucoCorner, arucoIdx in zip(cornerList, idList):
-                # see if the corner is in meta dict
-                if not (str(arucoIdx[0]) in arucoSineIdxList):
-                    continue
-                arucoCorner = np.array(arucoCorner, dtype=np.float32).reshape(4,2)
-                metaDict = arucoSineMetas[str(arucoIdx[0])]
-                # extract tiles
-                tileList, ppList, lpmmList = \
-                extract_sine_and_bw_tiles(img, arucoCorner, metaDict)
-                # calculate black/white contrast
-                bwTile = tileList[-1].astype(float)/255.0
-                commMode, diffMode = estimate_comm_diff_from_bw_tile(bwTile)
-                # calculate spectrum and MTF
-                mtfList = []
-                for tile, lpmm, pp in zip(tileList[:-1], lpmmList, ppList):
-                    mtf = estimate_mtf_from_sine_tile(tile.astype(float)/255.0, lpmm, pp, 
-                                                      commMode, diffMode, bezel_ratio=0.15)
-                    mtfList.append(mtf)
-                # find and draw sine block outline
-                sineCorner = find_sine_corner_list(arucoCorner, metaDict)
-                dispImg = draw_sine_block_outline_and_mtf(dispImg, sineCorner, lpmmList, mtfList)
+    renderTime0 = time.time_ns()
+    lastFrameCount = 0
+    img = None
+    dispImg = None
+    grabErrorShown = False
+    displayResizer = DisplayResizer(liveWindowName, windowWidth)
+    while True:
+        loopTime0 = time.time_ns()
+        # collect finished MTF jobs, also while no chart is in view
+        if mtfAnalyzer is not None:
+            mtfAnalyzer.poll()
+        # pick up the newest frame, skip rendering if nothing new
+        latest = grabber.latest
+        if latest is not None and latest[1] != lastFrameCount:
+            img, lastFrameCount, _ = latest
+            renderCount += 1
+            # raw Bayer frame, detect and display on the Gr plane
+            if bayerPattern is not None:
+                raw = img
+                img = bayer_planes(raw, bayerPattern)['Gr']
+                if bayerShift > 0:
+                    img = np.right_shift(img, bayerShift).astype(np.uint8)
+                else:
+                    img = np.ascontiguousarray(img)
+
+            # lens undistortion, maps of the ROI streamed, a frame of another ROI (e.g. just after
+            # a parameter change) is left distorted
+            frameUndistorter = None
+            if undistortMode is not None:
+                params = arrayParams[camSn]
+                roi = frameRoi(previewParams(params, previewFactor, previewMode) if previewOn else params)
+                if undistorter is None or undistorter.roi != roi:
+                    undistorter = undistortCache.get(camSn, intrinsics, roi)
+                if undistorter.frameWh == (img.shape[1], img.shape[0]):
+                    frameUndistorter = undistorter
+                else:
+                    debug('Frame of {}x{} is not of the ROI {}, not undistorted'.format(
+                        img.shape[1], img.shape[0], roi))
+            grabImg = img # kept distorted for frame grab
+            roiUndistorter = None # charts analyzed on undistorted ROIs
+            if frameUndistorter is not None:
+                if undistortMode == 'frame':
+                    img = frameUndistorter.undistort(img)
+                else:
+                    roiUndistorter = frameUndistorter
+
+            # field map of this frame size
+            if fieldMapLpmm is not None:
+                imgWh = (img.shape[1], img.shape[0])
+                if fieldMap is None or fieldMap.img_wh != imgWh:
+                    fieldMap = FieldMtfMap(imgWh, fieldMapBin)
+                    fieldMapFed = {}
+                fieldMap.new_frame()
+
+            # timing and show fps every FPS_AVG_GAP rendered frames
+            if renderCount % FPS_AVG_GAP == 0:
+                renderTime1 = time.time_ns()
+                renderFps = 1e9/(renderTime1-renderTime0)*FPS_AVG_GAP
+                print('{:d} frames grabbed, \t grab fps {:.2f}, \t render fps {:.2f} '.format(
+                    grabber.frameCount, grabber.fps, renderFps), end='\r')
+                renderTime0 = renderTime1
+
+            ### analysis on the full resolution frame
+            # ArUco markers
+            cornerList, idList = [], None
+            if arucoDetector is not None:
+                if arucoTracker is not None:
+                    cornerList, idList, rejectedImgPoints = arucoTracker.detect(img)
+                elif arucoScale is None:
+                    cornerList, idList, rejectedImgPoints = arucoDetector.detectMarkers(img)
+                else:
+                    cornerList, idList, rejectedImgPoints = detect_markers_pyramid(arucoDetector, img, arucoScale)
+
+            # marker tilt, all markers at once, charts tilted over maxTilt are not analyzed
+            # corners of charts are in the undistorted frame, in 'roi' mode moved there all at once
+            tiltList = None
+            chartCornerList, chartIdList = cornerList, idList
+            if roiUndistorter is not None and len(cornerList) > 0:
+                chartCornerList = list(roiUndistorter.undistortPoints(np.reshape(cornerList, (-1, 1, 4, 2))))
+            if intrinsics is not None and len(cornerList) > 0:
+                if frameUndistorter is not None: # no distortion left
+                    tiltList, _ = marker_tilt_batch(chartCornerList, frameUndistorter.cameraMatrix)
+                else:
+                    imgWh = (img.shape[1], img.shape[0])
+                    if tiltIntrinsics is None or tiltIntrinsics[0] != imgWh:
+                        tiltIntrinsics = (imgWh, *scaledIntrinsics(intrinsics, imgWh))
+                    tiltList, _ = marker_tilt_batch(cornerList, *tiltIntrinsics[1:])
+                chartCornerList = [c for c, tilt in zip(chartCornerList, tiltList) if tilt <= maxTilt]
+                chartIdList = np.reshape(idList, (-1, 1))[tiltList <= maxTilt]
             
+            # ArUco-Sine charts, note that img is aready grayscale
+            sineResultList = [] # (sineCorner, lpmmList, mtfList, title, mtfBand, metaDict)
+            if arucoSineMetas is not None and len(chartCornerList) > 0:
+                if mtfAnalyzer is not None: # analyze asynchronously, show the latest results
+                    if bayerPattern is None:
+                        mtfAnalyzer.submit(img, lastFrameCount, chartCornerList, chartIdList,
+                                           None if roiUndistorter is None else roiUndistorter.undistortRoi)
+                    else: # raw frame, corners in full resolution
+                        mtfAnalyzer.submit(raw, lastFrameCount, 
+                            [bayer_from_plane_corners(np.reshape(c, (4,2)), bayerPattern, 'Gr') for c in chartCornerList],
+                            chartIdList)
+                # loop each marker found
+                readyList = [] # (arucoCorner, metaDict, arucoIdx) with an async result
+                for arucoCorner, arucoIdx in zip(chartCornerList, chartIdList):
+                    # see if the corner is in meta dict
+                    if not (str(arucoIdx[0]) in arucoSineIdxList):
+                        continue
+                    arucoCorner = np.array(arucoCorner, dtype=np.float32).reshape(4,2)
+                    metaDict = arucoSineMetas[str(arucoIdx[0])]
+                    if mtfAnalyzer is None:
+                        if roiUndistorter is not None:
+                            sineCorner, lpmmList, mtfList = _analyzeUndistortedChart(img, arucoCorner, metaDict,
+                                                                                     roiUndistorter)
+                        elif bayerPattern is None:
+                            sineCorner, lpmmList, mtfList = analyze_aruco_sine_chart(img, arucoCorner, metaDict)
+                        else: # mtfList is a dict of color channels
+                            sineCorner, lpmmList, mtfList = analyze_aruco_sine_chart_bayer(
+                                raw, arucoCorner, metaDict, bayerPattern, corner_channel='Gr')
+                        title, mtfBand = None, None
+                        if fieldMap is not None:
+                            _feedFieldMap(fieldMap, fieldMapFed, str(arucoIdx[0]), lastFrameCount,
+                                          sineCorner, lpmmList, mtfList)
+                        if mtfAvgFrames is not None:
+                            mtfList, mtfBand, avgCount = _averageMtf(mtfAveragers, str(arucoIdx[0]), lastFrameCount,
+                                                                     lpmmList, mtfList, mtfAvgFrames)
+                            title = 'avg {:d} fr'.format(avgCount)
+                        sineResultList.append((sineCorner, lpmmList, mtfList, title, mtfBand, metaDict))
+                    elif str(arucoIdx[0]) in mtfAnalyzer.resultDict:
+                        readyList.append((arucoCorner, metaDict, str(arucoIdx[0])))
+                # outlines at current location of all charts at once, MTF tagged with its frame age
+                if len(readyList) > 0:
+                    arucoCorners, metaList, readyIdxList = zip(*readyList)
+                    sineCorners = find_sine_corner_list_batch(np.stack(arucoCorners), metaList)
+                    for sineCorner, metaDict, arucoIdx in zip(sineCorners, metaList, readyIdxList):
+                        resultFrameCount, _, lpmmList, mtfList = mtfAnalyzer.resultDict[arucoIdx]
+                        title = 'age {:d} fr'.format(lastFrameCount - resultFrameCount)
+                        mtfBand = None
+                        if fieldMap is not None: # MTF of an older frame, mapped at the current location
+                            _feedFieldMap(fieldMap, fieldMapFed, arucoIdx, resultFrameCount,
+                                          sineCorner, lpmmList, mtfList)
+                        if mtfAvgFrames is not None:
+                            mtfList, mtfBand, avgCount = _averageMtf(mtfAveragers, arucoIdx, resultFrameCount,
+                                                                     lpmmList, mtfList, mtfAvgFrames)
+                            title += ', avg {:d}'.format(avgCount)
+                        sineResultList.append((sineCorner, lpmmList, mtfList, title, mtfBand, metaDict))
 
-        # show image
-        cv.namedWindow(liveWindowName, cv.WINDOW_NORMAL)
-        cv.imshow(liveWindowName, dispImg)
-        debug('One frame shown.')
+            ### downscale once to the window, draw overlays in display coordinates
+            overlayOn = showFps or len(cornerList) > 0 or histOverlay is not None \
+                        or (fieldMap is not None and fieldMap.chart_count > 0)
+            dispImg, dispScale = displayResizer.resize(img, overlayOn)
+            # fps and histogram of this frame
+            fpsStr = None
+            if showFps:
+                fpsStr = 'Frame {:d}, grab fps {:.2f}, render fps {:.2f}'.format(
+                    lastFrameCount, grabber.fps, renderFps)
+            if histOverlay is not None:
+                histOverlay.update(img)
+            # kept for a full resolution snapshot
+            overlayArgs = (fpsStr, cornerList, idList, tiltList, maxTilt,
+                           fieldMap, fieldMapLpmm, sineResultList, roiUndistorter, histOverlay)
+            dispImg = _drawOverlays(dispImg, dispScale, *overlayArgs)
 
-        # show histogram upon request
-        if histBins is not None:
-            dispHist(img, histBins, fig, ax, lineR, lineG, lineB)
+            # show image
+            cv.imshow(liveWindowName, dispImg)
+            debug('One frame shown.')
+        # the grab thread stopped, tell on the last frame shown
+        elif grabber.error is not None and not grabErrorShown:
+            grabErrorShown = True
+            if dispImg is None:
+                errImg = np.zeros((480, 640, 3), np.uint8)
+            elif dispImg.ndim == 2:
+                errImg = cv.cvtColor(dispImg, cv.COLOR_GRAY2BGR)
+            else:
+                errImg = np.copy(dispImg)
+            w = errImg.shape[1]
+            cv.putText(errImg, 'Grab thread stopped: {}'.format(grabber.error),
+                (np.round(w*0.01).astype(int), np.round(w*0.06).astype(int)),
+                cv.FONT_HERSHEY_SIMPLEX, w*0.0008,
+                (0,0,255), max(1, np.round(w*0.0012).astype(int)), cv.LINE_AA, False)
+            cv.imshow(liveWindowName, errImg)
 
-        # refresh parameters if needed
-        arrayParams = configArrayIfParamChanges(camList, arrayParamsLoader, arrayParams)
+        # refresh parameters if needed, the file checked without the camera lock,
+        # which the grab thread holds while waiting for a frame, only a change is applied under it
+        if arrayParamsLoader.changedAfterLastLoad():
+            with camLock:
+                arrayParamsNew = configArrayIfParamChanges(camList, arrayParamsLoader, arrayParams)
+                if previewOn and not arrayParamsNew is arrayParams:
+                    # changes are written at full resolution, re-apply preview on top
+                    params = arrayParamsNew[camSn]
+                    setCamParams(cam, previewParams(params, previewFactor, previewMode), params)
+                arrayParams = arrayParamsNew
 
-        # wait for keyboard input, change if needed
-        nextCamInd = opencvKeyWatcher(nextCamInd)
+        # wait for keyboard input until next render, change if needed
+        waitTime = int((renderPeriodNs - (time.time_ns() - loopTime0)) / 1e6)
+        nextCamInd = opencvKeyWatcher(nextCamInd, max(waitTime, 1))
         if isinstance(nextCamInd, int):
             if nextCamInd == camInd: # no change, keep running
                 continue
             else: # changed, break(-1)
                 debug('Break from inner livestream loop, nextCamInd {}'.format(nextCamInd))
                 break
-        elif isinstance(nextCamInd, str):
+        elif nextCamInd == 'm': # switch to mosaic
+            debug('Break from inner livestream loop to mosaic')
+            break
+        elif nextCamInd == 'p': # toggle preview
+            params = arrayParams[camSn]
+            preview = previewParams(params, previewFactor, previewMode)
+            with camLock:
+                if previewOn:
+                    setCamParams(cam, fullResParams(params), preview)
+                else:
+                    setCamParams(cam, preview, params)
+            previewOn = not previewOn
+            print('\nPreview mode {}'.format('on' if previewOn else 'off'))
+        elif nextCamInd == 'c': # clear field map
+            if fieldMap is not None:
+                fieldMap.reset()
+                fieldMapFed = {}
+                print('\nField MTF map cleared')
+        elif isinstance(nextCamInd, str) and img is not None:
             # timestamp
             timestamp = datetime.now().strftime(dateFormat)[:-4]
             if nextCamInd == 's':
-                # snapshot
+                # snapshot, overlays drawn again on the frame at full resolution
                 imgFn = 'cam{:d}_snapshot_{:s}.png'.format(camInd, timestamp)
-                if not cv.imwrite(imgFn, dispImg):
+                snapImg = cv.cvtColor(img, cv.COLOR_GRAY2BGR) if img.ndim == 2 else np.copy(img)
+                snapImg = _drawOverlays(snapImg, 1.0, *overlayArgs)
+                if not cv.imwrite(imgFn, snapImg):
                     error('Cannot save image {:s}. Check problem.'.format(imgFn))
                 else:
                     print('\nSnapshot saved to {:s}'.format(imgFn))
             elif nextCamInd == 'f':
-                # frame grab
+                # frame grab, always at full resolution, undistorted from the grabbed frame,
+                # raw Bayer frames saved as grabbed, 16 bit PNG beyond 8 bits
                 imgFn = 'cam{:d}_frame_{:s}.png'.format(camInd, timestamp)
-                if not cv.imwrite(imgFn, img):
+                frameImg = img if bayerPattern is None else raw
+                if previewOn:
+                    params = arrayParams[camSn]
+                    frameImg = grabFullResFrame(cam, converter if bayerPattern is None else None, params,
+                                                previewParams(params, previewFactor, previewMode), camLock)
+                    if frameImg is not None and undistortMode is not None:
+                        frameImg = undistortCache.get(camSn, intrinsics, frameRoi(params)).undistort(
+                            frameImg, cv.INTER_CUBIC)
+                elif frameUndistorter is not None:
+                    frameImg = frameUndistorter.undistort(grabImg, cv.INTER_CUBIC)
+                if frameImg is None or not cv.imwrite(imgFn, frameImg):
                     error('Cannot save image {:s}. Check problem.'.format(imgFn))
                 else:
                     print('\nFrame saved to {:s}'.format(imgFn))
@@ -248,8 +832,153 @@ def singleCamlivestream(camList, arrayParamsLoader, converter,
         nextCamInd = camInd
 
     ### cleanup
+    grabber.stop()
     cam.StopGrabbing()
+    if mtfAnalyzer is not None:
+        mtfAnalyzer.close()
+    if previewOn: # restore full resolution
+        params = arrayParams[camSn]
+        setCamParams(cam, fullResParams(params), previewParams(params, previewFactor, previewMode))
     cv.destroyAllWindows()
-    plt.close('all')
     print('\nLivestream ends.')
     return nextCamInd, arrayParams
+
+########################################
+### Camera array mosaic livestream
+########################################
+def _mosaicGrid(camAmount):
+    """
+    Return (rows, cols) of a near-square grid holding camAmount tiles
+    """
+    cols = int(np.ceil(np.sqrt(camAmount)))
+    rows = int(np.ceil(camAmount / cols))
+    return rows, cols
+
+def arrayMosaicLivestream(camList, arrayParamsLoader, converter,
+                          arrayParams,
+                          bandwidthBudget=300e6,
+                          tileWidth=640,
+                          displayFps=10,
+                          showFps=False,
+                          previewFactor=None,
+                          previewMode='binning'
+                         ):
+    """
+    Stream all cameras at once, tiled into one window. Including init, loop, and cleanup.
+    Each camera's frame rate is capped such that the sum of all payloads per second
+        stays under bandwidthBudget (bytes/s). The cap is applied on the cameras,
+        and their original parameters are restored on exit.
+    Each camera gets a grab thread. The render loop resizes the newest frame of each camera
+        into its tile of a preallocated canvas, at most at displayFps.
+    tileWidth is the width of each tile in pixels, its height follows the first camera's aspect ratio.
+        Each camera's frame is fit into its tile keeping its own aspect ratio, letterboxed.
+    If previewFactor is not None, cameras also bin/decimate (previewMode) the sensor
+        by previewFactor, leaving more bandwidth for frame rate.
+    The parameter file is not reloaded during mosaic. Changes are applied when going back
+        to the single camera livestream.
+    Return nextCamInd (-1 or a camera index) and arrayParams, like singleCamlivestream.
+    Known issue: with more than 4 cameras in one process grabbing may fail, see README.
+    """
+    ### initializing
+    camAmount = len(camList)
+    snList = [cam.GetDeviceInfo().GetSerialNumber() for cam in camList]
+    nameList = [arrayParams[sn]['name'] for sn in snList]
+    windowName = 'mosaic'
+    # bin/decimate if needed, then cap frame rate to fit the bandwidth budget
+    mosaicParamsList = []
+    for cam, sn in zip(camList, snList):
+        params = arrayParams[sn]
+        mosaicParams = dict(params)
+        if previewFactor is not None:
+            mosaicParams = previewParams(params, previewFactor, previewMode)
+            setCamParams(cam, mosaicParams, params)
+        mosaicParamsList.append(mosaicParams)
+    payloadSum = sum([cam.PayloadSize.GetValue() for cam in camList]) # bytes per round
+    fpsCap = bandwidthBudget / payloadSum
+    for cam, sn, mosaicParams in zip(camList, snList, mosaicParamsList):
+        fps = mosaicParams['AcquisitionFrameRate']
+        if fps <= 0 or fps > fpsCap:
+            mosaicParams['AcquisitionFrameRate'] = fpsCap
+            setCamParams(cam, mosaicParams, dict(mosaicParams, AcquisitionFrameRate=fps))
+    info('Mosaic frame rate capped at {:.2f} fps for a {:.1f} MB/s budget'.format(
+        fpsCap, bandwidthBudget/1e6))
+    # preallocate canvas, tile size by the first camera's aspect ratio
+    rows, cols = _mosaicGrid(camAmount)
+    params = mosaicParamsList[0]
+    tileW = int(tileWidth)
+    tileH = int(np.round(tileWidth * params['Height'] / params['Width']))
+    canvas = np.zeros((rows*tileH, cols*tileW, 3), dtype=np.uint8)
+    tileViewList = []
+    for a in range(camAmount):
+        r, c = divmod(a, cols)
+        tileViewList.append(canvas[r*tileH:(r+1)*tileH, c*tileW:(c+1)*tileW])
+    fitList = [None] * camAmount # per camera (frame shape, letterboxed view of its tile, grayscale buffer)
+    # start grabbing
+    grabberList = []
+    for cam, name in zip(camList, nameList):
+        cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        grabber = LatestFrameGrabber(cam, converter, threading.Lock(), name)
+        grabber.start()
+        grabberList.append(grabber)
+    renderPeriodNs = 1e9/displayFps
+
+    ### render loop
+    nextCamInd = 'm'
+    lastFrameCountList = [0] * camAmount
+    cv.namedWindow(windowName, cv.WINDOW_NORMAL)
+    while True:
+        loopTime0 = time.time_ns()
+        # refresh changed tiles
+        for a, grabber in enumerate(grabberList):
+            latest = grabber.latest
+            if latest is None or latest[1] == lastFrameCountList[a]:
+                continue
+            img, lastFrameCountList[a], _ = latest
+            tileView = tileViewList[a]
+            # fit the frame into the tile, recomputed only when the frame shape changes
+            if fitList[a] is None or fitList[a][0] != img.shape:
+                imgH, imgW = img.shape[:2]
+                fitScale = min(tileW/imgW, tileH/imgH)
+                fitW = max(1, min(tileW, int(np.round(imgW*fitScale))))
+                fitH = max(1, min(tileH, int(np.round(imgH*fitScale))))
+                x0, y0 = (tileW-fitW)//2, (tileH-fitH)//2
+                tileView[:] = 0
+                fitList[a] = (img.shape, tileView[y0:y0+fitH, x0:x0+fitW], 
+                              np.zeros((fitH, fitW), dtype=np.uint8) if img.ndim == 2 else None)
+            _, fitView, grayBuf = fitList[a]
+            if img.ndim == 2:
+                cv.resize(img, grayBuf.shape[::-1], dst=grayBuf, interpolation=cv.INTER_AREA)
+                cv.cvtColor(grayBuf, cv.COLOR_GRAY2BGR, dst=fitView)
+            else:
+                cv.resize(img, fitView.shape[1::-1], dst=fitView, interpolation=cv.INTER_AREA)
+            # label
+            labelStr = 'cam{} {}'.format(a, nameList[a])
+            if showFps:
+                labelStr += ' {:.1f} fps'.format(grabber.fps)
+            cv.putText(tileView, labelStr,
+                (np.round(tileW*0.02).astype(int), np.round(tileW*0.06).astype(int)),
+                cv.FONT_HERSHEY_SIMPLEX, tileW*0.0012,
+                (0,255,0), max(1, np.round(tileW*0.003).astype(int)), cv.LINE_AA, False)
+        cv.imshow(windowName, canvas)
+
+        # wait for keyboard input until next render
+        waitTime = int((renderPeriodNs - (time.time_ns() - loopTime0)) / 1e6)
+        nextCamInd = opencvKeyWatcher(nextCamInd, max(waitTime, 1))
+        if isinstance(nextCamInd, int):
+            if nextCamInd < camAmount: # ESC (-1) or a valid camera
+                debug('Break from mosaic loop, nextCamInd {}'.format(nextCamInd))
+                break
+            warning('No camera with index {}, continue mosaic'.format(nextCamInd))
+        elif nextCamInd != 'm':
+            warning('Key {} not supported in mosaic, continue display'.format(nextCamInd))
+        nextCamInd = 'm'
+
+    ### cleanup
+    for cam, grabber in zip(camList, grabberList):
+        grabber.stop()
+        cam.StopGrabbing()
+    for cam, sn, mosaicParams in zip(camList, snList, mosaicParamsList):
+        setCamParams(cam, fullResParams(arrayParams[sn]), mosaicParams)
+    cv.destroyAllWindows()
+    print('\nMosaic livestream ends.')
+    return nextCamInd, arrayParams
@@ -0,0 +1,233 @@
+"""
+Codes to monitor the MTF of ArUco-Sine charts over long durations, headless
+
+check the notes in __init__.py for some overall ideas.
+
+Monitoring logic:
+Focus drifts slowly, e.g. as the cameras warm up, so a frame every few seconds is enough, but the run lasts hours.
+No window is shown. Every interval, each camera grabs one frame, ArUco-Sine charts are found and their MTF estimated,
+the same path as the livestream takes.
+Every sine tile becomes a fixed size binary record (MONITOR_DTYPE), appended to a .bin file and flushed per sample,
+so the file grows linearly and an interrupted run keeps all samples but the last one.
+A .json header next to it describes the record dtype and the cameras.
+Running statistics (Welford) of each (camera, chart, lpmm) are kept in memory, its size not growing with time,
+and printed every few samples.
+The records can be read back with loadMonitorRecords, or plotted with mtf_monitor_plot.py.
+
+Known issue:
+Cameras are sampled one after another, thus the records of one sample are a few hundred ms apart.
+"""
+
+import json
+import time
+import pathlib
+import logging
+from logging import critical, error, info, warning, debug
+from datetime import datetime
+
+import numpy as np
+
+from .intrinsics import scaledIntrinsics
+from target_toolbox.aruco_marker import detect_markers_pyramid, marker_tilt_batch
+from target_toolbox.aruco_sine_chart import analyze_aruco_sine_chart
+
+# one record per sine tile per sample, packed, 27 bytes
+MONITOR_DTYPE = np.dtype([('timeNs', '<i8'),  # time.time_ns() of the grab
+                          ('sample', '<u4'),  # sample index
+                          ('cam', '<u1'),     # camera index in arrayParams
+                          ('chart', '<u2'),   # ArUco index of the chart
+                          ('lpmm', '<f4'),
+                          ('mtf', '<f4'),
+                          ('temp', '<f4')])   # camera DeviceTemperature, nan if unavailable
+
+########################################
+### Running statistics
+########################################
+class RunningStats():
+    """
+    Welford's online mean and variance, with min, max and the last value
+    Memory is constant regardless of the amount of values
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.last = np.nan
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        self.last = x
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+########################################
+### Record file
+########################################
+def _headerPath(binPath):
+    return pathlib.Path(binPath).with_suffix('.json')
+
+def loadMonitorRecords(binPath):
+    """
+    Read a monitor record file, without loading it to memory
+    Return the header dict and a structured memmap of MONITOR_DTYPE records
+    """
+    with open(_headerPath(binPath), 'r') as fp:
+        header = json.load(fp)
+    dtype = np.dtype([tuple(field) for field in header['dtype']])
+    # a record cut by an interruption is ignored
+    amount = pathlib.Path(binPath).stat().st_size // dtype.itemsize
+    if amount == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(binPath, dtype=dtype, mode='r', shape=(amount,))
+
+def _camTemperature(cam):
+    """
+    Camera device temperature in Celsius, nan if not supported
+    pypylon is not imported here, such that records can be read without it
+    """
+    try:
+        return cam.DeviceTemperature.Value
+    except Exception: # node not available
+        return np.nan
+
+########################################
+### Monitor loop
+########################################
+def arrayMtfMonitor(camList, converter, arrayParams,
+                    arucoDetector, arucoSineMetas,
+                    outPath,
+                    interval=10.0,
+                    duration=None,
+                    arucoScale=None,
+                    printGap=10,
+                    timeout=5000,
+                    intrinsics=None,
+                    maxTilt=10.0):
+    """
+    Headless MTF monitoring of all cameras. Including init, loop, and cleanup.
+    Every interval seconds, each camera grabs one frame with the given converter (Mono8 expected),
+        markers are detected by arucoDetector (on the frame downscaled by arucoScale if not None),
+        and every chart in arucoSineMetas found is analyzed.
+    Records are appended to outPath (.bin), see MONITOR_DTYPE, with a .json header next to it.
+        An existing file of the same cameras and dtype is appended to, such that a run can be continued.
+    If intrinsics is not None, a dict of intrinsics keyed by SN (see intrinsics.py), charts of those cameras
+        tilted more than maxTilt degrees are not recorded.
+    Stops after duration seconds if not None, or on KeyboardInterrupt.
+    Running statistics are printed every printGap samples, and returned as a dict,
+        keyed by (camera name, chart, lpmm), valued by RunningStats
+    """
+    ### initializing
+    assert arucoDetector is not None and arucoSineMetas is not None, \
+        'MTF monitoring needs an arucoDetector and arucoSineMetas'
+    binPath = pathlib.Path(outPath)
+    binPath.parent.mkdir(parents=True, exist_ok=True)
+    # camera index and names of the records
+    camIndList, camNameList, camIntrinsicsList = [], [], []
+    for cam in camList:
+        camSn = cam.GetDeviceInfo().GetSerialNumber()
+        camIndList.append(arrayParams[camSn]['index'])
+        camNameList.append(arrayParams[camSn]['name'])
+        camIntrinsicsList.append(None if intrinsics is None else intrinsics.get(camSn))
+    header = {'dtype': [[name, MONITOR_DTYPE[name].str] for name in MONITOR_DTYPE.names],
+              'cameras': {str(ind): name for ind, name in zip(camIndList, camNameList)},
+              'interval': interval,
+              'start': datetime.now().strftime('%Y%m%d_%H%M%S')}
+    sampleCount = 0
+    if binPath.exists() and _headerPath(binPath).exists():
+        oldHeader, records = loadMonitorRecords(binPath)
+        assert oldHeader['dtype'] == header['dtype'] and oldHeader['cameras'] == header['cameras'], \
+            'Existing {} has different cameras or record format'.format(binPath)
+        header['start'] = oldHeader['start']
+        recordAmount = len(records)
+        if recordAmount > 0:
+            sampleCount = int(records['sample'][-1]) + 1
+        del records
+        # drop a record cut by an interruption
+        with open(binPath, 'r+b') as fp:
+            fp.truncate(recordAmount*MONITOR_DTYPE.itemsize)
+        info('Continue monitoring {} from sample {}'.format(binPath, sampleCount))
+    with open(_headerPath(binPath), 'w') as fp:
+        json.dump(header, fp, indent=4)
+    statsDict = {}
+
+    ### sampling loop
+    print('Monitoring {} cameras every {:.1f} s into {}, ctrl+c to stop'.format(len(camList), interval, binPath))
+    startTime = time.time()
+    nextTime = startTime
+    try:
+        with open(binPath, 'ab') as fp:
+            while duration is None or time.time() - startTime < duration:
+                # wait for the next sample
+                time.sleep(max(0, nextTime - time.time()))
+                nextTime += interval
+                recordList = []
+                for cam, camInd, camName, camIntrinsics in zip(camList, camIndList, camNameList, camIntrinsicsList):
+                    grabTime = time.time_ns()
+                    grabResult = cam.GrabOne(timeout)
+                    if not grabResult.GrabSucceeded():
+                        error('{} grab failed: {}'.format(camName, grabResult.GetErrorDescription()))
+                        grabResult.Release()
+                        continue
+                    img = converter.Convert(grabResult).GetArray()
+                    grabResult.Release()
+                    temp = _camTemperature(cam)
+                    # the same path as the livestream
+                    if arucoScale is None:
+                        cornerList, idList, _ = arucoDetector.detectMarkers(img)
+                    else:
+                        cornerList, idList, _ = detect_markers_pyramid(arucoDetector, img, arucoScale)
+                    if idList is None:
+                        continue
+                    tiltList = np.zeros(len(cornerList))
+                    if camIntrinsics is not None:
+                        tiltList, _ = marker_tilt_batch(cornerList, *scaledIntrinsics(camIntrinsics, img.shape[1::-1]))
+                    for arucoCorner, arucoIdx, tilt in zip(cornerList, np.reshape(idList, -1), tiltList):
+                        if not str(arucoIdx) in arucoSineMetas:
+                            continue
+                        if tilt > maxTilt:
+                            debug('{} chart {} tilted {:.1f} deg, not recorded'.format(camName, arucoIdx, tilt))
+                            continue
+                        arucoCorner = np.array(arucoCorner, dtype=np.float32).reshape(4,2)
+                        try:
+                            _, lpmmList, mtfList = analyze_aruco_sine_chart(
+                                img, arucoCorner, arucoSineMetas[str(arucoIdx)])
+                        except Exception as e: # a chart partially out of frame may fail, keep others
+                            error('{} chart {} analysis failed: {}'.format(camName, arucoIdx, e))
+                            continue
+                        for lpmm, mtf in zip(lpmmList, mtfList):
+                            recordList.append((grabTime, sampleCount, camInd, arucoIdx, lpmm, mtf, temp))
+                            statsDict.setdefault((camName, int(arucoIdx), float(lpmm)), RunningStats()).update(float(mtf))
+                # one write per sample
+                np.array(recordList, dtype=MONITOR_DTYPE).tofile(fp)
+                fp.flush()
+                debug('Sample {} with {} records'.format(sampleCount, len(recordList)))
+                sampleCount += 1
+                if sampleCount % printGap == 0:
+                    printMonitorStats(statsDict, sampleCount, time.time() - startTime)
+                if time.time() > nextTime:
+                    warning('Sample {} took longer than the interval {:.1f} s'.format(sampleCount-1, interval))
+                    nextTime = time.time()
+    except KeyboardInterrupt:
+        print('Monitoring stopped')
+
+    ### cleanup
+    if len(statsDict) > 0 and sampleCount % printGap != 0: # not just printed
+        printMonitorStats(statsDict, sampleCount, time.time() - startTime)
+    return statsDict
+
+def printMonitorStats(statsDict, sampleCount, elapsed):
+    print('Sample {:d}, {:.0f} s elapsed'.format(sampleCount, elapsed))
+    print('{:>12s} {:>6s} {:>6s} {:>6s} {:>7s} {:>7s} {:>7s} {:>7s} {:>7s}'.format(
+        'camera', 'chart', 'lpmm', 'n', 'last', 'mean', 'std', 'min', 'max'))
+    for (camName, arucoIdx, lpmm), stats in sorted(statsDict.items()):
+        print('{:>12s} {:>6d} {:>6.3g} {:>6d} {:>7.4f} {:>7.4f} {:>7.4f} {:>7.4f} {:>7.4f}'.format(
+            camName, arucoIdx, lpmm, stats.n, stats.last, stats.mean, stats.std, stats.min, stats.max))
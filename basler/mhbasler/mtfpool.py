@@ -0,0 +1,139 @@
+"""
+Codes to analyze ArUco-Sine charts asynchronously during livestream
+
+check the notes in __init__.py for some overall ideas.
+
+Asynchronous analysis logic:
+MTF estimation of ArUco-Sine charts is much slower than grabbing and displaying.
+The render loop detects ArUco markers, crops the ROI of each chart found, and submits them to a process pool.
+At most one job per worker is in flight. If all workers are busy, the frame is simply not analyzed, thus the analysis never blocks.
+The most recent result of each chart is kept, tagged with the frame count it came from, so the display can show its age.
+Workers are spawned, not forked, to stay away from the camera driver's threads.
+"""
+
+import sys
+sys.path.append('/home/dbg/Desktop/camera_control_scripts/target_workbench')
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import logging
+from logging import critical, error, info, warning, debug
+
+import numpy as np
+
+from target_toolbox.aruco_sine_chart import analyze_aruco_sine_chart, analyze_aruco_sine_chart_bayer, find_chart_roi
+
+########################################
+### Worker side
+########################################
+_workerMetas = None
+_workerBayerPattern = None
+
+def _initWorker(arucoSineMetas, bayerPattern=None):
+    """
+    Keep the chart metas in the worker process, so they are not sent with every job
+    """
+    global _workerMetas, _workerBayerPattern
+    _workerMetas = arucoSineMetas
+    _workerBayerPattern = bayerPattern
+
+def _analyzeCharts(frameCount, chartList):
+    """
+    Analyze a list of (arucoIdx, roiImg, arucoCorner, roiOffset) of one frame
+    arucoCorner is in ROI coordinate, results are moved back to frame coordinate
+    Return frameCount and a list of (arucoIdx, sineCorner, lpmmList, mtfList)
+    For raw Bayer frames, mtfList is a dict of color channel -> MTF list
+    """
+    resultList = []
+    for arucoIdx, roiImg, arucoCorner, roiOffset in chartList:
+        try:
+            if _workerBayerPattern is None:
+                sineCorner, lpmmList, mtfList = analyze_aruco_sine_chart(
+                    roiImg, arucoCorner, _workerMetas[arucoIdx])
+            else:
+                sineCorner, lpmmList, mtfList = analyze_aruco_sine_chart_bayer(
+                    roiImg, arucoCorner, _workerMetas[arucoIdx], _workerBayerPattern)
+        except Exception as e: # a chart partially out of frame may fail, keep others
+            error('Chart {} analysis failed: {}'.format(arucoIdx, e))
+            continue
+        resultList.append((arucoIdx, sineCorner + np.array(roiOffset), lpmmList, mtfList))
+    return frameCount, resultList
+
+########################################
+### Main process side
+########################################
+class AsyncMtfAnalyzer():
+    """
+    A process pool analyzing ArUco-Sine charts at its own pace
+    submit() never blocks, poll() collects finished results into self.resultDict,
+    keyed by ArUco index (str), valued by (frameCount, sineCorner, lpmmList, mtfList)
+    poll() is meant to be called once per render loop, whether charts are submitted or not,
+    submit() counts busy workers by the jobs left pending at the last poll()
+    """
+    def __init__(self, arucoSineMetas, workers=2, bayerPattern=None):
+        """
+        Args:
+            arucoSineMetas: dict of chart meta dicts, the key being ArUco index (str)
+            workers: amount of worker processes
+            bayerPattern: if not None, e.g. 'RG', frames submitted are raw Bayer frames,
+                and each color plane is analyzed
+        """
+        self.arucoSineMetas = arucoSineMetas
+        self.workers = workers
+        self.bayerPattern = bayerPattern
+        self.pool = ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'),
+                                        initializer=_initWorker, initargs=(arucoSineMetas, bayerPattern))
+        self.futureList = []
+        self.resultDict = {}
+
+    def poll(self):
+        """
+        Collect finished jobs, keep the newest result of each chart
+        """
+        pendingList = []
+        for future in self.futureList:
+            if not future.done():
+                pendingList.append(future)
+                continue
+            try:
+                frameCount, resultList = future.result()
+            except Exception as e:
+                error('MTF analysis job failed: {}'.format(e))
+                continue
+            for arucoIdx, sineCorner, lpmmList, mtfList in resultList:
+                if arucoIdx in self.resultDict and self.resultDict[arucoIdx][0] > frameCount:
+                    continue
+                self.resultDict[arucoIdx] = (frameCount, sineCorner, lpmmList, mtfList)
+        self.futureList = pendingList
+
+    def submit(self, img, frameCount, cornerList, idList, roiFunc=None):
+        """
+        Submit the charts found in a frame if a worker was free at the last poll()
+        Only the chart ROIs are copied and sent
+        If roiFunc is not None, ROIs are taken by roiFunc(img, x0, y0, x1, y1) instead of sliced,
+            e.g. FrameUndistorter.undistortRoi, cornerList being in its coordinate
+        Return True if submitted, False if skipped
+        """
+        if len(self.futureList) >= self.workers:
+            debug('All MTF workers busy, frame {} skipped'.format(frameCount))
+            return False
+        chartList = []
+        for arucoCorner, arucoIdx in zip(cornerList, np.reshape(idList, -1)):
+            arucoIdx = str(arucoIdx)
+            if not arucoIdx in self.arucoSineMetas:
+                continue
+            arucoCorner = np.array(arucoCorner, dtype=np.float32).reshape(4,2)
+            x0, y0, x1, y1 = find_chart_roi(arucoCorner, self.arucoSineMetas[arucoIdx], img.shape)
+            if self.bayerPattern is not None: # keep the Bayer pattern of the ROI
+                x0, y0 = x0 - x0 % 2, y0 - y0 % 2
+            if roiFunc is None:
+                roiImg = np.ascontiguousarray(img[y0:y1, x0:x1])
+            else:
+                roiImg = roiFunc(img, x0, y0, x1, y1)
+            chartList.append((arucoIdx, roiImg, arucoCorner - np.array([x0, y0], dtype=np.float32), (x0, y0)))
+        if len(chartList) == 0:
+            return False
+        self.futureList.append(self.pool.submit(_analyzeCharts, frameCount, chartList))
+        return True
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
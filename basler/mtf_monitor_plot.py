@@ -0,0 +1,127 @@
+"""
+Codes to plot the records of a headless MTF monitoring run
+By Minghao, 2023 Mar
+
+Plotting logic:
+array_cam_disp.py --sine --monitor <file.bin> appends one binary record per sine tile per sample, check mhbasler/monitor.py.
+The records are memory mapped, no frame is needed. One subplot per camera and chart, one line per lpmm,
+MTF against the hours since the first record, optionally smoothed by a moving average.
+Camera temperature, if recorded, is drawn on a second y axis.
+A table of the statistics of each (camera, chart, lpmm) is printed, including the drift between the first and the last samples.
+"""
+
+import sys
+sys.path.append('/home/dbg/Desktop/camera_control_scripts/target_workbench')
+import argparse
+import logging
+from logging import critical, error, info, warning, debug
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from mhbasler.monitor import loadMonitorRecords
+
+########################################
+### Argument parsing and logging setup
+########################################
+def parseArguments():
+    """
+    Read arguments from the command line
+    """
+    ### compose parser
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('records', type=str,
+                        help='The .bin record file of a monitoring run, with its .json header next to it.')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Save the figure to this file instead of showing it.')
+    parser.add_argument('-c', '--cam_ind_list', nargs='+', type=int, default=None,
+                        help='Camera indices to plot. Default all.')
+    parser.add_argument('--chart', nargs='+', type=int, default=None,
+                        help='ArUco indices of the charts to plot. Default all.')
+    parser.add_argument('--smooth', type=int, default=1,
+                        help='Moving average window, in samples.')
+    parser.add_argument('--drift_samples', type=int, default=10,
+                        help='Amount of samples averaged at both ends for the drift.')
+    parser.add_argument('-v', '--verbose', type=int, default=1,
+                        help='Verbosity of logging: 0-critical, 1-error, 2-warning, 3-info, 4-debug')
+    ### parse args
+    args = parser.parse_args()
+    ### set logging
+    vTable = {0: logging.CRITICAL, 1: logging.ERROR, 2: logging.WARNING,
+              3: logging.INFO, 4: logging.DEBUG}
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=vTable[args.verbose], stream=sys.stdout)
+
+    return args
+
+def movingAverage(x, window):
+    """
+    Moving average, the first window-1 values averaged over what is available
+    """
+    if window <= 1 or len(x) == 0:
+        return x
+    cs = np.cumsum(np.insert(x, 0, 0.0))
+    n = np.minimum(np.arange(1, len(x)+1), window)
+    return (cs[1:] - cs[np.arange(1, len(x)+1) - n]) / n
+
+########################################
+### Main function
+########################################
+def main(args):
+    header, records = loadMonitorRecords(args.records)
+    assert len(records) > 0, 'No record in {}'.format(args.records)
+    info('{} records of {} samples loaded'.format(len(records), int(records['sample'].max())+1))
+    hours = (records['timeNs'] - records['timeNs'].min()) / 3600e9
+    # pick the curves
+    camIndList = sorted(set(records['cam'].tolist()))
+    if args.cam_ind_list is not None:
+        camIndList = [camInd for camInd in camIndList if camInd in args.cam_ind_list]
+    chartList = sorted(set(records['chart'].tolist()))
+    if args.chart is not None:
+        chartList = [chart for chart in chartList if chart in args.chart]
+    panelList = [(camInd, chart) for camInd in camIndList for chart in chartList
+                 if np.any((records['cam'] == camInd) & (records['chart'] == chart))]
+    assert len(panelList) > 0, 'No record of the cameras and charts asked'
+
+    ### plot and print statistics
+    print('{:>12s} {:>6s} {:>6s} {:>6s} {:>7s} {:>7s} {:>7s} {:>7s} {:>7s}'.format(
+        'camera', 'chart', 'lpmm', 'n', 'mean', 'std', 'min', 'max', 'drift'))
+    fig, axList = plt.subplots(len(panelList), 1, sharex=True, squeeze=False,
+                               figsize=(10, 3*len(panelList)))
+    for ax, (camInd, chart) in zip(axList[:,0], panelList):
+        camName = header['cameras'].get(str(camInd), str(camInd))
+        panelMask = (records['cam'] == camInd) & (records['chart'] == chart)
+        for lpmm in sorted(set(records['lpmm'][panelMask].tolist())):
+            mask = panelMask & (records['lpmm'] == lpmm)
+            mtf = np.asarray(records['mtf'][mask], dtype=float)
+            ax.plot(hours[mask], movingAverage(mtf, args.smooth), label='{:.3g} lp/mm'.format(lpmm))
+            k = min(args.drift_samples, len(mtf))
+            print('{:>12s} {:>6d} {:>6.3g} {:>6d} {:>7.4f} {:>7.4f} {:>7.4f} {:>7.4f} {:>+7.4f}'.format(
+                camName, chart, lpmm, len(mtf), mtf.mean(), mtf.std(), mtf.min(), mtf.max(),
+                mtf[-k:].mean() - mtf[:k].mean()))
+        ax.set_ylabel('MTF')
+        ax.set_title('cam{} {}, chart {}'.format(camInd, camName, chart))
+        ax.grid(True)
+        ax.legend(loc='upper left', fontsize='small')
+        # camera temperature of the panel, one value per sample
+        # every tile record of a sample repeats it, keep the first record of each sample
+        camIdx = np.flatnonzero(records['cam'] == camInd)
+        _, firstIdx = np.unique(records['sample'][camIdx], return_index=True)
+        camIdx = camIdx[firstIdx]
+        temp = np.asarray(records['temp'][camIdx], dtype=float)
+        if np.any(np.isfinite(temp)):
+            axTemp = ax.twinx()
+            axTemp.plot(hours[camIdx], temp, 'k:', linewidth=1)
+            axTemp.set_ylabel('Temperature (C)')
+    axList[-1,0].set_xlabel('Hours since {}'.format(header['start']))
+    fig.tight_layout()
+    if args.output is None:
+        plt.show()
+    else:
+        fig.savefig(args.output, dpi=150)
+        print('Figure saved to {}'.format(args.output))
+
+    return
+
+if __name__ == '__main__':
+    args = parseArguments()
+    main(args)
@@ -25,6 +25,7 @@ from pypylon import pylon, genicam
 
 from mhbasler.camconfig import jsonLoadFunc, RealTimeFileLoader
 from mhbasler.camconfig import pickRequiredCameras, setCamParams
+from mhbasler.camconfig import CamProfileCache, setCamParamsCached
 from mhbasler.grab import enableChunk, disableChunk, chunkGrab, saveChunkOne
 
 ########################################
@@ -44,6 +45,12 @@ def parseArguments():
                         help='Frame amount to save, 0 for manual stop. ')
     parser.add_argument('-m', '--save_mode', type=str, choices=['raw', 'rgb', '4bit-left'], default='raw',
                         help='Save mode. 4bit-left would move 12-bit image left 4 bits, to 16-bit.')
+    parser.add_argument('--profile_dir', type=str, default='cam_profiles',
+                        help='Folder caching configured camera profiles, keyed by the hash of each camera\'s parameters.')
+    parser.add_argument('--userset', nargs='+', type=str, default=None,
+                        help='Cache profiles in these camera UserSets (e.g. UserSet1 UserSet2) instead of feature files.')
+    parser.add_argument('--no_profile', dest='use_profile', action='store_false',
+                        help='Disable the camera profile cache, always set parameters one by one.')
 #    parser.add_argument('--instant_save', action='store_true',
 #                        help='Save while capturing, would probably lower fps.')
     parser.add_argument('--start_ns', type=int, default=0,
@@ -103,9 +110,12 @@ def main(args):
     else:
         raise RuntimeError('save mode \'{}\' is not supported.'.format(args.save_mode))
         
-    # open and initialize camera parameters
+    # open and initialize camera parameters, bulk-load cached profile if possible
+    profileCache = None
+    if args.use_profile:
+        profileCache = CamProfileCache(args.profile_dir, args.userset)
     cam.Open()
-    setCamParams(cam, camParams, None)
+    setCamParamsCached(cam, camParams, profileCache)
     # use chunk grab mode
     enableChunk(cam)
 
@@ -0,0 +1,128 @@
+"""
+Render a batch of ArUco-Sine charts and their meta data, in parallel
+
+The spec file is a json file, for example
+{
+    "defaults": {"aruco_length": 100, "lpmm_list": [0.125, 0.25, 0.5],
+                 "length": 100, "height": 20, "side_width": 20, "dpi": 600},
+    "charts": [
+        {"aruco_idx": 12},
+        {"aruco_idx": [13, 14, 15], "lpmm_list": [0.5, 1, 2]},
+        {"aruco_idx": 66, "height": 100, "dpi": 1200},
+        {"aruco_idx": 70, "type": "star", "star_cycles": 144, "star_diameter": 100}
+    ]
+}
+Each chart entry overrides the defaults, a list of aruco_idx expands to one chart per index.
+"type" is "sine" (default) for an ArUco-Sine chart, or "star" for an ArUco-Star chart,
+a sinusoidal Siemens star in place of the sine block, see aruco_star_chart_layout.
+
+Outputs in the output folder
+aruco_sine_chart_{idx}.png: the charts, of either type, dpi recorded in the file
+aruco_sine_chart_params.json: meta data of all charts, keyed by ArUco index, as the livestream loads
+manifest.json: the spec of each chart, its output file, size and render time
+"""
+
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .target_toolbox.aruco_marker import ARUCO_AMOUNT
+from .target_toolbox.chart_layout import aruco_sine_chart_layout, aruco_star_chart_layout
+
+CHART_KEYS = {'sine': ['aruco_idx', 'aruco_length', 'lpmm_list', 'length', 'height', 'side_width', 'dpi'],
+              'star': ['aruco_idx', 'aruco_length', 'star_cycles', 'star_diameter', 'side_width', 'dpi']}
+
+def get_parser():
+    ### compose parser
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('spec', type=str,
+                        help='Spec json file of the charts.')
+    parser.add_argument('-o', '--out_dir', type=str, default='aruco_sine_charts',
+                        help='Output folder.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='Amount of worker processes.')
+    parser.add_argument('--strip_rows', type=int, default=256,
+                        help='Rows rendered at a time, bounds the memory used by each worker.')
+    return parser
+
+def expand_spec(spec):
+    """
+    Return a list of chart dicts with their type and all CHART_KEYS of it, one per ArUco index
+    """
+    chart_list = []
+    for entry in spec['charts']:
+        chart = {**spec.get('defaults', {}), **entry}
+        chart_type = chart.get('type', 'sine')
+        assert chart_type in CHART_KEYS, 'Chart {} of unknown type {}'.format(entry, chart_type)
+        missing = [key for key in CHART_KEYS[chart_type] if key not in chart]
+        assert len(missing) == 0, 'Chart {} misses {}'.format(entry, missing)
+        idx_list = chart['aruco_idx'] if isinstance(chart['aruco_idx'], list) else [chart['aruco_idx']]
+        for idx in idx_list:
+            assert 0 <= idx < ARUCO_AMOUNT, 'ArUco index {} out of [0, {})'.format(idx, ARUCO_AMOUNT)
+            chart_list.append({'type': chart_type} | {key: chart[key] for key in CHART_KEYS[chart_type]}
+                              | {'aruco_idx': idx})
+    idx_list = [chart['aruco_idx'] for chart in chart_list]
+    assert len(set(idx_list)) == len(idx_list), 'Repeated ArUco index, charts would not be told apart'
+    return chart_list
+
+def render_chart(chart, out_dir, strip_rows=256):
+    """
+    Render one chart into out_dir, return its meta dict and manifest record
+    Runs in worker processes, the ArUco dictionary and sine profiles are cached per worker
+    """
+    t0 = time.perf_counter()
+    if chart['type'] == 'star':
+        layout, meta_dict = aruco_star_chart_layout(chart['aruco_idx'], chart['aruco_length'],
+                                                    chart['star_cycles'], chart['star_diameter'],
+                                                    chart['side_width'], chart['dpi'])
+    else:
+        layout, meta_dict = aruco_sine_chart_layout(chart['aruco_idx'], chart['aruco_length'],
+                                                    chart['lpmm_list'], chart['length'], chart['height'],
+                                                    chart['side_width'], chart['dpi'])
+    t1 = time.perf_counter()
+    fn = 'aruco_sine_chart_{:d}.png'.format(chart['aruco_idx'])
+    layout.write_png(os.path.join(out_dir, fn), strip_rows)
+    t2 = time.perf_counter()
+    record = {'chart': chart, 'file': fn, 'hw_pix': meta_dict['hw_pix'],
+              'file_bytes': os.path.getsize(os.path.join(out_dir, fn)),
+              'layout_time': t1 - t0, 'render_time': t2 - t1, 'pid': os.getpid()}
+    return meta_dict, record
+
+def main(args):
+    # load spec
+    with open(args.spec, 'r') as fp:
+        chart_list = expand_spec(json.load(fp))
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    # render in a process pool
+    t0 = time.perf_counter()
+    meta_all, record_list = {}, []
+    with ProcessPoolExecutor(args.workers) as pool:
+        future_list = [pool.submit(render_chart, chart, args.out_dir, args.strip_rows) for chart in chart_list]
+        for future in as_completed(future_list):
+            meta_dict, record = future.result()
+            meta_all[str(meta_dict['aruco_idx'])] = meta_dict
+            record_list.append(record)
+            print('[{}/{}] {} {}x{} in {:.2f} s'.format(len(record_list), len(chart_list), record['file'],
+                                                       *record['hw_pix'][::-1], record['render_time']))
+    total_time = time.perf_counter() - t0
+
+    # meta data and manifest, in spec order
+    order = {chart['aruco_idx']: a for a, chart in enumerate(chart_list)}
+    meta_all = dict(sorted(meta_all.items(), key=lambda item: order[int(item[0])]))
+    record_list.sort(key=lambda record: order[record['chart']['aruco_idx']])
+    with open(os.path.join(args.out_dir, 'aruco_sine_chart_params.json'), 'w') as fp:
+        json.dump(meta_all, fp, indent=4)
+    with open(os.path.join(args.out_dir, 'manifest.json'), 'w') as fp:
+        json.dump({'spec': os.path.abspath(args.spec), 'workers': args.workers,
+                   'total_time': total_time, 'charts': record_list}, fp, indent=4)
+    print('{} charts in {:.2f} s, written to {}'.format(len(record_list), total_time, args.out_dir))
+
+    return
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args, _ = parser.parse_known_args()
+    main(args)
@@ -1,3 +1,5 @@
+import time
+from functools import lru_cache
 import numpy as np
 import cv2 as cv
 from .common import mm_to_pixels
@@ -38,12 +40,19 @@ ARUCO_DICT_TYPE = ARUCO_DICT_SET[ARUCO_DICT_TYPE_STR]
 ##############################
 ### marker generators
 ##############################
+@lru_cache(maxsize=None)
+def get_aruco_dict(aruco_dict_type):
+    """
+    cv.aruco.getPredefinedDictionary, cached, as batch chart generation loads the same one for each chart
+    """
+    return cv.aruco.getPredefinedDictionary(aruco_dict_type)
+
 def draw_aruco_marker(aruco_dict_type, index, length, dpi):
     # parse edge pixel length
     side_pixels = mm_to_pixels(length, dpi)
 
     # load the ArUCo dictionary
-    aruco_dict = cv.aruco.getPredefinedDictionary(aruco_dict_type)
+    aruco_dict = get_aruco_dict(aruco_dict_type)
 
     # make marker
     aruco_marker = aruco_dict.generateImageMarker(index, side_pixels)
@@ -51,6 +60,15 @@ def draw_aruco_marker(aruco_dict_type, index, length, dpi):
     
     return aruco_marker
 
+def draw_aruco_bit_grid(aruco_dict_type, index):
+    """
+    Return the marker as a uint8 image of one pixel per bit, including the edge bits
+    draw_aruco_marker is this grid scaled by nearest neighbor
+    """
+    aruco_dict = get_aruco_dict(aruco_dict_type)
+    return aruco_dict.generateImageMarker(index, aruco_dict.markerSize+2*ARUCO_EDGE_BIT, 
+                                          borderBits=ARUCO_EDGE_BIT)
+
 def draw_aruco_desc_tile(aruco_dict_type_str, index, length, dpi):
     # parse edge pixel length
     side_pixels = mm_to_pixels(length, dpi)
@@ -74,6 +92,147 @@ def draw_aruco_desc_tile(aruco_dict_type_str, index, length, dpi):
 ##############################
 ### marker detection and evaluation
 ##############################
+def _to_gray(img):
+    if img.ndim == 2:
+        return img
+    return cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+
+def detect_markers_pyramid(detector, img, scale=0.25, refine=True, 
+                           refine_criteria=(cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_COUNT, 30, 0.01)):
+    """
+    Detect ArUco markers on a downscaled image, then refine the corners at full resolution
+    Same return format as cv.aruco.ArucoDetector.detectMarkers(), in full resolution coordinate
+    detector: cv.aruco.ArucoDetector
+    img: HxW or HxWx3 uint8 image
+    scale: downscale ratio for candidate search, (0, 1]
+    refine: if True, refine each corner with cv.cornerSubPix on the full resolution image.
+            Only a small window (about 1/scale pixels) around each corner is touched
+    refine_criteria: termination criteria of cv.cornerSubPix
+    """
+    gray = _to_gray(img)
+    h, w = gray.shape
+    small_wh = (max(1, int(np.round(w*scale))), max(1, int(np.round(h*scale))))
+    small = cv.resize(gray, small_wh, interpolation=cv.INTER_AREA)
+    corner_list, id_list, rejected_list = detector.detectMarkers(small)
+    if len(corner_list) == 0:
+        return corner_list, id_list, rejected_list
+    # back to full resolution, pixel centers aligned
+    s = np.array([w/small_wh[0], h/small_wh[1]], dtype=np.float32)
+    corners = (np.concatenate(corner_list, 0).reshape(-1, 1, 2) + 0.5) * s - 0.5
+    corners = corners.astype(np.float32)
+    if refine:
+        half_win = int(np.ceil(s.max())) + 2
+        corners = cv.cornerSubPix(gray, corners, (half_win, half_win), (-1, -1), refine_criteria)
+    corner_list = tuple(c.reshape(1, 4, 2) for c in corners.reshape(-1, 4, 2))
+    return corner_list, id_list, rejected_list
+
+class ArucoRoiTracker():
+    """
+    Temporal ROI tracking on top of an ArUco detector, for (nearly) static scenes
+    Each frame, markers are only searched in expanded windows around their corners in the previous frame.
+    A full frame search happens every full_search_gap frames, or when a marker is lost.
+    detect() returns the same format as cv.aruco.ArucoDetector.detectMarkers()
+    """
+    def __init__(self, detector, full_search_gap=30, margin_ratio=0.5, scale=None):
+        """
+        detector: cv.aruco.ArucoDetector
+        full_search_gap: force a full frame search every this amount of frames
+        margin_ratio: window margin around a marker, relative to the marker's bounding box size
+        scale: if not None, search with detect_markers_pyramid() at this scale
+        """
+        self.detector = detector
+        self.full_search_gap = full_search_gap
+        self.margin_ratio = margin_ratio
+        self.scale = scale
+        self.prev_dict = {} # marker id -> 4x2 corners in the previous frame
+        self.frame_count = 0
+        self.last_full_search = None
+
+    def _detect(self, img):
+        if self.scale is None:
+            return self.detector.detectMarkers(img)
+        return detect_markers_pyramid(self.detector, img, self.scale)
+
+    def _roi_search(self, img):
+        h, w = img.shape[:2]
+        found_dict = {}
+        for idx, corner in self.prev_dict.items():
+            if idx in found_dict: # already found in a neighbor's window
+                continue
+            # expanded window
+            (x0, y0), (x1, y1) = corner.min(0), corner.max(0)
+            margin = self.margin_ratio * max(x1-x0, y1-y0)
+            rx0 = int(max(0, np.floor(x0-margin)))
+            ry0 = int(max(0, np.floor(y0-margin)))
+            rx1 = int(min(w, np.ceil(x1+margin)+1))
+            ry1 = int(min(h, np.ceil(y1+margin)+1))
+            if rx1 <= rx0 or ry1 <= ry0:
+                continue
+            # search window, back to frame coordinate
+            corner_list, id_list, _ = self._detect(img[ry0:ry1, rx0:rx1])
+            if id_list is None:
+                continue
+            for c, i in zip(corner_list, np.reshape(id_list, -1)):
+                found_dict[int(i)] = c.reshape(4, 2) + np.array([rx0, ry0], dtype=np.float32)
+        return found_dict
+
+    def detect(self, img):
+        """
+        Detect markers in img. Return corner_list, id_list, rejected_list (always empty)
+        """
+        # try tracking first
+        full_search = self.last_full_search is None or len(self.prev_dict) == 0 \
+                      or self.frame_count - self.last_full_search >= self.full_search_gap
+        if not full_search:
+            found_dict = self._roi_search(img)
+            if not set(self.prev_dict.keys()) <= set(found_dict.keys()): # lost some marker
+                full_search = True
+        # full frame search if needed
+        if full_search:
+            corner_list, id_list, _ = self._detect(img)
+            found_dict = {}
+            if id_list is not None:
+                for c, i in zip(corner_list, np.reshape(id_list, -1)):
+                    found_dict[int(i)] = c.reshape(4, 2)
+            self.last_full_search = self.frame_count
+        self.frame_count += 1
+        self.prev_dict = found_dict
+        # pack as detectMarkers() does
+        if len(found_dict) == 0:
+            return (), None, ()
+        id_list = np.array(list(found_dict.keys()), dtype=np.int32).reshape(-1, 1)
+        corner_list = tuple(c.reshape(1, 4, 2).astype(np.float32) for c in found_dict.values())
+        return corner_list, id_list, ()
+
+def compare_pyramid_detection(detector, img, scale=0.25, refine=True, repeat=5):
+    """
+    Compare detect_markers_pyramid with full resolution detection on one image
+    Return a dict with
+        full_time, pyramid_time: average detection time in seconds
+        speedup: full_time / pyramid_time
+        matched: amount of marker ids found by both
+        mean_err, max_err: corner distance in pixels between the two, over matched markers
+    """
+    def timing(func):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - t0) / repeat
+    (full_corners, full_ids, _), full_time = timing(lambda: detector.detectMarkers(img))
+    (pyr_corners, pyr_ids, _), pyr_time = timing(
+        lambda: detect_markers_pyramid(detector, img, scale, refine))
+    # match by id
+    err_list = []
+    if full_ids is not None and pyr_ids is not None:
+        pyr_dict = {int(i): c.reshape(4, 2) for c, i in zip(pyr_corners, np.reshape(pyr_ids, -1))}
+        for c, i in zip(full_corners, np.reshape(full_ids, -1)):
+            if int(i) in pyr_dict:
+                err_list.append(np.linalg.norm(c.reshape(4, 2) - pyr_dict[int(i)], axis=1))
+    err = np.concatenate(err_list) if len(err_list) > 0 else np.array([np.nan])
+    return {'full_time': full_time, 'pyramid_time': pyr_time, 
+            'speedup': full_time / pyr_time, 'matched': len(err_list),
+            'mean_err': float(err.mean()), 'max_err': float(err.max())}
+
 def square_score(x, y, flip=False, uplimit=100.0, eps=1e-5):
     """
     Give a score of the "squareness" of four points
@@ -84,36 +243,139 @@ def square_score(x, y, flip=False, uplimit=100.0, eps=1e-5):
         fitting a square to match the points giving the least square error
         the negative log of that square error
     By my vision test, above 8.5 usually means a good square
+    See square_score_batch for many markers at once
     """
     assert len(x)==4 and len(y)==4, \
     'Need four x and four y'
-    if flip:
-        y = -y
+    corners = np.stack([x, y], -1).reshape(1, 4, 2)
+    return square_score_batch(corners, flip, uplimit, eps)[0][0]
+
+def square_score_batch(corners, flip=False, uplimit=100.0, eps=1e-5):
+    """
+    Vectorized square_score of N markers, with their geometry computed in the same pass
+    corners: Nx4x2 array, or a list of 1x4x2 arrays as cv.aruco.ArucoDetector.detectMarkers() returns
+             clockwise in image coordinate, flip as square_score
+    Return a tuple of length-N arrays
+        score: square_score of each marker
+        area: area in pixels
+        aspect: ratio of the mean lengths of the two pairs of opposite edges, larger over smaller, 1 for a square
+        skew: largest deviation of the four corner angles from 90 degrees, in degrees
+    """
+    corners = np.asarray(corners, dtype=float).reshape(-1, 4, 2)
+    x, y = corners[:,:,0], corners[:,:,1]
     
-    x0 = np.mean(x)
-    y0 = np.mean(y)
-    u = (x[0]-y[1]-x[2]+y[3])/4
-    v = (y[0]+x[1]-y[2]-x[3])/4
+    # square score
+    ys = -y if flip else y
+    x0 = x.mean(1)
+    y0 = ys.mean(1)
+    u = (x[:,0]-ys[:,1]-x[:,2]+ys[:,3])/4
+    v = (ys[:,0]+x[:,1]-ys[:,2]-x[:,3])/4
+    s = (np.power(x,2).sum(1) + np.power(ys,2).sum(1) - 4*(x0**2) - 4*(y0**2))/(u**2+v**2+eps) - 4
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(s <= 0, uplimit, np.clip(-np.log(np.maximum(s, 1e-300)), None, uplimit))
     
-    s = (np.power(x,2).sum() + np.power(y,2).sum() - 4*(x0**2) - 4*(y0**2))/(u**2+v**2+eps) - 4
+    # geometry, edges from each corner to the next
+    edge = np.roll(corners, -1, axis=1) - corners
+    edge_len = np.linalg.norm(edge, axis=2)
+    area = np.abs((x*np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1)*y).sum(1)) / 2
+    pair_a = edge_len[:,0] + edge_len[:,2]
+    pair_b = edge_len[:,1] + edge_len[:,3]
+    aspect = np.maximum(pair_a, pair_b) / np.maximum(np.minimum(pair_a, pair_b), eps)
+    # corner angle between the incoming and outgoing edges
+    edge_in = -np.roll(edge, 1, axis=1)
+    cos_angle = (edge*edge_in).sum(2) / np.maximum(edge_len*np.roll(edge_len, 1, axis=1), eps)
+    skew = np.degrees(np.abs(np.pi/2 - np.arccos(np.clip(cos_angle, -1, 1)))).max(1)
     
-    if s <= 0:
-        return uplimit
-    else:
-        return np.clip(-np.log(s), None, uplimit)
+    return score, area, aspect, skew
+
+##############################
+### marker pose
+##############################
+# marker corners on its own plane, clockwise from the origin as detected, scale free
+_MARKER_SQUARE = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=float)
+
+def marker_tilt_batch(corners, camera_matrix, dist_coeffs=None):
+    """
+    3D tilt of N square markers from their image corners and the camera intrinsics, vectorized
+    The homography from the marker square to the undistorted, normalized image points is solved 
+    for all markers at once (8x8 linear systems, h33 = 1). Its Jacobian at the marker center gives 
+    the rotation in closed form as IPPE does (Collins and Bartoli, 2014), with its two-fold ambiguity 
+    resolved by the homography's own axes. Same as cv.solvePnP with SOLVEPNP_IPPE_SQUARE per marker.
+    The normal does not depend on the marker size, so no size is needed
+    corners: Nx4x2 array, or a list of 1x4x2 arrays as cv.aruco.ArucoDetector.detectMarkers() returns
+    camera_matrix: 3x3 intrinsic matrix, at the resolution of the corners
+    dist_coeffs: distortion coefficients in OpenCV order, None for no distortion
+    Return a tuple of
+        tilt: length-N array, angle between the marker normal and the optical axis, in degrees
+        normal: Nx3 array, unit normals in camera frame, pointing to the camera (negative z)
+    """
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+    N = corners.shape[0]
+    if N == 0:
+        return np.zeros(0), np.zeros((0, 3))
+    # all corners undistorted and normalized in one call
+    q = cv.undistortPoints(corners.reshape(-1, 1, 2), np.asarray(camera_matrix, dtype=np.float64), 
+                           None if dist_coeffs is None else np.asarray(dist_coeffs, dtype=np.float64))
+    q = q.reshape(N, 4, 2)
+    # homography, DLT rows [X Y 1 0 0 0 -uX -uY] h = u, [0 0 0 X Y 1 -vX -vY] h = v
+    X, Y = _MARKER_SQUARE[:, 0], _MARKER_SQUARE[:, 1]
+    u, v = q[:, :, 0], q[:, :, 1]
+    A = np.zeros((N, 4, 2, 8))
+    A[:, :, 0, 0], A[:, :, 0, 1], A[:, :, 0, 2] = X, Y, 1
+    A[:, :, 1, 3], A[:, :, 1, 4], A[:, :, 1, 5] = X, Y, 1
+    A[:, :, 0, 6], A[:, :, 0, 7] = -u*X, -u*Y
+    A[:, :, 1, 6], A[:, :, 1, 7] = -v*X, -v*Y
+    H = np.concatenate([np.linalg.solve(A.reshape(N, 8, 8), q.reshape(N, 8, 1))[:, :, 0], 
+                        np.ones((N, 1))], 1).reshape(N, 3, 3)
+    
+    # image of the marker center (p, q) and the Jacobian there
+    p, q = H[:, 0, 2], H[:, 1, 2]
+    J = H[:, :2, :2] - np.stack([p, q], 1)[:, :, None] * H[:, 2, None, :2]
+    # rotation Rv taking the optical axis to the line of sight (p, q, 1)
+    t = np.hypot(p, q)
+    s = np.sqrt(t*t + 1)
+    kx, ky = np.divide(p, t, out=np.zeros(N), where=t > 0), np.divide(q, t, out=np.zeros(N), where=t > 0)
+    K = np.zeros((N, 3, 3))
+    K[:, 0, 2], K[:, 1, 2], K[:, 2, 0], K[:, 2, 1] = kx, ky, -kx, -ky
+    Rv = np.eye(3) + np.sqrt(1 - 1/(s*s))[:, None, None]*K + (1 - 1/s)[:, None, None]*(K @ K)
+    # the 2x2 block of the rotation in the Rv frame, up to scale
+    B = Rv[:, :2, :2] - np.stack([p, q], 1)[:, :, None] * Rv[:, 2, None, :2]
+    M = np.linalg.solve(B, J)
+    gamma = np.linalg.norm(M, ord=2, axis=(1, 2)) # largest singular value
+    R = M / gamma[:, None, None]
+    b0 = np.sqrt(np.clip(1 - R[:, 0, 0]**2 - R[:, 1, 0]**2, 0, None))
+    b1 = np.sqrt(np.clip(1 - R[:, 0, 1]**2 - R[:, 1, 1]**2, 0, None))
+    b1 = np.where(-R[:, 0, 0]*R[:, 0, 1] - R[:, 1, 0]*R[:, 1, 1] < 0, -b1, b1)
+    # two solutions, bottom row (b0, b1) or (-b0, -b1), normal = Rv @ (col0 x col1)
+    normal_list = []
+    for sign in (1, -1):
+        col0 = np.stack([R[:, 0, 0], R[:, 1, 0], sign*b0], 1)
+        col1 = np.stack([R[:, 0, 1], R[:, 1, 1], sign*b1], 1)
+        normal = np.einsum('nij,nj->ni', Rv, np.cross(col0, col1))
+        normal_list.append(normal * -np.sign(normal[:, 2:3] + 1e-300)) # towards the camera
+    # pick the solution closer to the normal of the homography's own axes
+    rough = np.cross(H[:, :, 0], H[:, :, 1])
+    rough *= -np.sign(rough[:, 2:3] + 1e-300)
+    pick = np.abs((normal_list[0]*rough).sum(1)) >= np.abs((normal_list[1]*rough).sum(1))
+    normal = np.where(pick[:, None], normal_list[0], normal_list[1])
+    normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+    tilt = np.degrees(np.arccos(np.clip(-normal[:, 2], -1, 1)))
+    return tilt, normal
 
 ##############################
 ### marker displayers
 ##############################
-def draw_aruco_coordinate(img, corner_list, color=(0,255,0)):
+def draw_aruco_coordinate(img, corner_list, color=(0,255,0), scale=1.0):
     """
     Draw ArUco marker's origin coordinate under it. Note that it alters the original image
     img should be a unit8 numpy array, the BGR image containing the ArUco markers
     corner_list should be a list of 1x4x2 numpy float array, returned by cv.aruco.ArucoDetector.detectMarkers()
+    scale: if img is a resized display of the frame, the corners are in img coordinate,
+           and the coordinate written is corner/scale, in frame coordinate
     """
     for corner in corner_list:
         # define text location
-        x, y = corner[0][0]
+        x, y = corner[0][0] / scale
         bot_y = corner[0,:,1].max()    
         center_x = corner[0,:,0].mean()
         width = corner[0,:,0].max() - corner[0,:,0].min()
@@ -133,9 +395,11 @@ def draw_aruco_square_score(img, corner_list, threshold=8.5):
     corner_list should be a list of 1x4x2 numpy float array, returned by cv.aruco.ArucoDetector.detectMarkers()
     score above threshold will be displayed green, otherwise, red
     """
-    for corner in corner_list:
-        # calculate score and color
-        score = square_score(*corner[0].transpose(), True)
+    if len(corner_list) == 0:
+        return img
+    score_list = square_score_batch(corner_list, True)[0]
+    for corner, score in zip(corner_list, score_list):
+        # color by score
         if score >= threshold:
             color = (0,255,0)
         else:
@@ -154,3 +418,30 @@ def draw_aruco_square_score(img, corner_list, threshold=8.5):
                    cv.FONT_HERSHEY_SIMPLEX, width*0.012, 
                    color, np.round(width*0.025).astype(int), cv.LINE_AA, False)
     return img
+
+def draw_aruco_tilt(img, corner_list, tilt_list, max_tilt=10.0):
+    """
+    Draw ArUco marker's 3D tilt in degrees above it, e.g. from marker_tilt_batch. Note that it alters the original image
+    img should be a unit8 numpy array, the BGR image containing the ArUco markers
+    corner_list should be a list of 1x4x2 numpy float array, returned by cv.aruco.ArucoDetector.detectMarkers()
+    tilt below max_tilt will be displayed green, otherwise, red
+    """
+    for corner, tilt in zip(corner_list, tilt_list):
+        # color by tilt
+        if tilt <= max_tilt:
+            color = (0,255,0)
+        else:
+            color = (0,0,255)
+        
+        # define text location
+        top_y = corner[0,:,1].min()    
+        center_x = corner[0,:,0].mean()
+        width = corner[0,:,0].max() - corner[0,:,0].min()
+        
+        # draw text
+        text_str = '{:.1f}deg'.format(tilt)
+        cv.putText(img, text_str, 
+                   (np.round(center_x - width*len(text_str)*0.12).astype(int), np.round(top_y - width*0.1).astype(int)), 
+                   cv.FONT_HERSHEY_SIMPLEX, width*0.012, 
+                   color, np.round(width*0.025).astype(int), cv.LINE_AA, False)
+    return img
@@ -1,11 +1,13 @@
+from functools import lru_cache
 import numpy as np
 import cv2 as cv
 
 from .common import mm_to_pixels, pixels_to_mm, center_crop_pad_to, remove_bezel, \
-                    draw_bw_ref_tile, draw_multiline_text, draw_polylines
+                    draw_multiline_text, draw_polylines
 from .aruco_marker import ARUCO_INNER_BIT, ARUCO_AMOUNT, ARUCO_EDGE_BIT, ARUCO_DICT_TYPE_STR, ARUCO_DICT_TYPE
-from .aruco_marker import draw_aruco_marker, draw_aruco_desc_tile
-from .sine_chart import draw_sine_block, draw_sine_block_desc_tile
+from .chart_layout import aruco_sine_chart_layout, aruco_star_chart_layout
+from .siemens_star import star_ring_radii, star_print_attenuation, estimate_mtf_from_star_rings, mtf50_from_curve, \
+                          estimate_star_center_offset
 
 ##############################
 ### chart generation
@@ -24,65 +26,30 @@ def generate_aruco_sine_chart_meta(aruco_idx, aruco_length,
     lpmm_list, length, height: sine tiles lpmm, length, height
     side_width: side tile's width
     dpi: dots per inch, should match the printer
+    The chart is composed by aruco_sine_chart_layout, whose layout can also be written 
+    strip by strip into a file for poster-size charts
     """
-    ### Pattern
-    # ArUco marker, sine block
-    aruco_marker = draw_aruco_marker(aruco_dict_type, aruco_idx, aruco_length, dpi)
-    sine_block = draw_sine_block(lpmm_list, length, height, dpi)
-
-    # description tiles, need to crop/pad to align
-    aruco_desc_tile = draw_aruco_desc_tile(ARUCO_DICT_TYPE_STR, aruco_idx, aruco_length, dpi)
-    sine_desc_tile = draw_sine_block_desc_tile(lpmm_list, height*len(lpmm_list), dpi)
-    aruco_desc_tile = center_crop_pad_to(aruco_desc_tile, sine_block.shape[0], 1, 255)
-    sine_desc_tile = center_crop_pad_to(sine_desc_tile, sine_block.shape[0], 1, 255)
+    layout, meta_dict = aruco_sine_chart_layout(aruco_idx, aruco_length, 
+                                                lpmm_list, length, height,
+                                                side_width, dpi, aruco_dict_type)
+    total_pattern = cv.cvtColor(layout.render(), cv.COLOR_GRAY2BGR)
+    return total_pattern, meta_dict
 
-    # gap around ArUco marker
-    gap_pix = int(np.round(aruco_marker.shape[1]/(ARUCO_INNER_BIT+2*ARUCO_EDGE_BIT)))
-    vert_gap_tile = np.full((aruco_marker.shape[1], gap_pix, 3), 255, np.uint8)
-    
-    # black/white side tile
-    bw_tile = draw_bw_ref_tile(sine_block.shape[0]+gap_pix+aruco_marker.shape[1], 
-                               mm_to_pixels(side_width, dpi))
-
-    # other gaps
-    filling_gap = np.full((gap_pix-aruco_desc_tile.shape[0]-sine_desc_tile.shape[0], 
-                           sine_block.shape[0], 3), 255, np.uint8)
-    right_gap = np.full((gap_pix, gap_pix+aruco_marker.shape[1], 3), 255, np.uint8)
-
-    # tile
-    top_row = np.concatenate([np.rot90(sine_block, 1), vert_gap_tile, aruco_marker], 1)
-    mid_row = np.concatenate([np.concatenate([filling_gap, 
-                                              sine_desc_tile, 
-                                              aruco_desc_tile], 0), right_gap], 1)
-    bot_row = bw_tile
-    total_pattern = np.concatenate([top_row, mid_row, bot_row], 0)
-    
-    ### data file
-    meta_dict = {}
-    
-    # total image height and width
-    meta_dict['hw_pix'] = list(total_pattern.shape[:2]) 
-    meta_dict['hw_mm'] = pixels_to_mm(np.array(total_pattern.shape[:2]), dpi).tolist()
-    
-    # aruco marker location and size
-    meta_dict['aruco_idx'] = aruco_idx
-    meta_dict['aruco_xywhr'] = [sine_block.shape[0]+gap_pix, 0, 
-                                aruco_marker.shape[1], aruco_marker.shape[0],
-                                0]
-    meta_dict['aruco_width_mm'] = pixels_to_mm(aruco_marker.shape[1], dpi)
-
-    # sine block location and size
-    meta_dict['sine_xywhr'] = [0, sine_block.shape[1]-1, 
-                               sine_block.shape[1], sine_block.shape[0], 
-                               -np.pi/2]
-    meta_dict['lpmm_list'] = lpmm_list
-
-    # bw_ref chart location
-    meta_dict['bw_xywhr'] = [0, sine_block.shape[0]+gap_pix, 
-                             bw_tile.shape[1], bw_tile.shape[0],
-                             0]
-    
-    ### return
+def generate_aruco_star_chart_meta(aruco_idx, aruco_length,
+                                   star_cycles, star_diameter,
+                                   side_width, dpi=600, center_ratio=0.1, kernel='box',
+                                   aruco_dict_type=ARUCO_DICT_TYPE):
+    """
+    Return an ArUco-Star chart and its meta data dict
+    Same as generate_aruco_sine_chart_meta, with a sinusoidal Siemens star of star_cycles periods
+        and star_diameter mm in place of the sine tiles, which gives a whole MTF curve
+    center_ratio, kernel: see draw_siemens_star
+    The chart is composed by aruco_star_chart_layout
+    """
+    layout, meta_dict = aruco_star_chart_layout(aruco_idx, aruco_length,
+                                                star_cycles, star_diameter,
+                                                side_width, dpi, center_ratio, kernel, aruco_dict_type)
+    total_pattern = cv.cvtColor(layout.render(), cv.COLOR_GRAY2BGR)
     return total_pattern, meta_dict
 
 ##############################
@@ -129,10 +96,96 @@ def _ouv_to_corners(ouv):
                      ovec + vvec
                     ], axis=0)
 
+def estimate_affine_batch(src, dst, partial=True):
+    """
+    Least square affine transformation from src points to dst points, in closed form, batched
+    src, dst: NxKx2 (or Kx2 for one) arrays of corresponding points
+    partial: if True, estimate partial affine (similarity), which consists only rotation, scaling, translation,
+             needs K>=2. Otherwise full affine, needs K>=3 points not on a line
+    Return Nx2x3 (or 2x3) float matrices, dst = H[:, :2] @ src + H[:, 2]
+    """
+    src = np.asarray(src, dtype=float)
+    dst = np.asarray(dst, dtype=float)
+    single = src.ndim == 2
+    src, dst = src.reshape(-1, src.shape[-2], 2), dst.reshape(-1, dst.shape[-2], 2)
+    # center both point sets, the translation follows the linear part
+    src_m, dst_m = src.mean(1), dst.mean(1)
+    sc, dc = src - src_m[:, None], dst - dst_m[:, None]
+    if partial:
+        # [[a, -b], [b, a]], minimizing sum |a*s + b*rot90(s) - d|^2
+        den = (sc**2).sum((1, 2))
+        a = (sc*dc).sum((1, 2)) / den
+        b = (sc[:,:,0]*dc[:,:,1] - sc[:,:,1]*dc[:,:,0]).sum(1) / den
+        A = np.stack([np.stack([a, -b], -1), np.stack([b, a], -1)], 1)
+    else:
+        # normal equation A @ (sc^T sc) = dc^T sc, sc^T sc is symmetric
+        S = np.einsum('nki,nkj->nij', sc, sc)
+        D = np.einsum('nki,nkj->nij', dc, sc)
+        A = np.linalg.solve(S, D.transpose(0, 2, 1)).transpose(0, 2, 1)
+    t = dst_m - np.einsum('nij,nj->ni', A, src_m)
+    H = np.concatenate([A, t[:, :, None]], 2)
+    return H[0] if single else H
+
+@lru_cache(maxsize=256)
+def _chart_geometry_from_xywhr(hw_pix, aruco_xywhr, block_xywhr, is_star):
+    """
+    Source side geometry of a chart, cached by its xywhr tuples, see prepare_chart_geometry
+    Arrays are read-only, as they are shared by all calls of the same chart
+    """
+    h, w = hw_pix
+    geometry = {
+        # corresponding to corner points, need point_to_corner
+        'aruco_corners': _ouv_to_corners(_xywhr_to_ouv(aruco_xywhr, True)),
+        'sine_corners': _ouv_to_corners(_xywhr_to_ouv(block_xywhr, True)),
+        'chart_corners': _ouv_to_corners(_xywhr_to_ouv([0, 0, w, h, 0], True)),
+    }
+    if is_star:
+        geometry['star_center'] = geometry['sine_corners'].mean(0)
+    else:
+        # for tile origins, no point_to_corner
+        geometry['sine_block_ouv'] = _xywhr_to_ouv(block_xywhr, False)
+    for v in geometry.values():
+        v.setflags(write=False)
+    return geometry
+
+def prepare_chart_geometry(meta_dict):
+    """
+    Return the source side geometry of a chart, computed once per chart
+    Functions below use it instead of rebuilding corners from xywhr for every frame
+    It is cached by the chart's hw_pix and xywhr values, not kept in meta_dict,
+    so meta_dict stays json serializable, and an edited or reloaded meta_dict is never stale
+    On ArUco-Star charts, the star's bounding square takes the place of the sine block
+    """
+    is_star = 'star_xywhr' in meta_dict
+    block_xywhr = meta_dict['star_xywhr'] if is_star else meta_dict['sine_xywhr']
+    return _chart_geometry_from_xywhr(tuple(meta_dict['hw_pix']), tuple(meta_dict['aruco_xywhr']),
+                                      tuple(block_xywhr), is_star)
+
+def prepare_chart_metas(meta_dicts):
+    """
+    prepare_chart_geometry for a dict of chart meta dicts, e.g. a loaded aruco_sine_chart_params.json,
+    such that the first frame doesn't pay for it. Return the same dict, unchanged
+    """
+    for meta_dict in meta_dicts.values():
+        prepare_chart_geometry(meta_dict)
+    return meta_dicts
+
+def _chart_affine(aruco_corner_list, meta_dict, partial=True, reverse=False):
+    """
+    rec2rec_affine of a chart's ArUco marker, batched if aruco_corner_list is Nx4x2 
+    and meta_dict a list of N meta dicts
+    """
+    if isinstance(meta_dict, dict):
+        src = prepare_chart_geometry(meta_dict)['aruco_corners']
+    else:
+        src = np.stack([prepare_chart_geometry(m)['aruco_corners'] for m in meta_dict], 0)
+    tsf = np.asarray(aruco_corner_list, dtype=float).reshape(src.shape)
+    return estimate_affine_batch(tsf, src, partial) if reverse else estimate_affine_batch(src, tsf, partial)
+
 ##############################
 ### extract tiles
 ##############################
-def rec2rec_affine(src_xywhr, tsf_corner_list, partial=True, reverse=False):
+def rec2rec_affine(src_xywhr, tsf_corner_list, partial=True, reverse=False, robust=False):
     """
     Return an affine transformation 2x3 matrix, from source to transformed (or reversed) 
     defined by rectangle-to-rectangle correspondance
@@ -141,6 +194,8 @@ def rec2rec_affine(src_xywhr, tsf_corner_list, partial=True, reverse=False):
     tsf_corner_list: 4x2 np.float32 array, gives the rectangle's corners' coordinates in transformed image
                      starting from top-left corner, clockwise
     partial: if True, estimate partial affine, which consists only rotation, scaling, translation
+    robust: if True, estimate by OpenCV with LMEDS, as it used to be.
+            Otherwise, least square in closed form over the four corners
     """
     # build corner list
     # corresponding to corner points, need point_to_corner
@@ -152,6 +207,9 @@ def rec2rec_affine(src_xywhr, tsf_corner_list, partial=True, reverse=False):
     else:
         Acl = src_corner_list
         Bcl = tsf_corner_list
+    # closed form
+    if not robust:
+        return estimate_affine_batch(Acl, Bcl, partial)
     # partial or full
     if partial:
         H, _ = cv.estimateAffinePartial2D(Acl, Bcl, method=cv.LMEDS)
@@ -189,17 +247,61 @@ def find_sine_corner_list(aruco_corner_list, meta_dict, partial=True):
     """
     Gives the corner points of sine block according to aruco marker corner points
     """
-    H_src2tsf = rec2rec_affine(meta_dict['aruco_xywhr'], aruco_corner_list, 
-                               partial=partial, reverse=False)
-    src_sine_corners = _ouv_to_corners(_xywhr_to_ouv(meta_dict['sine_xywhr'], True)).astype(float)
-    tsf_sine_corners = H_src2tsf @ np.pad(src_sine_corners.transpose(), ((0,1),(0,0)), mode='constant', constant_values=1)
-    tsf_sine_corners = np.array(tsf_sine_corners)[:2].transpose()
-    tsf_sine_corners = np.round(tsf_sine_corners).astype(int)
-    return tsf_sine_corners
+    return find_sine_corner_list_batch([aruco_corner_list], [meta_dict], partial)[0]
+
+def find_sine_corner_list_batch(aruco_corner_lists, meta_dict_list, partial=True):
+    """
+    find_sine_corner_list of N charts at once
+    aruco_corner_lists: Nx4x2 array, or a list of N 4x2 arrays
+    meta_dict_list: a list of N meta dicts, the chart of each marker
+    Return a Nx4x2 int array
+    """
+    H_src2tsf = _chart_affine(aruco_corner_lists, meta_dict_list, partial=partial, reverse=False)
+    src_sine_corners = np.stack([prepare_chart_geometry(m)['sine_corners'] for m in meta_dict_list], 0)
+    tsf_sine_corners = np.einsum('nij,nkj->nki', H_src2tsf[:, :, :2], src_sine_corners) + H_src2tsf[:, None, :, 2]
+    return np.round(tsf_sine_corners).astype(int)
     
+def _interp_support(interp_flag):
+    """
+    Pixels an OpenCV interpolation reads on each side of the sampling point, plus one for rounding
+    """
+    return {cv.INTER_NEAREST: 1, cv.INTER_LINEAR: 2, cv.INTER_CUBIC: 3, cv.INTER_LANCZOS4: 5}.get(interp_flag, 5)
+
+def _affine_src_bbox(H_inv, tgt_wh, img_shape, pad):
+    """
+    Bounding box (x0, y0, x1, y1) in the source image read by a warp into a tgt_wh image
+    H_inv: 2x3 affine matrix, from target to source
+    pad: extra pixels for interpolation support
+    The box is clipped to the image, x1/y1 are exclusive
+    """
+    tgt_w, tgt_h = tgt_wh
+    tgt_corners = np.array([[0, 0], [tgt_w-1, 0], [tgt_w-1, tgt_h-1], [0, tgt_h-1]], dtype=float)
+    src_corners = tgt_corners @ H_inv[:, :2].T + H_inv[:, 2]
+    (x0, y0), (x1, y1) = src_corners.min(0), src_corners.max(0)
+    x0 = int(min(img_shape[1], max(0, np.floor(x0)-pad)))
+    y0 = int(min(img_shape[0], max(0, np.floor(y0)-pad)))
+    x1 = int(max(x0, min(img_shape[1], np.ceil(x1)+pad+1)))
+    y1 = int(max(y0, min(img_shape[0], np.ceil(y1)+pad+1)))
+    return x0, y0, x1, y1
+
+def _warp_affine_roi(img, H, tgt_wh, interp_flag=cv.INTER_CUBIC):
+    """
+    cv.warpAffine(img, H, tgt_wh, flags=interp_flag), but only the ROI of img the warp reads is passed to OpenCV
+    The inverse matrix is computed as cv.warpAffine does (in double), 
+    then the integer ROI offset is folded into it. Not bit-exact: the folded offset changes the rounding
+    of the sampling coordinates, few pixels may differ by one level from warping the whole image
+    """
+    H_inv = cv.invertAffineTransform(np.array(H, dtype=np.float64))
+    x0, y0, x1, y1 = _affine_src_bbox(H_inv, tgt_wh, img.shape, _interp_support(interp_flag))
+    if x1 == x0 or y1 == y0: # tile fully out of image
+        return np.zeros((tgt_wh[1], tgt_wh[0]) + img.shape[2:], dtype=img.dtype)
+    H_inv[:, 2] -= (x0, y0)
+    return cv.warpAffine(img[y0:y1, x0:x1], H_inv, tgt_wh, flags=interp_flag|cv.WARP_INVERSE_MAP)
+
 def extract_sine_and_bw_tiles(img, aruco_corner_list, meta_dict, 
                               sine_oversample=16, bw_oversample=4,
-                              partial=True, interp_flag=cv.INTER_CUBIC):
+                              partial=True, interp_flag=cv.INTER_CUBIC,
+                              roi_local=False):
     """
     Extract sine tiles and bw tile from a ArUco-Sine chart in a frame based on detected ArUco marker
     
@@ -213,6 +315,8 @@ def extract_sine_and_bw_tiles(img, aruco_corner_list, meta_dict,
     partial: if True, estimate partial affine, which consists only rotation, scaling, translation.
              Should keep True if the chart is fronto-parallel to the camera
     interp_flag: interpolation flag defined by OpenCV
+    roi_local: if True, each tile is warped from a padded ROI of img around its source bounding box,
+               instead of the whole image, see _warp_affine_roi. Few pixels may differ by one level
     
     Return values
     tile_list: a list of extracted tiles, last is bw tile, rest are sine tiles
@@ -223,15 +327,13 @@ def extract_sine_and_bw_tiles(img, aruco_corner_list, meta_dict,
     src_pp = meta_dict['aruco_width_mm'] / meta_dict['aruco_xywhr'][2] # source pixel pitch in mm
     # prepare to split sine block to sine tile
     N_tile = len(meta_dict['lpmm_list'])
-    sine_block_ouv = _xywhr_to_ouv(meta_dict['sine_xywhr'], False) # origin-uvector-vvector
-                                                                   # for tile origins, no point_to_corner
+    sine_block_ouv = prepare_chart_geometry(meta_dict)['sine_block_ouv'] # origin-uvector-vvector
     tile_w = meta_dict['sine_xywhr'][2]
     tile_h = meta_dict['sine_xywhr'][3]/N_tile
     tile_r = meta_dict['sine_xywhr'][4]
     
     # affine matrix from transformed image to source image
-    H_tsf2src = rec2rec_affine(meta_dict['aruco_xywhr'], aruco_corner_list, 
-                               partial=partial, reverse=True)
+    H_tsf2src = _chart_affine(aruco_corner_list, meta_dict, partial=partial, reverse=True)
     s_src2tsf = 1 / np.sqrt(np.linalg.det(H_tsf2src[:2,:2])) # scale
     
     # sine tiles' affine transformation parameter
@@ -252,13 +354,19 @@ def extract_sine_and_bw_tiles(img, aruco_corner_list, meta_dict,
     pp_list.append(meta_dict['bw_xywhr'][2] * src_pp / bw_tgt_w)
         
     # extract tiles by affine warpping
-    tile_list = []
+    H_list = []
+    tgt_wh_list = []
     for xywhr, tgt_w in tile_xywhr_tgtw_list:
         H_src2tgt, tgt_wh = recout_affine_shape(xywhr, tgt_w)
         H_total = _affine_2x3_to_3x3(H_src2tgt) @ _affine_2x3_to_3x3(H_tsf2src)
-        H_total = np.array(H_total, dtype=np.float32)[:2]
-        roi_img = cv.warpAffine(img, H_total, tgt_wh, flags=interp_flag)
-        tile_list.append(roi_img)
+        H_list.append(np.array(H_total, dtype=np.float32)[:2])
+        tgt_wh_list.append(tgt_wh)
+    if roi_local:
+        tile_list = [_warp_affine_roi(img, H_total, tgt_wh, interp_flag) 
+                     for H_total, tgt_wh in zip(H_list, tgt_wh_list)]
+    else:
+        tile_list = [cv.warpAffine(img, H_total, tgt_wh, flags=interp_flag) 
+                     for H_total, tgt_wh in zip(H_list, tgt_wh_list)]
         
     # return
     return tile_list, pp_list, meta_dict['lpmm_list']
@@ -286,10 +394,65 @@ def estimate_comm_diff_from_bw_tile(bw_tile, bezel_ratio=0.1):
     # return
     return comm_mode, diff_mode
 
+def _crop_sine_tile(sine_tile, lpmm, pp, bezel_ratio=0.1, full_periods=True):
+    """
+    Remove bezel of a sine tile, and truncate it to full periods if full_periods
+    Return a view of the input
+    """
+    tile = remove_bezel(sine_tile, bezel_ratio) # remove bezel
+    if full_periods: # truncate to full period
+        period_pix = 1/lpmm/pp
+        tile_w = tile.shape[1]
+        new_w = (np.floor(tile_w/period_pix)*period_pix).astype(int)
+        assert new_w > 0, 'Tile width less than one period'
+        tile = center_crop_pad_to(tile, new_w, 1)
+    return tile
+
+@lru_cache(maxsize=256)
+def _sine_tile_freq_idx(tile_hw, lpmm, pp_x, pp_y, freq_diff_ratio=0.15):
+    """
+    Return the (fy_idx, fx_idx) index arrays of the integration window around lpmm
+    in the (not shifted) rfftn spectrum of a tile_hw shaped tile, 
+    shaped to index spec[fy_idx, fx_idx] directly
+    pp_x, pp_y: pixel pitch in mm along width and height
+    Cached, as a chart gives the same few tile shapes frame after frame
+    """
+    tile_h, tile_w = tile_hw
+    lpmm_whw = lpmm * freq_diff_ratio
+    fx = np.fft.rfftfreq(tile_w, pp_x)
+    fy = np.fft.fftfreq(tile_h, pp_y)
+    fx_inline_idx = np.argwhere(np.abs(fx-lpmm)<=lpmm_whw).reshape(1,-1)
+    fy_inline_idx = np.argwhere(np.abs(fy)<=lpmm_whw).reshape(-1,1)
+    fx_inline_idx.setflags(write=False)
+    fy_inline_idx.setflags(write=False)
+    return fy_inline_idx, fx_inline_idx
+
+@lru_cache(maxsize=256)
+def _sine_tile_dft_basis(tile_hw, lpmm, pp, freq_diff_ratio=0.15, search=False):
+    """
+    Return the (basis_y, basis_x) to project a tile_hw shaped tile onto the frequencies around lpmm
+    basis_y: (2*ny)xH real array, cos then sin rows of the ny vertical bins in the integration window
+    basis_x: Wxnx complex array, columns are e^(-2*pi*i*f*x) of 
+             lpmm only, or every horizontal bin in the integration window if search
+    Cached, as a chart gives the same few tile shapes frame after frame
+    """
+    tile_h, tile_w = tile_hw
+    fy_inline_idx, fx_inline_idx = _sine_tile_freq_idx(tile_hw, lpmm, pp, pp, freq_diff_ratio)
+    theta_y = 2*np.pi * np.outer(fy_inline_idx.reshape(-1), np.arange(tile_h)) / tile_h
+    basis_y = np.concatenate([np.cos(theta_y), np.sin(theta_y)], 0)
+    if search:
+        fx = fx_inline_idx.reshape(-1) / (tile_w*pp)
+    else:
+        fx = np.array([lpmm], dtype=float)
+    basis_x = np.exp(-2j*np.pi * np.outer(np.arange(tile_w)*pp, fx))
+    basis_y.setflags(write=False)
+    basis_x.setflags(write=False)
+    return basis_y, basis_x
+
 def estimate_mtf_from_sine_tile(sine_tile, lpmm, pp, 
                                 comm_mode=None, diff_mode=0.5, 
                                 freq_diff_ratio=0.15, bezel_ratio=0.1,
-                                full_periods=True
+                                full_periods=True, method='fft', dft_search=True
                                ):
     """
     sine_tile:       a MxN 0-1 float array, blurred sine wave along horizontal direction
@@ -303,41 +466,381 @@ def estimate_mtf_from_sine_tile(sine_tile, lpmm, pp,
     bezel_ratio:     bezel width ratio to remove
                      allows slightly tilting/distortion
     full_periods:    if True, truncate the tile to full periods after removing bezel
+    method:          'fft', power within the window of the full 2D real FFT
+                     'dft', project the tile onto complex exponentials of the window's vertical bins,
+                     then onto lpmm horizontally. Cost grows linearly with the tile size
+    dft_search:      only for 'dft', project onto every horizontal bin within the window, 
+                     then gives the same MTF as 'fft'. If False, project onto lpmm only, 
+                     which drops fast once the tile is slightly rotated or scaled
     """
     # preprocess and parse parameter
-    tile = remove_bezel(sine_tile, bezel_ratio) # remove bezel
-    if full_periods: # truncate to full period
-        period_pix = 1/lpmm/pp
-        tile_w = tile.shape[1]
-        new_w = (np.floor(tile_w/period_pix)*period_pix).astype(int)
-        assert new_w > 0, 'Tile width less than one period'
-        tile = center_crop_pad_to(tile, new_w, 1)
-    tile_h, tile_w = tile.shape[:2]
+    tile = _crop_sine_tile(sine_tile, lpmm, pp, bezel_ratio, full_periods)
     if comm_mode is None: # parse common mode
         comm_mode = tile.mean()
     tile = (tile - comm_mode) / diff_mode # make zero-mean, normalize scale
-    lpmm_whw = lpmm * freq_diff_ratio
+    
+    if method == 'fft':
+        # fft to spectrum
+        spec = np.fft.rfftn(tile)
+        spec = spec/spec.size # normalize power
+        # power within the window
+        fy_inline_idx, fx_inline_idx = _sine_tile_freq_idx(tile.shape, lpmm, pp, pp, freq_diff_ratio)
+        p_spec = np.power(np.abs(spec[fy_inline_idx, fx_inline_idx]), 2).sum()
+    elif method == 'dft':
+        # project vertically, then horizontally, normalized as the rfftn spectrum
+        basis_y, basis_x = _sine_tile_dft_basis(tile.shape, lpmm, pp, freq_diff_ratio, dft_search)
+        proj_y = basis_y @ tile
+        ny = proj_y.shape[0]//2
+        proj = ((proj_y[:ny] - 1j*proj_y[ny:]) @ basis_x) / (tile.shape[0]*(tile.shape[1]//2+1))
+        p_spec = np.power(np.abs(proj), 2).sum()
+    else:
+        raise ValueError('Unknown MTF method {}'.format(method))
+    mtf = np.sqrt(p_spec) # MTF is amplitude ratio, square root of power ratio
+    
+    return mtf
+
+def estimate_mtf_from_sine_tiles(sine_tile_list, lpmm_list, pp_list, 
+                                 comm_mode=None, diff_mode=0.5, 
+                                 freq_diff_ratio=0.15, bezel_ratio=0.1,
+                                 full_periods=True, common_hw=None, min_period_pix=4
+                                ):
+    """
+    Batched version of estimate_mtf_from_sine_tile, return a list of MTF
+    Every tile is cropped the same way, resampled to a common shape, 
+    and all go through one stacked FFT
+    
+    sine_tile_list:  MxN arrays, 0-1 float, or 0-255 uint8 with comm/diff_mode scaled alike
+    lpmm_list, pp_list: lpmm and pixel pitch in mm of each tile
+    common_hw:       (h, w) of the common shape, if None, use the smallest height and width,
+                     widened if needed so every tile keeps min_period_pix pixels per period
+    rest:            same as estimate_mtf_from_sine_tile
+    
+    Resampling keeps the amount of periods and the frequency bin spacing of each tile,
+    so the integration windows cover the same bins, 
+    only the rfft normalization needs correcting by (w/(w//2+1)) / (W/(W//2+1))
+    The tiles are oversampled far above their sine frequency, Lanczos resampling changes 
+    the MTF by about 1e-4 on clean tiles (cubic overshoots by about 1e-3, not used)
+    """
+    # crop, views only
+    tile_list = [_crop_sine_tile(tile, lpmm, pp, bezel_ratio, full_periods) 
+                 for tile, lpmm, pp in zip(sine_tile_list, lpmm_list, pp_list)]
+    # common shape
+    if common_hw is None:
+        max_periods = max(tile.shape[1]*lpmm*pp for tile, lpmm, pp in zip(tile_list, lpmm_list, pp_list))
+        common_hw = (min(tile.shape[0] for tile in tile_list), 
+                     max(min(tile.shape[1] for tile in tile_list), int(np.ceil(max_periods*min_period_pix))))
+    H, W = common_hw
+    
+    # resample and normalize into one stack
+    stack = np.empty((len(tile_list), H, W), dtype=np.float32)
+    for a, tile in enumerate(tile_list):
+        if tile.shape[:2] == (H, W):
+            stack[a] = tile
+        else:
+            stack[a] = cv.resize(tile.astype(np.float32), (W, H), interpolation=cv.INTER_LANCZOS4)
+        tile_comm_mode = tile.mean() if comm_mode is None else comm_mode
+        stack[a] -= tile_comm_mode
+    stack /= diff_mode
     
     # fft to spectrum
-    spec = np.fft.fftshift(np.fft.rfftn(tile), 0)
-    spec = spec/spec.size # normalize power
-    fx = np.fft.rfftfreq(tile_w, pp)
-    fy = np.fft.fftshift(np.fft.fftfreq(tile_h, pp))
+    spec = np.fft.rfftn(stack, axes=(1,2))
+    spec = spec/(H*(W//2+1)) # normalize power, as for a single tile
     
     # calculate MTF by power within the window
-    fx_inline_idx = np.argwhere(np.abs(fx-lpmm)<=lpmm_whw).reshape(1,-1)
-    fy_inline_idx = np.argwhere(np.abs(fy)<=lpmm_whw).reshape(-1,1)
-    p_spec = np.power(np.abs(spec[fy_inline_idx, fx_inline_idx]), 2).sum()
-    mtf = np.sqrt(p_spec) # MTF is amplitude ratio, square root of power ratio
+    mtf_list = []
+    for a, (tile, lpmm, pp) in enumerate(zip(tile_list, lpmm_list, pp_list)):
+        h, w = tile.shape[:2]
+        fy_inline_idx, fx_inline_idx = _sine_tile_freq_idx((H, W), lpmm, pp*w/W, pp*h/H, freq_diff_ratio)
+        p_spec = np.power(np.abs(spec[a][fy_inline_idx, fx_inline_idx]), 2).sum()
+        norm_corr = (w/(w//2+1)) / (W/(W//2+1))
+        mtf_list.append(float(np.sqrt(p_spec) * norm_corr))
     
-    return mtf
+    return mtf_list
+
+##############################
+### chart analysis
+##############################
+def find_chart_roi(aruco_corner_list, meta_dict, img_shape, pad_ratio=0.05, partial=True):
+    """
+    Gives the bounding box (x0, y0, x1, y1) of the whole ArUco-Sine chart in an image,
+    according to aruco marker corner points. The box is padded by pad_ratio of its size,
+    and clipped to the image. x1/y1 are exclusive, so img[y0:y1, x0:x1] is the ROI
+    img_shape: shape of the image
+    """
+    H_src2tsf = _chart_affine(aruco_corner_list, meta_dict, partial=partial, reverse=False)
+    src_corners = prepare_chart_geometry(meta_dict)['chart_corners']
+    tsf_corners = src_corners @ H_src2tsf[:, :2].T + H_src2tsf[:, 2]
+    (x0, y0), (x1, y1) = tsf_corners.min(0), tsf_corners.max(0)
+    pad = pad_ratio * max(x1-x0, y1-y0)
+    x0 = int(max(0, np.floor(x0-pad)))
+    y0 = int(max(0, np.floor(y0-pad)))
+    x1 = int(min(img_shape[1], np.ceil(x1+pad)+1))
+    y1 = int(min(img_shape[0], np.ceil(y1+pad)+1))
+    return x0, y0, x1, y1
+
+def analyze_aruco_sine_chart(img, aruco_corner_list, meta_dict, bezel_ratio=0.15, partial=True, 
+                             mtf_method='fft'):
+    """
+    Estimate the MTF of all sine tiles of an ArUco-Sine chart in a frame
+    img: HxW uint8 grayscale image containing the chart
+    aruco_corner_list: 4x2 np.float32 array, starting from origin, clockwise
+    meta_dict: meta data dictionary discribing the property of the board
+    mtf_method: 'fft', all sine tiles in one batched FFT, 
+                or 'dft', projecting each tile onto its frequency, see estimate_mtf_from_sine_tile
+    Return values
+    sine_corner_list: 4x2 int array, corners of the sine block in img, clockwise
+    lpmm_list: the lpmm of the sine tiles
+    mtf_list: the MTF of the sine tiles
+    ArUco-Star charts (meta_dict with star_xywhr) go to analyze_aruco_star_chart instead, 
+    the star's bounding square and MTF curve are returned the same way
+    """
+    if 'star_xywhr' in meta_dict:
+        return analyze_aruco_star_chart(img, aruco_corner_list, meta_dict, partial=partial)
+    # extract tiles
+    tile_list, pp_list, lpmm_list = extract_sine_and_bw_tiles(img, aruco_corner_list, meta_dict, partial=partial)
+    # calculate black/white contrast
+    bw_tile = tile_list[-1].astype(float)/255.0
+    comm_mode, diff_mode = estimate_comm_diff_from_bw_tile(bw_tile)
+    # calculate spectrum and MTF, tiles stay 0-255, scale comm/diff mode instead
+    if mtf_method == 'fft': # all sine tiles in one batch
+        mtf_list = estimate_mtf_from_sine_tiles(tile_list[:-1], lpmm_list, pp_list[:-1], 
+                                                comm_mode*255.0, diff_mode*255.0, bezel_ratio=bezel_ratio)
+    else:
+        mtf_list = [float(estimate_mtf_from_sine_tile(tile, lpmm, pp, comm_mode*255.0, diff_mode*255.0, 
+                                                      bezel_ratio=bezel_ratio, method=mtf_method))
+                    for tile, lpmm, pp in zip(tile_list[:-1], lpmm_list, pp_list[:-1])]
+    # sine block outline
+    sine_corner_list = find_sine_corner_list(aruco_corner_list, meta_dict, partial=partial)
+    return sine_corner_list, lpmm_list, mtf_list
+
+def analyze_aruco_star_chart(img, aruco_corner_list, meta_dict, partial=True, lpmm_amount=32, ring_amount=8,
+                             interp_flag=cv.INTER_CUBIC, bw_oversample=4, center_iterations=1,
+                             center_max_freq=0.25, center_max_offset=4.0):
+    """
+    Estimate the MTF curve of the Siemens star of an ArUco-Star chart in a frame
+    The star is located by the ArUco marker as the sine block is. Rings around its center, 
+    ring_amount per lpmm bin, lpmm_amount bins over the chart's star_lpmm_range, are mapped into img
+    and sampled by one cv.remap, about one sample per pixel on the outer ring.
+    Each ring is projected onto the star's angular frequency, see estimate_mtf_from_star_rings,
+    normalized by the bw tile, and by the amplitude the star was drawn with at that radius
+    Rings off the star center lose amplitude fast near the center, a fraction of a pixel matters. 
+    The center is refined from the star phase around the rings, see estimate_star_center_offset, 
+    and the rings sampled again, center_iterations times. Only rings below center_max_freq cycles per
+    frame pixel are used, as the inner rings of a star are often aliased. A refinement moving the center
+    more than center_max_offset frame pixels from the marker's estimate, or lowering the amplitude
+    of those rings, is rejected
+    img: HxW uint8 grayscale image containing the chart
+    aruco_corner_list: 4x2 np.float32 array, starting from origin, clockwise
+    meta_dict: meta data dictionary of an ArUco-Star chart
+    Return values
+    star_corner_list: 4x2 int array, corners of the star's bounding square in img, clockwise
+    lpmm_list: the center lpmm of the bins
+    mtf_list: the MTF of the bins
+    """
+    src_pp = meta_dict['aruco_width_mm'] / meta_dict['aruco_xywhr'][2] # source pixel pitch in mm
+    H_src2tsf = _chart_affine(aruco_corner_list, meta_dict, partial=partial, reverse=False)
+    s_src2tsf = np.sqrt(np.abs(np.linalg.det(H_src2tsf[:2,:2]))) # scale
+    
+    # bw tile, as extract_sine_and_bw_tiles
+    H_tsf2src = cv.invertAffineTransform(H_src2tsf)
+    bw_tgt_w = np.round(s_src2tsf * bw_oversample * meta_dict['bw_xywhr'][2]).astype(int)
+    H_src2tgt, tgt_wh = recout_affine_shape(meta_dict['bw_xywhr'], bw_tgt_w)
+    H_total = np.array(_affine_2x3_to_3x3(H_src2tgt) @ _affine_2x3_to_3x3(H_tsf2src), dtype=np.float32)[:2]
+    bw_tile = _warp_affine_roi(img, H_total, tgt_wh, interp_flag).astype(float)/255.0
+    comm_mode, diff_mode = estimate_comm_diff_from_bw_tile(bw_tile)
+    
+    # rings in chart coordinates, mapped into img
+    cycles = meta_dict['star_cycles']
+    lpmm_list, radii = star_ring_radii(cycles, meta_dict['star_lpmm_range'], src_pp, lpmm_amount, ring_amount)
+    angle_amount = int(max(8*cycles, np.ceil(2*np.pi*radii.max()*s_src2tsf)))
+    phi = np.arange(angle_amount) * 2*np.pi/angle_amount
+    ring_x, ring_y = radii[..., None]*np.cos(phi), radii[..., None]*np.sin(phi)
+    cx0, cy0 = prepare_chart_geometry(meta_dict)['star_center']
+    cx, cy = cx0, cy0
+    # frequency of each ring in cycles per frame pixel, aliased ones left out of the center refinement
+    ring_mask = cycles/(2*np.pi*radii*s_src2tsf) < center_max_freq
+    basis = np.exp(-1j*cycles*phi)
+    best_amplitude = None
+    for a in range(center_iterations + 1):
+        src_x, src_y = cx + ring_x, cy + ring_y
+        map_x = (H_src2tsf[0,0]*src_x + H_src2tsf[0,1]*src_y + H_src2tsf[0,2]).astype(np.float32)
+        map_y = (H_src2tsf[1,0]*src_x + H_src2tsf[1,1]*src_y + H_src2tsf[1,2]).astype(np.float32)
+        ring_array = cv.remap(img, map_x.reshape(-1, angle_amount), map_y.reshape(-1, angle_amount), 
+                              interp_flag, borderMode=cv.BORDER_CONSTANT, borderValue=0)
+        ring_array = ring_array.reshape(radii.shape + (angle_amount,)).astype(np.float32)
+        # rings off the star center lose amplitude, a center lowering it is worse than the previous one
+        amplitude = np.abs(ring_array[ring_mask] @ basis).sum()
+        if best_amplitude is not None and amplitude < best_amplitude:
+            ring_array = best_ring_array
+            break
+        best_amplitude, best_ring_array = amplitude, ring_array
+        if a == center_iterations:
+            break
+        offset = estimate_star_center_offset(ring_array, radii, cycles, ring_mask=ring_mask)
+        # the rings sampled at the last accepted center are kept
+        if offset is None or np.hypot(cx - offset[0] - cx0, cy - offset[1] - cy0)*s_src2tsf > center_max_offset:
+            break
+        cx, cy = cx - offset[0], cy - offset[1]
+    
+    # MTF of all rings at once
+    attenuation = star_print_attenuation(cycles, radii, meta_dict.get('star_kernel', 'box'))
+    mtf_list = estimate_mtf_from_star_rings(ring_array, cycles, diff_mode*255.0, attenuation)
+    # star outline
+    star_corner_list = find_sine_corner_list(aruco_corner_list, meta_dict, partial=partial)
+    return star_corner_list, lpmm_list.tolist(), mtf_list.tolist()
+
+class MtfTemporalAverager():
+    """
+    Average the MTF of a chart over its last N frames, to steady the flickering of sensor noise
+    The power within the integration window (MTF squared) of each tile is kept in a ring buffer,
+    with its running sum and sum of squares, so one update and eviction costs O(tile amount) 
+    whatever N is. Averaging window power equals integrating the averaged power spectrum,
+    no spectrum needs keeping.
+    The averaged MTF is sqrt of the mean power, its confidence band comes from the standard error 
+    of the mean power, z standard errors wide on each side, mapped through sqrt.
+    """
+    def __init__(self, window=16, z=1.96, resum_gap=None):
+        """
+        window: amount of frames averaged
+        z: half width of the confidence band in standard errors, 1.96 for 95%
+        resum_gap: recompute the running sums from the buffer every this amount of updates, 
+                   against floating point drift, default window*16
+        """
+        self.window = window
+        self.z = z
+        self.resum_gap = window*16 if resum_gap is None else resum_gap
+        self.reset()
+
+    def reset(self, lpmm_list=None):
+        self.lpmm_list = None if lpmm_list is None else list(lpmm_list)
+        self.buf = None # window x tiles power
+        self.sum = None
+        self.sum_sq = None
+        self.count = 0 # frames in the buffer
+        self.head = 0 # next slot to write
+        self.update_count = 0
+
+    def update(self, lpmm_list, mtf_list):
+        """
+        Add the MTF of a new frame, evicting the oldest one if the window is full
+        Starts over if lpmm_list changed, e.g. the chart meta file was reloaded
+        Return mtf_list, mtf_low_list, mtf_high_list, averaged over the frames in the window
+        """
+        if self.lpmm_list != list(lpmm_list):
+            self.reset(lpmm_list)
+        power = np.square(np.asarray(mtf_list, dtype=float))
+        if self.buf is None:
+            self.buf = np.zeros((self.window, len(power)))
+            self.sum = np.zeros(len(power))
+            self.sum_sq = np.zeros(len(power))
+        # evict, then add
+        if self.count == self.window:
+            old = self.buf[self.head]
+            self.sum -= old
+            self.sum_sq -= old*old
+        else:
+            self.count += 1
+        self.buf[self.head] = power
+        self.sum += power
+        self.sum_sq += power*power
+        self.head = (self.head + 1) % self.window
+        self.update_count += 1
+        if self.update_count % self.resum_gap == 0:
+            self.sum = self.buf[:self.count].sum(0)
+            self.sum_sq = np.square(self.buf[:self.count]).sum(0)
+        return self.result()
+
+    def result(self):
+        """
+        Return mtf_list, mtf_low_list, mtf_high_list of the frames in the window, None if empty
+        """
+        if self.count == 0:
+            return None
+        n = self.count
+        mean = self.sum / n
+        if n > 1:
+            var = np.maximum(self.sum_sq - n*mean*mean, 0) / (n - 1)
+            half = self.z * np.sqrt(var / n)
+        else: # no spread from one frame
+            half = np.zeros_like(mean)
+        mtf = np.sqrt(np.maximum(mean, 0))
+        mtf_low = np.sqrt(np.maximum(mean - half, 0))
+        mtf_high = np.sqrt(mean + half)
+        return mtf.tolist(), mtf_low.tolist(), mtf_high.tolist()
+
+##############################
+### raw bayer frames
+##############################
+# (x, y) offset of each color channel in the 2x2 Bayer cell, keyed by the pattern of the top-left 2x2 cell,
+# as in pylon pixel formats, e.g. BayerRG8. Gr is the green on the red rows, Gb on the blue rows
+BAYER_CHANNEL_OFFSETS = {
+    'RG': {'R': (0, 0), 'Gr': (1, 0), 'Gb': (0, 1), 'B': (1, 1)},
+    'BG': {'B': (0, 0), 'Gb': (1, 0), 'Gr': (0, 1), 'R': (1, 1)},
+    'GR': {'Gr': (0, 0), 'R': (1, 0), 'B': (0, 1), 'Gb': (1, 1)},
+    'GB': {'Gb': (0, 0), 'B': (1, 0), 'R': (0, 1), 'Gr': (1, 1)},
+}
+BAYER_CHANNELS = ['R', 'Gr', 'Gb', 'B']
+
+def bayer_planes(raw, pattern='RG'):
+    """
+    Split a HxW raw Bayer frame into its four color planes, as strided views, no copy
+    Return a dict of channel -> (H/2)x(W/2) view
+    """
+    return {ch: raw[oy::2, ox::2] for ch, (ox, oy) in BAYER_CHANNEL_OFFSETS[pattern].items()}
+
+def bayer_to_plane_corners(corner_list, pattern, channel):
+    """
+    Map full resolution coordinates of a raw Bayer frame to a channel plane's coordinates
+    Pixel (x, y) of a plane sits at (2x + ox, 2y + oy) of the frame, so x = (X - ox) / 2
+    """
+    return (np.asarray(corner_list, dtype=np.float32) - BAYER_CHANNEL_OFFSETS[pattern][channel]) / 2
+
+def bayer_from_plane_corners(corner_list, pattern, channel):
+    """
+    Map a channel plane's coordinates back to full resolution coordinates, X = 2x + ox
+    """
+    return np.asarray(corner_list, dtype=np.float32) * 2 + BAYER_CHANNEL_OFFSETS[pattern][channel]
+
+def analyze_aruco_sine_chart_bayer(raw, aruco_corner_list, meta_dict, pattern='RG', channels=BAYER_CHANNELS,
+                                   corner_channel=None, **kwargs):
+    """
+    analyze_aruco_sine_chart on each color plane of a raw Bayer frame, without demosaicing
+    Every plane is a half resolution image of its own, sampled at its own offset, 
+    the chart geometry is mapped to it by bayer_to_plane_corners
+    raw: HxW raw Bayer frame, uint8 or uint16, MTF does not depend on the bit depth
+    aruco_corner_list: 4x2 array, in full resolution coordinates, 
+                       or in the plane coordinates of corner_channel if not None, e.g. detected on a G plane
+    channels: the color planes to analyze
+    kwargs are passed to analyze_aruco_sine_chart
+    Return values
+    sine_corner_list: 4x2 int array, corners of the sine block, in the same coordinates as aruco_corner_list
+    lpmm_list: the lpmm of the sine tiles
+    mtf_dict: channel -> the MTF of the sine tiles in that plane
+    """
+    if corner_channel is not None:
+        aruco_corner_list = bayer_from_plane_corners(aruco_corner_list, pattern, corner_channel)
+    plane_dict = bayer_planes(raw, pattern)
+    mtf_dict = {}
+    for ch in channels:
+        plane_corner_list = bayer_to_plane_corners(aruco_corner_list, pattern, ch)
+        _, lpmm_list, mtf_dict[ch] = analyze_aruco_sine_chart(plane_dict[ch], plane_corner_list, meta_dict, **kwargs)
+    sine_corner_list = find_sine_corner_list(aruco_corner_list, meta_dict, partial=kwargs.get('partial', True))
+    if corner_channel is not None:
+        sine_corner_list = np.round(bayer_to_plane_corners(sine_corner_list, pattern, corner_channel)).astype(int)
+    return sine_corner_list, lpmm_list, mtf_dict
 
 ##############################
 ### draw information
 ##############################
-def draw_sine_block_outline_and_mtf(img, sine_corner_list, lpmm_list, mtf_list, color=(0,255,0)):
+def draw_sine_block_outline_and_mtf(img, sine_corner_list, lpmm_list, mtf_list, color=(0,255,0), title=None,
+                                    mtf_band=None):
     """
     sine_corner_list is a 4x2 np.int32 array, denoting the corners of a sine block, clockwise
+    title: if not None, an extra first line of text
+    mtf_band: if not None, (mtf_low_list, mtf_high_list), e.g. from MtfTemporalAverager, 
+              each MTF is shown with the half width of its band, and a bar of the band
+    mtf_list may also be a dict of channel -> MTF list, e.g. from analyze_aruco_sine_chart_bayer,
+    then all channels are shown on each line, without band
     """
     # sine block geometry
     text_x = sine_corner_list[:,0].max()
@@ -345,15 +848,103 @@ def draw_sine_block_outline_and_mtf(img, sine_corner_list, lpmm_list, mtf_list,
     h = sine_corner_list[:,1].max() - sine_corner_list[:,1].min()
     
     # mtf text
-    text_list = ['{:.3f}: {:.3f}'.format(lpmm, mtf) for lpmm, mtf in zip(lpmm_list, mtf_list)]
+    if isinstance(mtf_list, dict):
+        text_list = ['{:.3f}: '.format(lpmm) + ' '.join('{} {:.3f}'.format(ch, mtf) for ch, mtf in zip(mtf_list, mtfs))
+                     for lpmm, *mtfs in zip(lpmm_list, *mtf_list.values())]
+        mtf_band = None
+    elif mtf_band is None:
+        text_list = ['{:.3f}: {:.3f}'.format(lpmm, mtf) for lpmm, mtf in zip(lpmm_list, mtf_list)]
+    else:
+        text_list = ['{:.3f}: {:.3f} +-{:.3f}'.format(lpmm, mtf, (high - low)/2) 
+                     for lpmm, mtf, low, high in zip(lpmm_list, mtf_list, *mtf_band)]
+    if title is not None:
+        text_list = [title] + text_list
     
     # draw
     img = draw_polylines(img, sine_corner_list.astype(np.int32), 
                          True, (0, 255, 0), np.round(h/80).astype(int), cv.LINE_AA)
     img = draw_multiline_text(img, text_list, (text_x, text_y), h)
     
+    # band bars over the sine block, MTF 0-1 across the block width, one row per tile
+    if mtf_band is not None and len(mtf_list) > 0:
+        bar_x0 = sine_corner_list[:,0].min()
+        bar_w = text_x - bar_x0
+        row_h = h / len(mtf_list)
+        thickness = max(1, np.round(row_h/8).astype(int))
+        for a, (mtf, low, high) in enumerate(zip(mtf_list, *mtf_band)):
+            y = np.round(text_y + (a+0.5)*row_h).astype(int)
+            x_low, x_mtf, x_high = [np.round(bar_x0 + bar_w*np.clip(v, 0, 1)).astype(int) for v in (low, mtf, high)]
+            cv.line(img, (x_low, y), (x_high, y), color, thickness, cv.LINE_AA)
+            cv.line(img, (x_mtf, y - 2*thickness), (x_mtf, y + 2*thickness), color, thickness, cv.LINE_AA)
+    
+    return img
+
+# curve colors of the color planes of raw Bayer frames, BGR
+BAYER_CHANNEL_COLORS = {'R': (0,0,255), 'Gr': (0,255,0), 'Gb': (0,160,0), 'B': (255,0,0)}
+
+def draw_star_outline_and_mtf(img, star_corner_list, lpmm_list, mtf_list, color=(0,255,0), title=None,
+                              mtf_band=None, lpmm_max=None):
+    """
+    star_corner_list is a 4x2 np.int32 array, denoting the corners of the star's bounding square, clockwise
+    The star's outline is drawn, and its MTF curve plotted in a square box on its right, 
+    MTF 0-1 over lpmm 0-lpmm_max (default the last lpmm), with the MTF50 below
+    title: if not None, an extra first line of text
+    mtf_band: if not None, (mtf_low_list, mtf_high_list), drawn as thin curves
+    mtf_list may also be a dict of channel -> MTF list, then one curve per channel, without band
+    """
+    # star geometry, the inscribed ellipse of the bounding parallelogram
+    corner_list = np.asarray(star_corner_list, dtype=float)
+    center = corner_list.mean(0)
+    u, v = (corner_list[1] - corner_list[0])/2, (corner_list[3] - corner_list[0])/2
+    t = np.linspace(0, 2*np.pi, 65)[:-1]
+    outline = center + np.cos(t)[:,None]*u + np.sin(t)[:,None]*v
+    radius = np.sqrt(np.abs(np.cross(u, v))) # of a circle of the same area
+    h = 2*radius
+    thickness = max(1, np.round(h/150).astype(int))
+    img = draw_polylines(img, np.round(outline).astype(np.int32), True, color, thickness, cv.LINE_AA)
+    
+    # plot box, the star's size, on its right
+    x0, y0 = center[0] + radius*1.1, center[1] - radius
+    lpmm_max = lpmm_list[-1] if lpmm_max is None else lpmm_max
+    def to_xy(mtfs):
+        x = x0 + h*np.asarray(lpmm_list)/lpmm_max
+        y = y0 + h*(1 - np.clip(mtfs, 0, 1))
+        return np.round(np.stack([x, y], 1)).astype(np.int32)
+    box = np.round([[x0, y0], [x0+h, y0], [x0+h, y0+h], [x0, y0+h]]).astype(np.int32)
+    img = draw_polylines(img, box, True, color, max(1, thickness//2), cv.LINE_AA)
+    y_half = int(np.round(y0 + h/2)) # MTF 0.5
+    cv.line(img, (int(box[0,0]), y_half), (int(box[1,0]), y_half), color, 1, cv.LINE_AA)
+    
+    # curves
+    if isinstance(mtf_list, dict):
+        for ch, mtfs in mtf_list.items():
+            img = draw_polylines(img, to_xy(mtfs), False, BAYER_CHANNEL_COLORS.get(ch, color), thickness, cv.LINE_AA)
+        mtf50 = mtf50_from_curve(lpmm_list, np.mean(list(mtf_list.values()), 0))
+    else:
+        img = draw_polylines(img, to_xy(mtf_list), False, color, thickness, cv.LINE_AA)
+        if mtf_band is not None:
+            for mtfs in mtf_band:
+                img = draw_polylines(img, to_xy(mtfs), False, color, 1, cv.LINE_AA)
+        mtf50 = mtf50_from_curve(lpmm_list, mtf_list)
+    
+    # text below the box
+    text_list = ['MTF50: {}'.format('> {:.3f}'.format(lpmm_list[-1]) if mtf50 is None else '{:.3f}'.format(mtf50)),
+                 '{:.3f}-{:.3f} lp/mm'.format(lpmm_list[0], lpmm_list[-1])]
+    if title is not None:
+        text_list = [title] + text_list
+    img = draw_multiline_text(img, text_list, (x0, y0 + h*1.02), h*0.1*len(text_list), color)
+    
     return img
 
+def draw_chart_outline_and_mtf(img, corner_list, lpmm_list, mtf_list, meta_dict, title=None, mtf_band=None):
+    """
+    draw_star_outline_and_mtf for ArUco-Star charts, draw_sine_block_outline_and_mtf for the others
+    corner_list is what analyze_aruco_sine_chart returns for the chart of meta_dict
+    """
+    if 'star_xywhr' in meta_dict:
+        return draw_star_outline_and_mtf(img, corner_list, lpmm_list, mtf_list, title=title, mtf_band=mtf_band)
+    return draw_sine_block_outline_and_mtf(img, corner_list, lpmm_list, mtf_list, title=title, mtf_band=mtf_band)
+
 # def estimate_mtf_from_sine_tile(sine_tile, lpmm, pp, 
 #                                 comm_mode=0.5, diff_mode=0.5, 
 #                                 freq_diff_ratio=0.15, bezel_ratio=0.1
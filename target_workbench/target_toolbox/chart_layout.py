@@ -0,0 +1,421 @@
+"""
+Chart composition by placed tiles, rendered strip by strip
+
+A chart is described as a ChartLayout, a canvas size plus a list of tiles placed on it.
+Tiles only keep what they need to produce their rows: a fill value, a 1D profile,
+a bit grid, or a small array. Rendering goes through horizontal strips,
+so a poster-size chart can be written straight into a PNG file
+while only a few strips are in memory.
+"""
+
+import struct
+import zlib
+from functools import lru_cache
+import numpy as np
+import cv2 as cv
+
+from .common import mm_to_pixels, pixels_to_mm, dpi_to_pp, center_crop_pad_to, draw_bw_ref_profile
+from .aruco_marker import ARUCO_INNER_BIT, ARUCO_EDGE_BIT, ARUCO_DICT_TYPE_STR, ARUCO_DICT_TYPE
+from .aruco_marker import draw_aruco_bit_grid, draw_aruco_desc_tile
+from .sine_chart import draw_sine_profile, draw_sine_block_desc_tile
+from .three_bar_chart import resolution_element
+from .siemens_star import draw_siemens_star_region, draw_siemens_star_desc_tile, star_lpmm_range
+
+##############################
+### tiles
+##############################
+class FillTile():
+    """
+    A w x h rectangle of one value, placed at (x, y)
+    """
+    def __init__(self, x, y, w, h, value=255):
+        self.x, self.y, self.w, self.h = x, y, w, h
+        self.value = value
+
+    def paint(self, dst, r0, r1, c0, c1):
+        """
+        Paint tile rows r0:r1, columns c0:c1 (tile coordinate) into dst, same shape
+        """
+        dst[:] = self.value
+
+class RowProfileTile():
+    """
+    A tile whose rows are all the same profile, e.g. a sine tile or the bw reference tile
+    """
+    def __init__(self, x, y, profile, h):
+        self.x, self.y, self.w, self.h = x, y, len(profile), h
+        self.profile = np.asarray(profile, dtype=np.uint8)
+
+    def paint(self, dst, r0, r1, c0, c1):
+        dst[:] = self.profile[c0:c1]
+
+class ColProfileTile():
+    """
+    A tile whose columns are all the same profile, e.g. a sine tile rotated by 90 degrees
+    """
+    def __init__(self, x, y, profile, w):
+        self.x, self.y, self.w, self.h = x, y, w, len(profile)
+        self.profile = np.asarray(profile, dtype=np.uint8)
+
+    def paint(self, dst, r0, r1, c0, c1):
+        dst[:] = self.profile[r0:r1, None]
+
+def _nearest_index(src_len, dst_len):
+    # source index of each destination pixel, as cv.resize INTER_NEAREST
+    return np.minimum(np.floor(np.arange(dst_len) * (src_len/dst_len)).astype(int), src_len-1)
+
+class BitGridTile():
+    """
+    A small grid scaled to w x h by nearest neighbor, e.g. an ArUco marker of one pixel per bit
+    """
+    def __init__(self, x, y, grid, w, h):
+        self.x, self.y, self.w, self.h = x, y, w, h
+        self.grid = np.asarray(grid, dtype=np.uint8)
+        self.row_idx = _nearest_index(self.grid.shape[0], h)
+        self.col_idx = _nearest_index(self.grid.shape[1], w)
+
+    def paint(self, dst, r0, r1, c0, c1):
+        dst[:] = self.grid[self.row_idx[r0:r1]][:, self.col_idx[c0:c1]]
+
+class ArrayTile():
+    """
+    A small uint8 array painted as is, e.g. a text tile
+    If mask is True, arr is boolean, and only its True pixels are painted with value
+    """
+    def __init__(self, x, y, arr, mask=False, value=0):
+        self.x, self.y = x, y
+        self.h, self.w = arr.shape[:2]
+        self.arr = arr
+        self.mask = mask
+        self.value = value
+
+    def paint(self, dst, r0, r1, c0, c1):
+        if self.mask:
+            dst[self.arr[r0:r1, c0:c1]] = self.value
+        else:
+            dst[:] = self.arr[r0:r1, c0:c1]
+
+class SiemensStarTile():
+    """
+    A sinusoidal Siemens star of d x d pixels, drawn strip by strip as painted, nothing kept
+    """
+    def __init__(self, x, y, cycles, d, center_ratio=0.1, kernel='box', background=255):
+        self.x, self.y, self.w, self.h = x, y, d, d
+        self.cycles, self.center_ratio, self.kernel = cycles, center_ratio, kernel
+        self.background = background
+
+    def paint(self, dst, r0, r1, c0, c1):
+        dst[:] = draw_siemens_star_region(self.cycles, self.w, r0, r1, c0, c1,
+                                          self.center_ratio, self.kernel, self.background)
+
+##############################
+### layout
+##############################
+class ChartLayout():
+    """
+    A h x w uint8 grayscale canvas with tiles placed on it
+    Tiles are painted in the order they are added, later ones on top, clipped to the canvas
+    """
+    def __init__(self, w, h, background=255, dpi=None):
+        self.w, self.h = int(w), int(h)
+        self.background = background
+        self.dpi = dpi
+        self.tile_list = []
+
+    def add(self, tile):
+        self.tile_list.append(tile)
+        return tile
+
+    def render_strip(self, y0, y1):
+        """
+        Render canvas rows y0:y1
+        """
+        strip = np.full((y1-y0, self.w), self.background, dtype=np.uint8)
+        for tile in self.tile_list:
+            ty0, ty1 = max(y0, tile.y), min(y1, tile.y+tile.h)
+            tx0, tx1 = max(0, tile.x), min(self.w, tile.x+tile.w)
+            if ty0 >= ty1 or tx0 >= tx1:
+                continue
+            tile.paint(strip[ty0-y0:ty1-y0, tx0:tx1],
+                       ty0-tile.y, ty1-tile.y, tx0-tile.x, tx1-tile.x)
+        return strip
+
+    def iter_strips(self, strip_rows=256):
+        for y0 in range(0, self.h, strip_rows):
+            yield self.render_strip(y0, min(self.h, y0+strip_rows))
+
+    def render(self):
+        """
+        Render the whole canvas in memory, for small charts
+        """
+        return self.render_strip(0, self.h)
+
+    def write_png(self, fn, strip_rows=256, level=6):
+        """
+        Render strip by strip straight into a grayscale PNG file,
+        with the dpi recorded if the layout has one
+        """
+        with PngStreamWriter(fn, self.w, self.h, self.dpi, level) as writer:
+            for strip in self.iter_strips(strip_rows):
+                writer.write_rows(strip)
+
+##############################
+### streaming PNG writer
+##############################
+class PngStreamWriter():
+    """
+    Write an 8-bit grayscale PNG file row by row, without holding the image
+    Rows are filtered by the "Up" filter, which turns the repeated rows of charts into zeros
+    """
+    def __init__(self, fn, w, h, dpi=None, level=6, idat_size=1<<20):
+        self.w, self.h = w, h
+        self.idat_size = idat_size
+        self.rows_written = 0
+        self.prev_row = np.zeros(w, dtype=np.uint8)
+        self.compressor = zlib.compressobj(level)
+        self.buffer = []
+        self.buffer_len = 0
+        self.fp = open(fn, 'wb')
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 0, 0, 0, 0))
+        if dpi is not None:
+            ppm = int(np.round(dpi / 0.0254)) # pixels per meter
+            self._chunk(b'pHYs', struct.pack('>IIB', ppm, ppm, 1))
+
+    def _chunk(self, chunk_type, data):
+        self.fp.write(struct.pack('>I', len(data)))
+        self.fp.write(chunk_type)
+        self.fp.write(data)
+        self.fp.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def _flush_idat(self):
+        if self.buffer_len > 0:
+            self._chunk(b'IDAT', b''.join(self.buffer))
+            self.buffer = []
+            self.buffer_len = 0
+
+    def write_rows(self, rows):
+        """
+        rows: N x w uint8 array
+        """
+        assert rows.shape[1] == self.w and rows.dtype == np.uint8, 'Rows should be uint8, {} wide'.format(self.w)
+        assert self.rows_written + rows.shape[0] <= self.h, 'More rows than the image height'
+        filtered = np.empty((rows.shape[0], self.w+1), dtype=np.uint8)
+        filtered[:, 0] = 2 # Up filter
+        filtered[0, 1:] = rows[0] - self.prev_row
+        filtered[1:, 1:] = rows[1:] - rows[:-1]
+        self.prev_row = rows[-1].copy()
+        self.rows_written += rows.shape[0]
+        data = self.compressor.compress(filtered.tobytes())
+        if len(data) > 0:
+            self.buffer.append(data)
+            self.buffer_len += len(data)
+        if self.buffer_len >= self.idat_size:
+            self._flush_idat()
+
+    def close(self):
+        assert self.rows_written == self.h, 'Only {} of {} rows written'.format(self.rows_written, self.h)
+        self.buffer.append(self.compressor.flush())
+        self.buffer_len += len(self.buffer[-1])
+        self._flush_idat()
+        self._chunk(b'IEND', b'')
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+
+##############################
+### chart layouts
+##############################
+@lru_cache(maxsize=64)
+def cached_sine_profile(lpmm, length, dpi, subpix_amount=101, scale_to_full=True):
+    """
+    draw_sine_profile, cached and read-only, as charts in a batch usually share their sine tiles
+    """
+    profile = draw_sine_profile(lpmm, length, dpi, subpix_amount, scale_to_full)
+    profile.setflags(write=False)
+    return profile
+
+def sine_block_layout(lpmm_list, length, height, dpi, subpix_amount=101, scale_to_01=True):
+    """
+    Layout of draw_sine_block, sine tiles stacked vertically
+    """
+    height_pix = int(mm_to_pixels(height, dpi))
+    profile_list = [cached_sine_profile(lpmm, length, dpi, subpix_amount, scale_to_01) for lpmm in lpmm_list]
+    layout = ChartLayout(len(profile_list[0]), height_pix*len(profile_list), dpi=dpi)
+    for a, profile in enumerate(profile_list):
+        layout.add(RowProfileTile(0, a*height_pix, profile, height_pix))
+    return layout
+
+def aruco_sine_chart_layout(aruco_idx, aruco_length,
+                            lpmm_list, length, height,
+                            side_width, dpi=600,
+                            aruco_dict_type=ARUCO_DICT_TYPE):
+    """
+    Layout of generate_aruco_sine_chart_meta, return the layout and the chart's meta data dict
+    Args are the same as generate_aruco_sine_chart_meta
+    """
+    ### Pattern sizes
+    # ArUco marker, sine block
+    aruco_pix = int(mm_to_pixels(aruco_length, dpi))
+    length_pix = int(mm_to_pixels(length, dpi))
+    height_pix = int(mm_to_pixels(height, dpi))
+    sine_block_hw = (height_pix*len(lpmm_list), length_pix)
+    gap_pix = int(np.round(aruco_pix/(ARUCO_INNER_BIT+2*ARUCO_EDGE_BIT)))
+    bw_h = int(mm_to_pixels(side_width, dpi))
+    # sine block is rotated 90 degrees counter-clockwise, next to the marker
+    top_h = max(sine_block_hw[1], aruco_pix)
+    total_w = sine_block_hw[0] + gap_pix + aruco_pix
+    layout = ChartLayout(total_w, top_h + gap_pix + bw_h, dpi=dpi)
+
+    ### Tiles
+    # rotated sine block, tile a becomes columns a*height_pix:(a+1)*height_pix, profile reversed
+    for a, lpmm in enumerate(lpmm_list):
+        profile = cached_sine_profile(lpmm, length, dpi)
+        layout.add(ColProfileTile(a*height_pix, 0, profile[::-1], height_pix))
+    # ArUco marker
+    layout.add(BitGridTile(sine_block_hw[0]+gap_pix, 0, draw_aruco_bit_grid(aruco_dict_type, aruco_idx),
+                           aruco_pix, aruco_pix))
+    # description tiles, bottom aligned in the gap below the sine block
+    aruco_desc_tile = draw_aruco_desc_tile(ARUCO_DICT_TYPE_STR, aruco_idx, aruco_length, dpi)
+    sine_desc_tile = draw_sine_block_desc_tile(lpmm_list, height*len(lpmm_list), dpi)
+    aruco_desc_tile = center_crop_pad_to(aruco_desc_tile, sine_block_hw[0], 1, 255)[:,:,0]
+    sine_desc_tile = center_crop_pad_to(sine_desc_tile, sine_block_hw[0], 1, 255)[:,:,0]
+    layout.add(ArrayTile(0, top_h+gap_pix-aruco_desc_tile.shape[0], aruco_desc_tile))
+    layout.add(ArrayTile(0, top_h+gap_pix-aruco_desc_tile.shape[0]-sine_desc_tile.shape[0], sine_desc_tile))
+    # black/white side tile
+    layout.add(RowProfileTile(0, top_h+gap_pix, draw_bw_ref_profile(total_w), bw_h))
+
+    ### data file
+    meta_dict = {}
+
+    # total image height and width
+    meta_dict['hw_pix'] = [layout.h, layout.w]
+    meta_dict['hw_mm'] = pixels_to_mm(np.array(meta_dict['hw_pix']), dpi).tolist()
+
+    # aruco marker location and size
+    meta_dict['aruco_idx'] = aruco_idx
+    meta_dict['aruco_xywhr'] = [sine_block_hw[0]+gap_pix, 0,
+                                aruco_pix, aruco_pix,
+                                0]
+    meta_dict['aruco_width_mm'] = pixels_to_mm(aruco_pix, dpi)
+
+    # sine block location and size
+    meta_dict['sine_xywhr'] = [0, sine_block_hw[1]-1,
+                               sine_block_hw[1], sine_block_hw[0],
+                               -np.pi/2]
+    meta_dict['lpmm_list'] = lpmm_list
+
+    # bw_ref chart location, below the top row and the gap
+    meta_dict['bw_xywhr'] = [0, top_h+gap_pix,
+                             total_w, bw_h,
+                             0]
+
+    return layout, meta_dict
+
+def aruco_star_chart_layout(aruco_idx, aruco_length,
+                            star_cycles, star_diameter,
+                            side_width, dpi=600, center_ratio=0.1, kernel='box',
+                            aruco_dict_type=ARUCO_DICT_TYPE):
+    """
+    Layout of an ArUco-Star chart, return the layout and the chart's meta data dict
+    Same as aruco_sine_chart_layout, with a sinusoidal Siemens star in place of the sine block,
+    so the chart is located the same way, and gives the MTF over a range of lpmm
+    star_cycles, star_diameter: sine periods around the star, star diameter in mm
+    center_ratio, kernel: see draw_siemens_star
+    """
+    ### Pattern sizes
+    aruco_pix = int(mm_to_pixels(aruco_length, dpi))
+    star_pix = int(mm_to_pixels(star_diameter, dpi))
+    gap_pix = int(np.round(aruco_pix/(ARUCO_INNER_BIT+2*ARUCO_EDGE_BIT)))
+    bw_h = int(mm_to_pixels(side_width, dpi))
+    lpmm_range = star_lpmm_range(star_cycles, star_pix, dpi_to_pp(dpi), center_ratio)
+    # description tiles, stacked in the gap below the star, the gap grown to fit them clear of the circle
+    aruco_desc_tile = draw_aruco_desc_tile(ARUCO_DICT_TYPE_STR, aruco_idx, aruco_length, dpi)
+    star_desc_tile = draw_siemens_star_desc_tile(star_cycles, lpmm_range, star_diameter, dpi)
+    aruco_desc_tile = center_crop_pad_to(aruco_desc_tile, star_pix, 1, 255)[:,:,0]
+    star_desc_tile = center_crop_pad_to(star_desc_tile, star_pix, 1, 255)[:,:,0]
+    # star next to the marker
+    top_h = max(star_pix, aruco_pix)
+    bottom_gap = max(gap_pix, aruco_desc_tile.shape[0] + star_desc_tile.shape[0])
+    total_w = star_pix + gap_pix + aruco_pix
+    layout = ChartLayout(total_w, top_h + bottom_gap + bw_h, dpi=dpi)
+
+    ### Tiles
+    layout.add(SiemensStarTile(0, 0, star_cycles, star_pix, center_ratio, kernel))
+    # ArUco marker
+    layout.add(BitGridTile(star_pix+gap_pix, 0, draw_aruco_bit_grid(aruco_dict_type, aruco_idx),
+                           aruco_pix, aruco_pix))
+    layout.add(ArrayTile(0, top_h+bottom_gap-aruco_desc_tile.shape[0], aruco_desc_tile))
+    layout.add(ArrayTile(0, top_h+bottom_gap-aruco_desc_tile.shape[0]-star_desc_tile.shape[0], star_desc_tile))
+    # black/white side tile
+    layout.add(RowProfileTile(0, top_h+bottom_gap, draw_bw_ref_profile(total_w), bw_h))
+
+    ### data file
+    meta_dict = {}
+
+    # total image height and width
+    meta_dict['hw_pix'] = [layout.h, layout.w]
+    meta_dict['hw_mm'] = pixels_to_mm(np.array(meta_dict['hw_pix']), dpi).tolist()
+
+    # aruco marker location and size
+    meta_dict['aruco_idx'] = aruco_idx
+    meta_dict['aruco_xywhr'] = [star_pix+gap_pix, 0,
+                                aruco_pix, aruco_pix,
+                                0]
+    meta_dict['aruco_width_mm'] = pixels_to_mm(aruco_pix, dpi)
+
+    # star location and size, its bounding square, and how it is drawn
+    meta_dict['star_xywhr'] = [0, 0, star_pix, star_pix, 0]
+    meta_dict['star_cycles'] = star_cycles
+    meta_dict['star_center_ratio'] = center_ratio
+    meta_dict['star_kernel'] = kernel
+    meta_dict['star_lpmm_range'] = lpmm_range
+
+    # bw_ref chart location, below the top row and the gap
+    meta_dict['bw_xywhr'] = [0, top_h+bottom_gap,
+                             total_w, bw_h,
+                             0]
+
+    return layout, meta_dict
+
+def three_bar_target_layout(lw_list, mid_num, dpi, *,
+                            center=False, tightness=0):
+    """
+    Layout of three_bar_target, args are the same
+    Resolution elements are small boolean arrays, painted black as masks on white
+    """
+    sf = 1/dpi_to_pp(dpi) # scale factor, pixels per mm. A float
+    P_list = [resolution_element(lw, sf) for lw in lw_list] # pattern list
+
+    # element locations within each series, as tile_resolution_elements
+    def series_yx(PL):
+        yx_list = [(0, 0)]
+        y = PL[0].shape[0]
+        for P in PL[1:]:
+            y += 2*P.shape[0]//5
+            yx_list.append((y, 0))
+            y += P.shape[0]
+        return yx_list, (y, PL[0].shape[1])
+    yx1_list, (H1, W1) = series_yx(P_list[:mid_num])
+    yx2_list, (H2, W2) = series_yx(P_list[mid_num:])
+
+    # first series cropped by tightness, second rotated by 180 degrees at its bottom-right corner
+    tightness_pix = int(np.round(tightness*sf))
+    w = W1 - tightness_pix
+    tgt_w = max(H1, w)
+    tp, lp = ((tgt_w-H1)//2, (tgt_w-w)//2) if center else (0, 0)
+    fw = int(lw_list[0]*sf)
+    layout = ChartLayout(tgt_w + 2*fw, tgt_w + 2*fw, dpi=dpi)
+    for (y, x), P in zip(yx1_list, P_list[:mid_num]):
+        layout.add(ArrayTile(fw+lp+x, fw+tp+y, P[:, :max(0, w-x)], mask=True, value=0))
+    for (y, x), P in zip(yx2_list, P_list[mid_num:]):
+        h2, w2 = P.shape
+        layout.add(ArrayTile(fw+lp+w-W2+(W2-x-w2), fw+tp+H1-H2+(H2-y-h2), np.rot90(P, 2), mask=True, value=0))
+    return layout
@@ -69,14 +69,18 @@ def remove_bezel(arr, bezel_ratio=0.1, dims=None):
 ##############################
 ### intensity reference
 ##############################
-def draw_bw_ref_tile(width, height):
-    # width and height in pixels
+def draw_bw_ref_profile(width):
+    # one row of the bw reference tile, width in pixels
     head_w = np.round(width/4).astype(int)
     y_list = np.concatenate([np.zeros(head_w, dtype=float), 
                              np.linspace(0, 1, width-2*head_w),
                              np.ones(head_w, dtype=float)
                             ])
-    y_list = np.round(y_list*255.0).astype(np.uint8)
+    return np.round(y_list*255.0).astype(np.uint8)
+
+def draw_bw_ref_tile(width, height):
+    # width and height in pixels
+    y_list = draw_bw_ref_profile(width)
     canvas = np.tile(y_list, (height, 1))
     return cv.cvtColor(canvas, cv.COLOR_GRAY2BGR)
 
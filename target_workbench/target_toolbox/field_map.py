@@ -0,0 +1,153 @@
+import time
+import numpy as np
+import cv2 as cv
+
+from .common import draw_multiline_text
+
+##############################
+### field dependent MTF map
+##############################
+class FieldMtfMap():
+    """
+    MTF across the image field, accumulated from the charts seen in one or many frames
+    The field is split into bins of bin_pix pixels. Each chart's MTF is splatted bilinearly
+    at its sine block center into a weighted sum grid and a weight grid, per lpmm.
+    Adding a chart touches 4 bins, whatever the history length.
+    The map is interpolated by normalized convolution, a Gaussian blur of the sum grid divided by
+    the blur of the weight grid, on the small bin grid only when drawn.
+    The upsampled heatmap is kept until the map or the drawing arguments change.
+    """
+    def __init__(self, img_wh, bin_pix=64, sigma_bins=1.5, decay=None):
+        """
+        img_wh: (w, h) of the frames the charts are found in
+        bin_pix: bin size in pixels
+        sigma_bins: Gaussian sigma of the interpolation, in bins
+        decay: if not None, the weight of past charts is multiplied by it on every new_frame(),
+               e.g. 0.99 to let the map follow a changing lens. Default keep all
+        """
+        self.img_wh = tuple(img_wh)
+        self.bin_pix = bin_pix
+        self.sigma_bins = sigma_bins
+        self.decay = decay
+        self.grid_wh = (int(np.ceil(img_wh[0] / bin_pix)), int(np.ceil(img_wh[1] / bin_pix)))
+        self.reset()
+
+    def reset(self):
+        self.sum_dict = {} # lpmm -> weighted MTF sum grid
+        self.weight_dict = {} # lpmm -> weight grid
+        self.chart_count = 0
+        self.version = 0 # bumped on every change, invalidates the heatmap cache
+        self._heat_cache = None
+
+    def new_frame(self):
+        """
+        Apply the decay, if any, call once per frame before adding its charts
+        """
+        if self.decay is None:
+            return
+        for lpmm in self.sum_dict:
+            self.sum_dict[lpmm] *= self.decay
+            self.weight_dict[lpmm] *= self.decay
+        self.version += 1
+
+    def _bilinear(self, xy):
+        """
+        Bin indices and weights of a point, bin centers at (i+0.5)*bin_pix
+        """
+        gw, gh = self.grid_wh
+        fx = np.clip(xy[0] / self.bin_pix - 0.5, 0, gw - 1)
+        fy = np.clip(xy[1] / self.bin_pix - 0.5, 0, gh - 1)
+        x0, y0 = min(int(fx), gw - 2) if gw > 1 else 0, min(int(fy), gh - 2) if gh > 1 else 0
+        ax, ay = fx - x0, fy - y0
+        idx_list = [(y0, x0), (y0, x0 + 1), (y0 + 1, x0), (y0 + 1, x0 + 1)]
+        w_list = [(1 - ay)*(1 - ax), (1 - ay)*ax, ay*(1 - ax), ay*ax]
+        return [(idx, w) for idx, w in zip(idx_list, w_list) if idx[0] < gh and idx[1] < gw and w > 0]
+
+    def add(self, sine_corner_list, lpmm_list, mtf_list, weight=1.0):
+        """
+        Add the MTF of one chart, located by its sine block corners in frame coordinates
+        """
+        splat = self._bilinear(np.asarray(sine_corner_list, dtype=float).mean(0))
+        gw, gh = self.grid_wh
+        for lpmm, mtf in zip(lpmm_list, mtf_list):
+            lpmm = float(lpmm)
+            if not lpmm in self.sum_dict:
+                self.sum_dict[lpmm] = np.zeros((gh, gw))
+                self.weight_dict[lpmm] = np.zeros((gh, gw))
+            for idx, w in splat:
+                self.sum_dict[lpmm][idx] += weight * w * mtf
+                self.weight_dict[lpmm][idx] += weight * w
+        self.chart_count += 1
+        self.version += 1
+
+    @property
+    def lpmm_list(self):
+        return sorted(self.sum_dict.keys())
+
+    def interpolate(self, lpmm):
+        """
+        Return the MTF grid and its confidence grid (blurred weight, 0-1, 1 where a chart sits) at lpmm,
+        both grid_wh sized, None if lpmm never added
+        """
+        if not float(lpmm) in self.sum_dict:
+            return None
+        ksize = 2*int(np.ceil(3*self.sigma_bins)) + 1
+        blur = lambda grid: cv.GaussianBlur(grid, (ksize, ksize), self.sigma_bins, borderType=cv.BORDER_CONSTANT)
+        s, w = blur(self.sum_dict[float(lpmm)]), blur(self.weight_dict[float(lpmm)])
+        mtf = np.divide(s, w, out=np.zeros_like(s), where=w > 1e-9)
+        peak = blur(np.pad(np.ones((1, 1)), ksize//2))[ksize//2, ksize//2] # blurred weight of one bin
+        return mtf, np.clip(w / peak, 0, 1)
+
+    def draw(self, img, lpmm, scale=1.0, alpha=0.5, min_confidence=0.05, mtf_range=(0.0, 1.0),
+             colormap=cv.COLORMAP_JET, min_interval=0.0):
+        """
+        Blend the MTF map at lpmm over img as a heatmap, with a legend at the top-right corner
+        img: HxWx3 uint8 image, frame coordinates times scale, e.g. a downscaled display image
+        Areas of confidence below min_confidence are left out, the blending fades in with confidence
+        mtf_range: MTF mapped to the ends of the colormap
+        min_interval: seconds, a map changed since the last draw is only redrawn after this long,
+                      e.g. when charts are added every frame
+        """
+        h, w = img.shape[:2]
+        key = (float(lpmm), w, h, scale, alpha, min_confidence, tuple(mtf_range), colormap)
+        now = time.perf_counter()
+        if self._heat_cache is None or self._heat_cache[0] != key \
+           or (self._heat_cache[1] != self.version and now - self._heat_cache[2] >= min_interval):
+            result = self._upsampled_heat(lpmm, w, h, scale, alpha, min_confidence, mtf_range, colormap)
+            if result is None:
+                return img
+            self._heat_cache = (key, self.version, now, *result)
+        heat, a, a_inv = self._heat_cache[3:]
+        img[:] = cv.blendLinear(img, heat, a_inv, a)
+        # legend
+        lo, hi = mtf_range
+        bar_h, bar_w = max(h//4, 20), max(w//80, 6)
+        bar = cv.applyColorMap(np.linspace(255, 0, bar_h).astype(np.uint8)[:, None].repeat(bar_w, 1), colormap)
+        x0, y0 = w - 2*bar_w, h//20
+        img[y0:y0+bar_h, x0:x0+bar_w] = bar
+        text_list = ['{:.2f}'.format(hi), '{:.3g} lp/mm'.format(lpmm), '{} charts'.format(self.chart_count),
+                     '{:.2f}'.format(lo)]
+        img = draw_multiline_text(img, text_list, (x0 - bar_h*0.9, y0), bar_h*0.8)
+        return img
+
+    def _upsampled_heat(self, lpmm, w, h, scale, alpha, min_confidence, mtf_range, colormap):
+        """
+        Return the heatmap and blending weights of draw(), image sized, None if lpmm never added
+        """
+        result = self.interpolate(lpmm)
+        if result is None:
+            return None
+        mtf, conf = result
+        # colors and blending weights on the bin grid, then upsampled, 
+        # the grid covers bin_pix*grid_wh of the frame, the image covers scale*img_wh
+        lo, hi = mtf_range
+        heat = cv.applyColorMap(np.clip((mtf - lo) / (hi - lo) * 255, 0, 255).astype(np.uint8), colormap)
+        a = (alpha * np.where(conf >= min_confidence, conf, 0)).astype(np.float32)
+        grid_w, grid_h = [int(np.round(n * self.bin_pix * scale)) for n in self.grid_wh]
+        heat = cv.resize(heat, (grid_w, grid_h), interpolation=cv.INTER_LINEAR)
+        a = cv.resize(a, (grid_w, grid_h), interpolation=cv.INTER_LINEAR)
+        # the last bins run past the frame, or rounding falls short of it
+        pad = ((0, max(h - grid_h, 0)), (0, max(w - grid_w, 0)))
+        heat = np.pad(heat[:h, :w], pad + ((0, 0),), mode='edge')
+        a = np.pad(a[:h, :w], pad, mode='edge')
+        return heat, a, 1 - a
@@ -0,0 +1,177 @@
+import numpy as np
+import cv2 as cv
+from .common import mm_to_pixels
+
+##############################
+### star generation
+##############################
+def _footprint_response(w, kernel='box'):
+    """
+    Attenuation of a sine of angular frequency w (rad/pixel) by the pixel footprint kernel, 1 at w = 0
+    kernel: 'box', the area of the pixel, or 'gaussian', std 0.5/3 as the sine tiles' subpixels.
+            The Gaussian is not truncated, within 3e-3 of _subpix_sine_response up to Nyquist, 
+            without its complex erf
+    """
+    w = np.abs(w)
+    if kernel == 'box': # |(e^(iw) - 1) / (iw)|
+        return np.abs(np.sinc(w/(2*np.pi)))
+    elif kernel == 'gaussian':
+        return np.exp(-(w*0.5/3)**2/2)
+    else:
+        raise ValueError('Unknown kernel {}'.format(kernel))
+
+def star_center_radius(cycles, diameter_pix, center_ratio=0.1, min_period_pix=2):
+    """
+    Radius in pixels of the gray disc at the star center,
+    center_ratio of the star radius, but at least where the period along the ring is min_period_pix
+    """
+    return max(center_ratio*diameter_pix/2, cycles*min_period_pix/(2*np.pi))
+
+def draw_siemens_star_region(cycles, diameter_pix, r0, r1, c0, c1, center_ratio=0.1, kernel='box', background=255):
+    """
+    Rows r0:r1, columns c0:c1 of a sinusoidal Siemens star in a diameter_pix square, as a uint8 array
+    The intensity is 0.5 + 0.5*sin(cycles*theta), no supersampling.
+    Around a pixel the star is locally a plane wave, its wave vector the gradient of cycles*theta,
+    so integrating it over the pixel footprint only scales the amplitude,
+    by the footprint's response to each axis's frequency, in closed form.
+    The gray center disc and the outer circle get one pixel wide coverage ramps.
+    """
+    d = diameter_pix
+    y = (np.arange(r0, r1) + 0.5 - d/2)[:, None]
+    x = (np.arange(c0, c1) + 0.5 - d/2)[None, :]
+    r = np.maximum(np.hypot(x, y), 1e-9)
+    # d(cycles*theta)/dx = -cycles*y/r^2, d/dy = cycles*x/r^2
+    amp = _footprint_response(cycles*y/(r*r), kernel) * _footprint_response(cycles*x/(r*r), kernel)
+    amp *= np.clip(r - star_center_radius(cycles, d, center_ratio) + 0.5, 0, 1)
+    value = (0.5 + 0.5*amp*np.sin(cycles*np.arctan2(y, x))) * 255.0
+    inside = np.clip(d/2 - r + 0.5, 0, 1)
+    value = value*inside + background*(1 - inside)
+    return np.round(value).astype(np.uint8)
+
+def draw_siemens_star(cycles, diameter, dpi, center_ratio=0.1, kernel='box'):
+    """
+    Draw a sinusoidal Siemens star on white
+    Args:
+        cycles (int): amount of sine periods around the star
+        diameter (float): star diameter in mm
+        dpi (float): dots per inch, easier to work with printers
+        center_ratio (float): diameter ratio of the gray center disc, where the periods are too
+                              small to draw anyway. Enlarged if needed to keep 2 pixels per period
+        kernel (str): pixel footprint of the anti-aliasing, 'box' or 'gaussian', see _footprint_response
+    The spatial frequency at radius r mm is cycles/(2*pi*r) lp/mm
+    """
+    d = int(mm_to_pixels(diameter, dpi))
+    star = draw_siemens_star_region(cycles, d, 0, d, 0, d, center_ratio, kernel)
+    return cv.cvtColor(star, cv.COLOR_GRAY2BGR)
+
+def star_lpmm_range(cycles, diameter_pix, pp, center_ratio=0.1, margin=0.1):
+    """
+    Spatial frequencies in lp/mm covered by a star, between the outer circle and the center disc,
+    both pulled in by margin of their radius, clear of their edges
+    pp: pixel pitch in mm
+    """
+    r_out = diameter_pix/2 * pp * (1 - margin)
+    r_in = star_center_radius(cycles, diameter_pix, center_ratio) * pp * (1 + 2*margin)
+    return [cycles/(2*np.pi*r_out), cycles/(2*np.pi*r_in)]
+
+def draw_siemens_star_desc_tile(cycles, lpmm_range, length, dpi):
+    # parse edge pixel length
+    side_pixels = mm_to_pixels(length, dpi)
+
+    # make description tile
+    desc_str = 'Siemens star: {:d} cycles, {:.2f}-{:.2f} lp/mm'.format(cycles, *lpmm_range)
+    text_canvas_height = np.round(side_pixels * 0.06).astype(int)
+    text_canvas = np.full((text_canvas_height, side_pixels, 3),
+                          255, np.uint8)
+    cv.putText(text_canvas, desc_str,
+               (np.round(side_pixels*0.03).astype(int), np.round(text_canvas_height*0.72).astype(int)),
+               cv.FONT_HERSHEY_SIMPLEX, side_pixels*0.0012,
+               (0,0,0), np.round(side_pixels*0.003).astype(int), cv.LINE_AA, False)
+
+    return text_canvas
+
+##############################
+### radial MTF
+##############################
+def star_ring_radii(cycles, lpmm_range, pp, lpmm_amount=32, ring_amount=8):
+    """
+    Rings to sample a star at, lpmm_amount bins evenly spaced over lpmm_range, ring_amount rings per bin
+    pp: pixel pitch of the star in mm
+    Return the center lpmm of each bin, and a lpmm_amount x ring_amount array of ring radii in pixels
+    """
+    edges = np.linspace(lpmm_range[0], lpmm_range[1], lpmm_amount+1)
+    lpmm_list = (edges[:-1] + edges[1:]) / 2
+    lpmm_rings = edges[:-1, None] + (np.arange(ring_amount) + 0.5)/ring_amount * np.diff(edges)[:, None]
+    return lpmm_list, cycles/(2*np.pi*lpmm_rings) / pp
+
+def star_print_attenuation(cycles, radii, kernel='box', angle_amount=64):
+    """
+    Amplitude of the drawn star at ring radii (pixels), relative to the ideal star,
+    averaged around the ring, see draw_siemens_star_region. Close to 1 but for rings near the center
+    """
+    phi = (np.arange(angle_amount) + 0.5) * 2*np.pi/angle_amount
+    w = cycles / np.asarray(radii, dtype=float)[..., None]
+    return (_footprint_response(w*np.sin(phi), kernel) * _footprint_response(w*np.cos(phi), kernel)).mean(-1)
+
+def estimate_mtf_from_star_rings(ring_array, cycles, diff_mode=0.5, attenuation=None):
+    """
+    ring_array: K x M x A array, K frequency bins of M rings each,
+                A samples evenly spaced in angle around each ring, starting at angle 0
+    cycles: amount of sine periods around the star
+    diff_mode: half the white-black difference, as estimate_comm_diff_from_bw_tile, in ring_array's scale
+    attenuation: K x M amplitude of the drawn star at each ring, e.g. star_print_attenuation, or None for 1
+    Every ring is projected onto e^(-i*cycles*phi), one matrix product for all rings.
+    The star has the same phase on every ring, so the rings of a bin are averaged as complex amplitudes,
+    which cancels noise instead of adding its power. Return the MTF of the K bins
+    """
+    A = ring_array.shape[-1]
+    basis = np.exp(-2j*np.pi*cycles*np.arange(A)/A)
+    coef = (ring_array @ basis) * (2/A)
+    if attenuation is not None:
+        coef = coef / attenuation
+    return np.abs(coef.mean(-1)) / diff_mode
+
+def estimate_star_center_offset(ring_array, radii, cycles, sector_amount=8, min_amplitude_ratio=0.2, ring_mask=None):
+    """
+    Offset of the ring center from the star center, in the units of radii
+    Rings around a point off the star center by (dx, dy) see the star phase shifted by
+    cycles/r*(-dx*sin(phi) + dy*cos(phi)) at angle phi, so the phase of each sector of a ring,
+    against the ring's own phase, gives the offset by least squares over all sectors and rings,
+    weighted by the ring amplitude. Rings below min_amplitude_ratio of the largest amplitude are left out
+    ring_array: K x M x A array as estimate_mtf_from_star_rings, radii: K x M
+    sector_amount: sectors per ring, of A // sector_amount or one more samples each
+    ring_mask: K x M bool array of the rings to use, or None for all. Rings near or above the Nyquist
+               frequency of the frame are aliased, their phase is not the star's, and must be left out
+    Return None if no ring is usable
+    """
+    A = ring_array.shape[-1]
+    basis = np.exp(-2j*np.pi*cycles*np.arange(A)/A)
+    sector_start = np.arange(sector_amount) * A // sector_amount
+    coef = np.add.reduceat(ring_array * basis, sector_start, axis=-1)
+    coef_ring = coef.sum(-1, keepdims=True)
+    weight = np.abs(coef_ring)[..., 0]**2
+    if ring_mask is not None:
+        weight[~np.asarray(ring_mask, dtype=bool)] = 0
+    if weight.max() <= 0:
+        return None
+    weight[weight < min_amplitude_ratio**2*weight.max()] = 0
+    # phase of each sector against its ring, in radians of the star angle
+    y = np.angle(coef * np.conj(coef_ring)) * np.asarray(radii)[..., None] / cycles
+    phi = (sector_start + np.diff(np.append(sector_start, A))/2) * 2*np.pi/A
+    # sin and cos of the sectors are orthogonal, the least squares is a projection
+    w = weight[..., None] / weight.sum()
+    dx = -2/sector_amount * (w*y*np.sin(phi)).sum()
+    dy = 2/sector_amount * (w*y*np.cos(phi)).sum()
+    return dx, dy
+
+def mtf50_from_curve(lpmm_list, mtf_list, level=0.5):
+    """
+    The first lpmm the MTF curve falls to level, linearly interpolated, None if it does not
+    """
+    mtf_list = np.asarray(mtf_list, dtype=float)
+    below = np.flatnonzero(mtf_list < level)
+    if len(below) == 0 or below[0] == 0:
+        return None
+    a = below[0]
+    t = (mtf_list[a-1] - level) / (mtf_list[a-1] - mtf_list[a])
+    return float(lpmm_list[a-1] + t*(lpmm_list[a] - lpmm_list[a-1]))
@@ -2,17 +2,34 @@ import warnings
 import numpy as np
 import cv2 as cv
 from scipy.stats import norm as sp_norm
+from scipy.special import erf
 from .common import mm_to_pixels, center_crop_pad_to
 
-def draw_sine_tile(lpmm, length, height, dpi, subpix_amount=101, scale_to_full=True):
+def _subpix_sine_response(period_pix, kernel='gaussian'):
     """
-    Draw a sine pattern tile with certain length, height, and line pair per mm
-    Args:
-        lpmm (float): line pair per mm
-        length, height (float): tile length and height in mm
-        dpi (float): dots per inch, easier to work with printers
-        subpix_amount (int): how many subpixels to integrate to form one pixel. Better to be odd.
-        scale_to_full (bool): whether scaling the output to 0-255
+    Complex response c of the pixel footprint kernel to sin(x/period_pix*2*pi), 
+    so that integrating the kernel over pixel x gives Im(c * e^(i*x/period_pix*2*pi))
+    kernel: 'gaussian', the truncated Gaussian over [0, 1) used by the subpixel path, 
+                        mean 0.5, std 0.5/3, not normalized, as the subpixel sum is divided by amount
+            'box', the plain integral over [0, 1)
+    """
+    w = 2*np.pi/period_pix
+    if kernel == 'gaussian':
+        mu, sigma = 0.5, 0.5/3
+        # integral of N(t; mu, sigma) e^(iwt) over [0, 1), erf of complex argument
+        z1 = ((1-mu)/sigma - 1j*sigma*w) / np.sqrt(2)
+        z0 = ((0-mu)/sigma - 1j*sigma*w) / np.sqrt(2)
+        return np.exp(1j*w*mu - (sigma*w)**2/2) * (erf(z1) - erf(z0)) / 2
+    elif kernel == 'box':
+        return (np.exp(1j*w) - 1) / (1j*w)
+    else:
+        raise ValueError('Unknown kernel {}'.format(kernel))
+
+def draw_sine_profile(lpmm, length, dpi, subpix_amount=101, scale_to_full=True, 
+                      method='analytic', kernel='gaussian'):
+    """
+    Draw one row of a sine pattern tile, a uint8 array of length in pixels
+    Args are the same as draw_sine_tile
     """
     # check subpix
     if not (subpix_amount<=1 or subpix_amount%2 == 1):
@@ -21,26 +38,31 @@ def draw_sine_tile(lpmm, length, height, dpi, subpix_amount=101, scale_to_full=T
     period = 1/lpmm
     if not length >= 10*period:
         warnings.warn('Pattern length is less than 10 periods.')
-    if not height >= 2*period:
-        warnings.warn('Pattern height is less than 2 periods.')
     
     # parse image size and period in pixels
     length_pix = mm_to_pixels(length, dpi)
-    height_pix = mm_to_pixels(height, dpi)
     period_pix = mm_to_pixels(period, dpi)
+    if not period_pix >= 2:
+        warnings.warn('Period is less than 2 pixels, cannot be drawn.')
     
     # calculate sine wave values
     x_list = np.arange(length_pix)
     # no sub-pixels
     if subpix_amount <= 1:
         y_list = np.sin(x_list/period_pix*2*np.pi)
-    # with sub-pixels
-    else:
+    # with sub-pixels, closed form
+    elif method == 'analytic':
+        c = _subpix_sine_response(period_pix, kernel)
+        y_list = np.abs(c) * np.sin(x_list/period_pix*2*np.pi + np.angle(c))
+    # with sub-pixels, summing them
+    elif method == 'supersample':
         subpix_offset_list = np.linspace(0, 1, 2*subpix_amount+1)[1::2]
         subpix_weight_list = sp_norm.pdf(subpix_offset_list, 0.5, 0.5/3)
         subpix_x_array = np.stack([x_list+offset for offset in subpix_offset_list], 0)
         y_array = np.sin(subpix_x_array/period_pix*2*np.pi)
         y_list = (y_array * subpix_weight_list[:,None]).sum(0) / subpix_amount
+    else:
+        raise ValueError('Unknown method {}'.format(method))
     y_list = (y_list + 1) / 2
     
     # scale to 0-1 if needed
@@ -48,8 +70,32 @@ def draw_sine_tile(lpmm, length, height, dpi, subpix_amount=101, scale_to_full=T
         y_list = (y_list-y_list.min())/(y_list.max()-y_list.min())
     y_list = np.clip(y_list, 0, 1)
     
+    # to uint8
+    return np.round(y_list*255.0).astype(np.uint8)
+
+def draw_sine_tile(lpmm, length, height, dpi, subpix_amount=101, scale_to_full=True, 
+                   method='analytic', kernel='gaussian'):
+    """
+    Draw a sine pattern tile with certain length, height, and line pair per mm
+    Args:
+        lpmm (float): line pair per mm
+        length, height (float): tile length and height in mm
+        dpi (float): dots per inch, easier to work with printers
+        subpix_amount (int): how many subpixels to integrate to form one pixel. Better to be odd.
+                             For 'analytic', any value above 1 means integrating the kernel exactly
+        scale_to_full (bool): whether scaling the output to 0-255
+        method (str): 'analytic', integrates the sine over each pixel in closed form, O(length)
+                      'supersample', the original path, sums subpix_amount subpixels per pixel,
+                                     kept as reference, see tests/test_sine_chart.py
+        kernel (str): pixel footprint for 'analytic', 'gaussian' matches 'supersample', or 'box'
+    """
+    # check size
+    if not height >= 2/lpmm:
+        warnings.warn('Pattern height is less than 2 periods.')
+    height_pix = mm_to_pixels(height, dpi)
+    
     # draw the sine_wave pattern to uint8
-    y_list = np.round(y_list*255.0).astype(np.uint8)
+    y_list = draw_sine_profile(lpmm, length, dpi, subpix_amount, scale_to_full, method, kernel)
     sine_tile = np.tile(y_list, (height_pix, 1))
     
     # return
@@ -0,0 +1,99 @@
+import os
+import sys
+import numpy as np
+import cv2 as cv
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from target_toolbox.aruco_sine_chart import generate_aruco_sine_chart_meta, extract_sine_and_bw_tiles, \
+    estimate_comm_diff_from_bw_tile, estimate_mtf_from_sine_tile, estimate_mtf_from_sine_tiles
+from target_toolbox.aruco_marker import ARUCO_DICT_TYPE
+from target_toolbox.common import mm_to_pixels, dpi_to_pp
+from target_toolbox.sine_chart import draw_sine_tile
+
+@pytest.fixture(scope='module')
+def sine_chart():
+    return generate_aruco_sine_chart_meta(5, 20, [1, 2, 4, 6], 25, 5, 10, dpi=600)
+
+def _render(chart, angle, scale, shift, sigma=1.0):
+    """
+    The chart rotated, scaled and shifted into a 1600x1200 frame, blurred by sigma pixels
+    """
+    gray = chart[:,:,0]
+    H = cv.getRotationMatrix2D((gray.shape[1]/2, gray.shape[0]/2), angle, scale)
+    H[:,2] += shift
+    frame = cv.warpAffine(gray, H, (1600, 1200), flags=cv.INTER_AREA, borderValue=200)
+    return cv.GaussianBlur(frame, (0,0), sigma)
+
+def _detect(frame):
+    detector = cv.aruco.ArucoDetector(cv.aruco.getPredefinedDictionary(ARUCO_DICT_TYPE), cv.aruco.DetectorParameters())
+    corners, ids, _ = detector.detectMarkers(frame)
+    assert ids is not None and len(ids) == 1
+    return corners[0].reshape(4,2)
+
+##############################
+### tile extraction
+##############################
+@pytest.mark.parametrize('interp_flag', [cv.INTER_LINEAR, cv.INTER_CUBIC, cv.INTER_LANCZOS4])
+@pytest.mark.parametrize('angle, scale, shift', [(7, 0.6, (300, 250)), (-20, 0.8, (200, 300)), (0, 0.5, (-200, 100))])
+def test_roi_local_tiles(sine_chart, interp_flag, angle, scale, shift):
+    chart, meta = sine_chart
+    frame = _render(chart, angle, scale, shift)
+    aruco_corner_list = _detect(frame)
+    whole_list, pp_list, lpmm_list = extract_sine_and_bw_tiles(frame, aruco_corner_list, meta, interp_flag=interp_flag)
+    roi_list, roi_pp_list, _ = extract_sine_and_bw_tiles(frame, aruco_corner_list, meta, interp_flag=interp_flag,
+                                                         roi_local=True)
+    assert pp_list == roi_pp_list
+    for whole, roi in zip(whole_list, roi_list):
+        assert whole.shape == roi.shape
+        # not bit-exact, the ROI offset changes the rounding of few sampling coordinates
+        assert np.abs(whole.astype(int) - roi).max() <= 1
+        assert (whole != roi).mean() < 0.01
+
+##############################
+### MTF estimation
+##############################
+@pytest.mark.parametrize('angle, scale, sigma', [(0, 1, 1.0), (7, 0.6, 1.5), (-20, 0.8, 0.8)])
+def test_batched_mtf(sine_chart, angle, scale, sigma):
+    chart, meta = sine_chart
+    frame = _render(chart, angle, scale, (300, 250), sigma)
+    tile_list, pp_list, lpmm_list = extract_sine_and_bw_tiles(frame, _detect(frame), meta)
+    comm_mode, diff_mode = estimate_comm_diff_from_bw_tile(tile_list[-1].astype(float)/255.0)
+    # uint8 tiles with comm/diff mode scaled, as analyze_aruco_sine_chart
+    single_mtf = [estimate_mtf_from_sine_tile(tile, lpmm, pp, comm_mode*255.0, diff_mode*255.0)
+                  for tile, lpmm, pp in zip(tile_list[:-1], lpmm_list, pp_list[:-1])]
+    batched_mtf = estimate_mtf_from_sine_tiles(tile_list[:-1], lpmm_list, pp_list[:-1], 
+                                               comm_mode*255.0, diff_mode*255.0)
+    assert len(batched_mtf) == len(single_mtf)
+    np.testing.assert_allclose(batched_mtf, single_mtf, atol=1e-3)
+
+def _synthetic_sine_tile(lpmm, dpi, blur_sigma, angle_deg, noise_std, length=25, height=5, seed=0):
+    """
+    A draw_sine_tile tile without subpixels, amplitude exactly 0.5, blurred by a Gaussian of blur_sigma pixels,
+    rotated by angle_deg and added with Gaussian noise of noise_std (0-1 scale)
+    Return the tile, its lpmm as drawn (draw_sine_tile rounds the period) and its true MTF
+    """
+    tile = draw_sine_tile(lpmm, length, height, dpi, subpix_amount=1, scale_to_full=False)
+    tile = tile[:,:,0].astype(float)/255.0
+    period_pix = mm_to_pixels(1/lpmm, dpi)
+    tile = cv.GaussianBlur(tile, (0, 0), blur_sigma, borderType=cv.BORDER_REFLECT)
+    if angle_deg != 0:
+        H = cv.getRotationMatrix2D((tile.shape[1]/2, tile.shape[0]/2), angle_deg, 1)
+        tile = cv.warpAffine(tile, H, tile.shape[::-1], flags=cv.INTER_CUBIC, borderMode=cv.BORDER_REFLECT)
+    tile = tile + np.random.default_rng(seed).normal(0, noise_std, tile.shape)
+    return tile, 1/(period_pix*dpi_to_pp(dpi)), np.exp(-2*np.pi**2 * blur_sigma**2 / period_pix**2)
+
+@pytest.mark.parametrize('angle_deg, noise_std', [(0, 0), (0, 0.02), (3, 0), (6, 0.02)])
+@pytest.mark.parametrize('lpmm', [1, 2, 4, 6])
+def test_dft_matches_fft(lpmm, angle_deg, noise_std, dpi=1200, blur_sigma=1.5):
+    tile, true_lpmm, true_mtf = _synthetic_sine_tile(lpmm, dpi, blur_sigma, angle_deg, noise_std)
+    pp = dpi_to_pp(dpi)
+    fft_mtf = estimate_mtf_from_sine_tile(tile, true_lpmm, pp, 0.5, 0.5, method='fft')
+    # searching every bin of the window is the same sum as the FFT's
+    dft_mtf = estimate_mtf_from_sine_tile(tile, true_lpmm, pp, 0.5, 0.5, method='dft', dft_search=True)
+    assert abs(dft_mtf - fft_mtf) < 1e-9
+    # lpmm alone only holds the power of a tile not rotated
+    if angle_deg == 0:
+        dft_mtf = estimate_mtf_from_sine_tile(tile, true_lpmm, pp, 0.5, 0.5, method='dft', dft_search=False)
+        assert abs(dft_mtf - fft_mtf) < 1e-3
+        assert abs(fft_mtf - true_mtf) < 0.01
@@ -0,0 +1,52 @@
+import os
+import sys
+import numpy as np
+import cv2 as cv
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from target_toolbox.aruco_sine_chart import generate_aruco_star_chart_meta, analyze_aruco_star_chart
+from target_toolbox.aruco_marker import ARUCO_DICT_TYPE
+
+DPI = 300
+CYCLES = 144 # the inner rings are above Nyquist once the chart is scaled down
+
+@pytest.fixture(scope='module')
+def star_chart():
+    return generate_aruco_star_chart_meta(70, 40, CYCLES, 60, 8, dpi=DPI)
+
+def _render(chart, angle, scale, sigma, oversample=4, seed=1):
+    """
+    The chart rotated and scaled into a frame, area sampled from oversample times the frame resolution,
+    then a Gaussian blur of sigma frame pixels and some noise. The MTF of the frame is the Gaussian's
+    times the pixel's sinc
+    """
+    gray = chart[:,:,0].astype(np.float32)
+    H = cv.getRotationMatrix2D((gray.shape[1]/2, gray.shape[0]/2), angle, scale)
+    H[:,2] += (400, 450)
+    H_big = H*oversample
+    H_big[:,2] += (oversample - 1)/2
+    big = cv.warpAffine(gray, H_big, (1800*oversample, 1500*oversample), flags=cv.INTER_LINEAR, borderValue=200)
+    frame = cv.resize(big, (1800, 1500), interpolation=cv.INTER_AREA)
+    frame = cv.GaussianBlur(frame, (0,0), sigma) + np.random.default_rng(seed).normal(0, 1, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize('angle, scale, sigma', [(0, 0.85, 0.6), (10, 0.7, 0.6), (17, 0.8, 1.2), (30, 0.6, 0.8)])
+def test_star_mtf_aliased(star_chart, angle, scale, sigma):
+    chart, meta = star_chart
+    frame = _render(chart, angle, scale, sigma)
+    detector = cv.aruco.ArucoDetector(cv.aruco.getPredefinedDictionary(ARUCO_DICT_TYPE), cv.aruco.DetectorParameters())
+    corners, ids, _ = detector.detectMarkers(frame)
+    assert ids is not None and len(ids) == 1
+
+    err_list = []
+    for center_iterations in (0, 1):
+        _, lpmm_list, mtf_list = analyze_aruco_star_chart(frame, corners[0].reshape(4,2), meta,
+                                                          center_iterations=center_iterations)
+        f_img = np.array(lpmm_list) * 25.4/DPI / scale # cycles per frame pixel
+        mtf_true = np.exp(-2*np.pi**2*sigma**2*f_img**2) * np.sinc(f_img)**2
+        valid = f_img < 0.45
+        err_list.append(np.abs(np.array(mtf_list) - mtf_true)[valid].max())
+    # the aliased inner rings must not pull the center off
+    assert err_list[1] < 0.05
+    assert err_list[1] <= err_list[0] + 0.01
@@ -0,0 +1,41 @@
+import os
+import sys
+import numpy as np
+import pytest
+from scipy.stats import norm as sp_norm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from target_toolbox.common import mm_to_pixels
+from target_toolbox.sine_chart import _subpix_sine_response, draw_sine_tile
+
+LPMM_DPI_LIST = [(lpmm, dpi) for dpi in (300, 600, 1200) for lpmm in (0.5, 1, 2, 4, 8) if mm_to_pixels(1/lpmm, dpi) >= 4]
+
+def _to_255(y_list, scale_to_full):
+    """
+    Float 0-255 values before rounding, normalized as draw_sine_profile
+    """
+    y_list = (y_list + 1) / 2
+    if scale_to_full:
+        y_list = (y_list-y_list.min())/(y_list.max()-y_list.min())
+    return np.clip(y_list, 0, 1) * 255.0
+
+@pytest.mark.parametrize('scale_to_full', [True, False])
+@pytest.mark.parametrize('lpmm, dpi', LPMM_DPI_LIST)
+def test_analytic_matches_supersample(lpmm, dpi, scale_to_full, length=50, height=5, subpix_amount=101):
+    # float values, the analytic response against the summed subpixels
+    period_pix = mm_to_pixels(1/lpmm, dpi)
+    x_list = np.arange(mm_to_pixels(length, dpi))
+    c = _subpix_sine_response(period_pix)
+    y_analytic = np.abs(c) * np.sin(x_list/period_pix*2*np.pi + np.angle(c))
+    subpix_offset_list = np.linspace(0, 1, 2*subpix_amount+1)[1::2]
+    subpix_weight_list = sp_norm.pdf(subpix_offset_list, 0.5, 0.5/3)
+    y_array = np.sin(np.add.outer(subpix_offset_list, x_list)/period_pix*2*np.pi)
+    y_super = (y_array * subpix_weight_list[:,None]).sum(0) / subpix_amount
+    max_lsb = np.abs(_to_255(y_analytic, scale_to_full) - _to_255(y_super, scale_to_full)).max()
+    assert max_lsb < 1
+
+    # uint8 tiles, only rounding may differ
+    analytic = draw_sine_tile(lpmm, length, height, dpi, subpix_amount, scale_to_full, method='analytic')
+    supersample = draw_sine_tile(lpmm, length, height, dpi, subpix_amount, scale_to_full, method='supersample')
+    assert analytic.shape == supersample.shape
+    assert np.abs(analytic.astype(int) - supersample).max() <= 1